@@ -0,0 +1,97 @@
+# benchmark of the time it takes to import the helper files, each in a new python process
+# run from the top folder of the repository:
+#     python benchmarks/import_time.py
+# it fails (exit code 1) if a module on the read and calibrate path imports a heavy package,
+# eg scipy or plotly, which should only be imported when fitting or plotting
+
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules a worker needs for reading and calibrating, which must stay light
+LIGHT_MODULES = [
+    "helper_files.read_data",
+    "helper_files.read_header",
+    "helper_files.calibration",
+    "helper_files.spectrum_dict",
+    "helper_files.spectrum_collection",
+    "helper_files.batch_calibration",
+    "helper_files.saving_json",
+    "helper_files.streaming",
+    "helper_files.roi",
+    "helper_files.gaussian_fitting",
+    "helper_files.plotting",
+]
+
+# the packages which must not be imported by the light modules
+HEAVY_PACKAGES = ["scipy", "plotly", "pandas", "matplotlib"]
+
+# printing which heavy packages are imported, after importing the module
+CHECK_CODE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = [name for name in {heavy} if name in sys.modules]
+print(seconds, ",".join(heavy))
+"""
+
+
+def import_time(module, repeat=5):
+    """
+    The best time of importing module in a new python process, and the heavy packages it imported.
+    numpy is imported before the timing starts, since all the helper files need it.
+
+    Returns
+    -------
+    tuple
+        seconds and a list of the heavy packages
+    """
+    code = "import numpy\n" + CHECK_CODE.format(module=module, heavy=HEAVY_PACKAGES)
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.split()
+        seconds = float(output[0])
+        best = seconds if best is None else min(best, seconds)
+    heavy = output[1].split(",") if len(output) > 1 else []
+    return best, heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time of the helper files, each in a new process.")
+    parser.add_argument("--repeat", type=int, default=5, help="imports of each module, the best time is used")
+    parser.add_argument(
+        "--max-ms", type=float, default=None, help="also fail if a light module takes longer than this to import"
+    )
+    parser.add_argument("--all", action="store_true", help="also time the modules which may import heavy packages")
+    args = parser.parse_args(argv)
+
+    modules = list(LIGHT_MODULES)
+    if args.all:
+        modules += ["helper_files.report", "helper_files.drift", "helper_files.spectrum_image", "helper_files.xray_lines"]
+
+    failed = []
+    print(f"{'module':<36} {'import [ms]':>12}  heavy packages")
+    for module in modules:
+        seconds, heavy = import_time(module, args.repeat)
+        print(f"{module:<36} {1000 * seconds:>12.1f}  {', '.join(heavy) or '-'}")
+        if module in LIGHT_MODULES:
+            if heavy:
+                failed.append(f"{module} imports {', '.join(heavy)}")
+            if args.max_ms is not None and 1000 * seconds > args.max_ms:
+                failed.append(f"{module} takes {1000 * seconds:.1f} ms to import, more than {args.max_ms} ms")
+
+    if failed:
+        print("\nFAILED:")
+        for message in failed:
+            print(f"\t{message}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+# benchmarks of the read, fit, calibrate, save and plot stages of helper_files
+# run from the top folder of the repository:
+#     python benchmarks/run_benchmarks.py                       # small sizes, takes less than a minute
+#     python benchmarks/run_benchmarks.py --output before.json  # saving the results
+#     python benchmarks/run_benchmarks.py --compare before.json # comparing with an earlier commit
+#     python benchmarks/run_benchmarks.py --channels 1024,16384 --peaks 1,50 --batch 1,100000
+# each benchmark reports the best time of a few runs, the throughput and the peak memory (tracemalloc)
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+# the benchmarks are run from the repository, without installing helper_files
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import DISPERSION, OFFSET, synthetic_msa_text, synthetic_spectra  # noqa: E402
+
+# the functions which are in every version of helper_files, so the benchmarks can be run on any commit
+from helper_files.calibration import calibrate_channel_width_two_peaks, channel_to_keV  # noqa: E402
+from helper_files.gaussian_fitting import fit_n_peaks_to_gaussian  # noqa: E402
+from helper_files.read_data import read_only_y_data  # noqa: E402
+from helper_files.saving_json import read_saved_spectrum_from_json, save_spectrum_to_json  # noqa: E402
+from helper_files.spectrum_dict import init_known_spectrum  # noqa: E402
+
+# the functions added later, the benchmarks of them are skipped on the commits before
+try:
+    from helper_files.background import snip_background
+except ImportError:
+    snip_background = None
+try:
+    from helper_files.calibration import Calibration, calibrate_least_squares
+except ImportError:
+    Calibration = calibrate_least_squares = None
+try:
+    from helper_files.gaussian_fitting import fit_n_peaks_to_gaussian_batch
+except ImportError:
+    fit_n_peaks_to_gaussian_batch = None
+try:
+    from helper_files.read_header import read_spectrum_file
+except ImportError:
+    read_spectrum_file = None
+try:
+    from helper_files.saving_json import read_saved_spectrum_from_npz, save_spectrum_to_npz
+except ImportError:
+    read_saved_spectrum_from_npz = save_spectrum_to_npz = None
+
+# the files read in the notebook, with the parameters the first version needs to read them
+LAB3_FILES = [
+    ("SEM_known_Cu.msa", "#SPECTRUM    : Spectral Data Starts Here", "#ENDOFDATA   : End Of Data and File", ", \n", None),
+    ("TEM_known_NiO_on_Mo_A.emsa", "#SPECTRUM    : Spectral Data Starts Here", "#ENDOFDATA   : ", "\n", ", "),
+    ("XRF_known_Cu.mca", "<<DATA>>", "<<END>>", "\n", None),
+]
+
+# the lines around the data of benchmarks/synthetic.py, after the line endings are removed
+SYNTHETIC_START = "#SPECTRUM    : Spectral Data Starts Here"
+SYNTHETIC_STOP = "#ENDOFDATA   :"
+
+
+def measure(func, repeat=3):
+    """
+    Runs func once to warm up (lazy imports, caches), then repeat times,
+    and gives the best time and the peak memory of the first timed run.
+    The prints of the helper functions are hidden.
+
+    Returns
+    -------
+    tuple
+        seconds and peak memory in bytes
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        best = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # the other runs are without tracemalloc, which slows down python code
+        for _ in range(repeat - 1):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+    return best, peak_memory
+
+
+def spectrum_dict(counts, params=None):
+    """A calibrated spectrum dictionary of synthetic counts, for the save and plot benchmarks."""
+    channel = np.arange(len(counts))
+    s = {
+        "name": "synthetic",
+        "filepath": "synthetic.msa",
+        "channel": channel,
+        "intensity": counts / counts.max(),
+        "counts": counts,
+        "peaks_keV": None,
+        "peaks_names": None,
+        "peaks_channel": None,
+        "dispersion": DISPERSION,
+        "offset": OFFSET,
+        "kev_calibrated": (channel - OFFSET) * DISPERSION,
+        "fit_params": None,
+        "fit_cov": None,
+        "intensity_fit": None,
+    }
+    if params is not None:
+        s["fit_params"] = (params * [1 / counts.max(), 1, 1]).ravel()
+    return s
+
+
+def benchmarks_read(channels, tmp_dir):
+    """Reading the Lab3_data files, and synthetic .msa files of each size."""
+    lab3_files = [(os.path.join(REPO_DIR, "Lab3_data", filename), *read_params) for filename, *read_params in LAB3_FILES]
+    yield "read", "init_known_spectrum Lab3_data", {"files": len(lab3_files)}, len(lab3_files), "files", lambda: [
+        init_known_spectrum(
+            name=path,
+            filepath=path,
+            start_str=start_str,
+            stop_str=stop_str,
+            line_endings=line_endings,
+            delimiter=delimiter,
+        )
+        for path, start_str, stop_str, line_endings, delimiter in lab3_files
+    ]
+    if read_spectrum_file is not None:
+        all_files = sorted(glob.glob(os.path.join(REPO_DIR, "Lab3_data", "*.*")))
+        yield "read", "read_spectrum_file Lab3_data", {"files": len(all_files)}, len(all_files), "files", lambda: [
+            read_spectrum_file(path, print_info=False) for path in all_files
+        ]
+    for n_channels in channels:
+        counts, _ = synthetic_spectra(1, n_channels, 5)
+        path = os.path.join(tmp_dir, f"synthetic_{n_channels}.msa")
+        with open(path, "w") as f:
+            f.write(synthetic_msa_text(counts[0]))
+        yield "read", "read_only_y_data .msa", {"channels": n_channels}, n_channels, "channels", (
+            lambda path=path: read_only_y_data(path, SYNTHETIC_START, SYNTHETIC_STOP, ", \n", print_info=False)
+        )
+        if read_spectrum_file is not None:
+            yield "read", "read_spectrum_file .msa", {"channels": n_channels}, n_channels, "channels", (
+                lambda path=path: read_spectrum_file(path, print_info=False)
+            )
+
+
+def benchmarks_fit(channels, peaks, batches):
+    """Fitting synthetic spectra, scaling the channels, the peaks and the number of spectra."""
+    for n_channels in channels:
+        for n_peaks in peaks:
+            counts, params = synthetic_spectra(1, n_channels, n_peaks)
+            intensity = counts[0] / counts[0].max()
+            x = np.arange(n_channels)
+            # lists, since the first version compares guessed_std and guessed_amp with 1
+            guess = (params[:, 1] + 0.5).tolist()
+            std = params[:, 2].tolist()
+            amp = (params[:, 0] / counts[0].max()).tolist()
+            yield "fit", "fit_n_peaks_to_gaussian", {"channels": n_channels, "peaks": n_peaks}, 1, "spectra", (
+                lambda x=x, intensity=intensity, guess=guess, std=std, amp=amp: fit_n_peaks_to_gaussian(
+                    x, intensity, guess, guessed_std=std, guessed_amp=amp
+                )
+            )
+    if fit_n_peaks_to_gaussian_batch is None:
+        return
+    n_channels = channels[0]
+    for n_spectra in batches:
+        counts, params = synthetic_spectra(n_spectra, n_channels, peaks[0])
+        intensity = counts / counts.max(axis=1, keepdims=True)
+        yield "fit", "fit_n_peaks_to_gaussian_batch", {"channels": n_channels, "peaks": peaks[0], "batch": n_spectra}, n_spectra, "spectra", (
+            lambda intensity=intensity, params=params: fit_n_peaks_to_gaussian_batch(
+                np.arange(n_channels), intensity, params[:, 1] + 0.5, guessed_std=params[:, 2], window=10 * params[:, 2].max()
+            )
+        )
+
+
+def benchmarks_calibrate(channels, peaks, batches):
+    """Calibration with two peaks, least squares calibration of many spectra, and making the keV axis."""
+    yield "calibrate", "calibrate_channel_width_two_peaks", {}, 1, "spectra", (
+        lambda: calibrate_channel_width_two_peaks([100.0, 700.0], [100 * DISPERSION, 700 * DISPERSION])
+    )
+    for n_channels in channels:
+        s = {"dispersion": DISPERSION, "offset": OFFSET}
+        yield "calibrate", "channel_to_keV", {"channels": n_channels}, n_channels, "channels", (
+            lambda s=s, n_channels=n_channels: channel_to_keV(s, array=np.arange(n_channels))
+        )
+    if Calibration is None:
+        return
+    for n_spectra in batches:
+        for n_peaks in peaks:
+            if n_peaks < 2:
+                continue
+            rng = np.random.default_rng(0)
+            peaks_keV = np.linspace(0.5, 15, n_peaks)
+            peaks_channel = peaks_keV / DISPERSION + OFFSET + rng.normal(0, 0.1, (n_spectra, n_peaks))
+            yield "calibrate", "calibrate_least_squares", {"peaks": n_peaks, "batch": n_spectra}, n_spectra, "spectra", (
+                lambda peaks_channel=peaks_channel, peaks_keV=peaks_keV: calibrate_least_squares(
+                    peaks_channel, peaks_keV, print_info=False
+                )
+            )
+    for n_channels in channels:
+        # a new calibration each time, so the cached axis is not used
+        yield "calibrate", "Calibration.to_keV", {"channels": n_channels}, n_channels, "channels", (
+            lambda n_channels=n_channels: Calibration(DISPERSION, OFFSET).to_keV(np.arange(n_channels))
+        )
+
+
+def benchmarks_background(channels, batches):
+    """The SNIP background of a stack of spectra."""
+    if snip_background is None:
+        return
+    for n_channels in channels:
+        for n_spectra in batches:
+            counts, _ = synthetic_spectra(n_spectra, n_channels, 5)
+            yield "background", "snip_background", {"channels": n_channels, "batch": n_spectra}, n_spectra, "spectra", (
+                lambda counts=counts: snip_background(counts)
+            )
+
+
+def benchmarks_save(channels, tmp_dir):
+    """Saving and reading a fitted spectrum dictionary as .json and .npz."""
+    json_dir = os.path.join(tmp_dir, "Lab3_data_calibrated")
+    os.makedirs(json_dir, exist_ok=True)
+
+    def save_json(s):
+        # save_spectrum_to_json always saves to Lab3_data_calibrated in the working folder
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            save_spectrum_to_json(s)
+        finally:
+            os.chdir(cwd)
+
+    for n_channels in channels:
+        counts, params = synthetic_spectra(1, n_channels, 5)
+        s = spectrum_dict(counts[0], params)
+        json_file = os.path.join(json_dir, "synthetic_calibrated.json")
+        npz_file = os.path.join(json_dir, "synthetic_calibrated.npz")
+        yield "save", "save_spectrum_to_json", {"channels": n_channels}, 1, "spectra", lambda s=s: save_json(s)
+        yield "save", "read_saved_spectrum_from_json", {"channels": n_channels}, 1, "spectra", (
+            lambda: read_saved_spectrum_from_json(json_file)
+        )
+        if save_spectrum_to_npz is None:
+            continue
+        yield "save", "save_spectrum_to_npz", {"channels": n_channels}, 1, "spectra", (
+            lambda s=s: save_spectrum_to_npz(s, json_dir)
+        )
+        yield "save", "read_saved_spectrum_from_npz", {"channels": n_channels}, 1, "spectra", (
+            lambda: read_saved_spectrum_from_npz(npz_file)
+        )
+
+
+def benchmarks_plot(channels):
+    """Making the plotly figure of a fitted spectrum, and its html."""
+    # imported here, so the other stages can be benchmarked without plotly
+    from helper_files.plotting import plotly_plot
+
+    for n_channels in channels:
+        counts, params = synthetic_spectra(1, n_channels, 5)
+        s = spectrum_dict(counts[0], params)
+
+        def figure_html(s=s):
+            fig = plotly_plot(
+                x=s["kev_calibrated"],
+                y_named=[s["intensity"], "intensity"],
+                vlines=list(params[:, 1]),
+                fit_params=s["fit_params"],
+                stop=len(s["channel"]),
+            )
+            return fig.to_html(include_plotlyjs=False)
+
+        yield "plot", "plotly_plot to html", {"channels": n_channels}, 1, "figures", figure_html
+
+
+def git_commit():
+    """The commit of the repository, so the results can be compared between commits."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    """What identifies a benchmark when comparing two runs."""
+    return result["stage"], result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def print_results(results, baseline=None):
+    """Prints a table of the results, with the speedup compared to the baseline results."""
+    baseline = {result_key(result): result for result in baseline or []}
+    header = f"{'stage':<11} {'benchmark':<32} {'parameters':<36} {'time [ms]':>10} {'throughput':>22} {'peak mem':>10}"
+    if baseline:
+        header += f" {'speedup':>8}"
+    print(header)
+    for result in results:
+        params = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+        throughput = f"{result['throughput']:.4g} {result['unit']}/s"
+        line = (
+            f"{result['stage']:<11} {result['name']:<32} {params:<36} {1000 * result['seconds']:>10.3f} "
+            f"{throughput:>22} {result['peak_memory'] / 2**20:>8.2f}MB"
+        )
+        old = baseline.get(result_key(result))
+        if old is not None:
+            line += f" {old['seconds'] / result['seconds']:>7.2f}x"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the read, fit, calibrate, save and plot stages.")
+    parser.add_argument("--channels", default="1024,4096", help="comma separated channel counts, eg 1024,4096,16384")
+    parser.add_argument("--peaks", default="1,5,20", help="comma separated peak counts, eg 1,10,50")
+    parser.add_argument("--batch", default="1,100,1000", help="comma separated numbers of spectra, eg 1,1000,100000")
+    parser.add_argument("--stages", default="read,fit,calibrate,background,save,plot", help="which stages to run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark, the best time is used")
+    parser.add_argument("--output", help="save the results to this .json file")
+    parser.add_argument("--compare", help="a .json file from an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    channels = [int(value) for value in args.channels.split(",")]
+    peaks = [int(value) for value in args.peaks.split(",")]
+    batches = [int(value) for value in args.batch.split(",")]
+    stages = args.stages.split(",")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        all_benchmarks = {
+            "read": lambda: benchmarks_read(channels, tmp_dir),
+            "fit": lambda: benchmarks_fit(channels, peaks, batches),
+            "calibrate": lambda: benchmarks_calibrate(channels, peaks, batches),
+            "background": lambda: benchmarks_background(channels, batches),
+            "save": lambda: benchmarks_save(channels, tmp_dir),
+            "plot": lambda: benchmarks_plot(channels),
+        }
+        for stage in stages:
+            for stage_name, name, params, n_items, unit, func in all_benchmarks[stage]():
+                seconds, peak_memory = measure(func, args.repeat)
+                results.append(
+                    {
+                        "stage": stage_name,
+                        "name": name,
+                        "params": params,
+                        "seconds": seconds,
+                        "throughput": n_items / seconds,
+                        "unit": unit,
+                        "peak_memory": peak_memory,
+                    }
+                )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "machine": platform.machine(),
+                    "cpu_count": os.cpu_count(),
+                    "results": results,
+                },
+                f,
+                indent=4,
+            )
+        print(f"Saved the results to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
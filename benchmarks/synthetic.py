@@ -0,0 +1,85 @@
+# synthetic spectra for the benchmarks, so the size of the data can be scaled
+# the spectra look like the SEM spectra: gaussian peaks on a falling background, with Poisson noise
+
+import numpy as np
+
+# the calibration of the synthetic spectra, about the same as SEM_known_Cu.msa
+DISPERSION = 0.02
+OFFSET = 10.0
+
+
+def synthetic_peaks(n_peaks, n_channels, seed=0):
+    """
+    Peak centers [channels], widths [channels] and heights [counts] spread over the spectrum.
+
+    Returns
+    -------
+    np.array
+        (n_peaks, 3) with amp, mu and std of each peak
+    """
+    rng = np.random.default_rng(seed)
+    params = np.empty((n_peaks, 3))
+    params[:, 0] = rng.uniform(200, 5000, n_peaks)
+    # evenly spread centers, so the peaks does not overlap too much
+    params[:, 1] = np.linspace(0.05, 0.95, n_peaks) * n_channels if n_peaks > 1 else [n_channels / 2]
+    params[:, 2] = rng.uniform(2, 4, n_peaks) * n_channels / 1024
+    return params
+
+
+def synthetic_spectra(n_spectra, n_channels, n_peaks, seed=0):
+    """
+    A stack of noisy spectra with the same peaks.
+
+    Parameters
+    ----------
+    n_spectra : int
+        number of spectra
+    n_channels : int
+        number of channels
+    n_peaks : int
+        number of gaussian peaks
+    seed : int, optional
+        seed of the random numbers, by default 0
+
+    Returns
+    -------
+    tuple
+        counts (n_spectra, n_channels) as floats, and the (n_peaks, 3) true peak parameters
+    """
+    rng = np.random.default_rng(seed)
+    params = synthetic_peaks(n_peaks, n_channels, seed)
+    channel = np.arange(n_channels)
+    expected = 50 * np.exp(-channel / (0.3 * n_channels)) + 1
+    for amp, mu, std in params:
+        expected = expected + amp * np.exp(-((channel - mu) ** 2) / (2 * std**2))
+    counts = rng.poisson(expected, size=(n_spectra, n_channels)).astype(np.float64)
+    return counts, params
+
+
+def synthetic_msa_text(counts, livetime=60.0):
+    """
+    An EMSA/MSA file with the given counts, with one column of data like SEM_known_Cu.msa.
+
+    Returns
+    -------
+    string
+        the whole file
+    """
+    header = "\n".join(
+        [
+            "#FORMAT      : EMSA/MAS Spectral Data File",
+            "#VERSION     : 1.0",
+            "#TITLE       : synthetic",
+            f"#NPOINTS     : {len(counts)}",
+            "#NCOLUMNS    : 1",
+            "#XUNITS      : keV",
+            "#YUNITS      : counts",
+            "#DATATYPE    : Y",
+            f"#XPERCHAN    : {DISPERSION}",
+            f"#OFFSET      : {-OFFSET * DISPERSION}",
+            f"#LIVETIME    : {livetime}",
+            "#SPECTRUM    : Spectral Data Starts Here",
+        ]
+    )
+    data = "\n".join(f"{value:.6f}, " for value in counts)
+    return f"{header}\n{data}\n#ENDOFDATA   : \n"
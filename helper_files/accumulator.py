@@ -0,0 +1,136 @@
+# helper file for summing many short acquisitions of the same sample into one spectrum
+# eg Lab3_data/TEM_known_NiO_on_Mo_A.emsa and _B.emsa
+
+import numpy as np
+
+from helper_files.spectrum_dict import read_spectrum_data
+
+
+class SpectrumAccumulator:
+    """
+    A running sum of the raw counts of many spectra, in one preallocated int64 array.
+    Each spectrum is added in place when it arrives, and is not kept afterwards,
+    so summing thousands of files uses the memory of one spectrum.
+
+    Parameters
+    ----------
+    n_channels : int
+        number of channels in the spectra
+    name : string, optional
+        name of the summed spectrum, by default "sum"
+    """
+
+    def __init__(self, n_channels, name="sum"):
+        self.name = name
+        self.counts = np.zeros(n_channels, dtype=np.int64)
+        self.livetime = 0.0
+        self.n_spectra = 0
+        # False when a spectrum without live time is added, then the rate is unknown
+        self.livetime_known = True
+
+    @property
+    def n_channels(self):
+        return len(self.counts)
+
+    def add(self, counts, livetime=None):
+        """
+        Adds the counts of one spectrum to the sum.
+
+        Parameters
+        ----------
+        counts : np.array
+            the raw counts, not the normalised intensity
+        livetime : float, optional
+            live time of the spectrum in seconds, by default None
+
+        Returns
+        -------
+        SpectrumAccumulator
+            itself, so calls can be chained
+        """
+        if len(counts) != self.n_channels:
+            raise ValueError(f"The sum has {self.n_channels} channels, while the spectrum has {len(counts)}")
+        # the counts are read as floats, but are whole numbers
+        np.add(self.counts, np.rint(counts), out=self.counts, casting="unsafe")
+        self.n_spectra += 1
+        if livetime is None:
+            self.livetime_known = False
+        else:
+            self.livetime += livetime
+        return self
+
+    def add_spectrum(self, s):
+        """
+        Adds the counts of a spectrum dictionary, with the live time from s['header'] if it has one.
+        """
+        header = s.get("header") or {}
+        return self.add(s["counts"], header.get("livetime"))
+
+    def add_file(self, filepath, start_str=None, stop_str=None, line_endings=None, delimiter=None, cache_dir=None):
+        """
+        Reads a file and adds its counts, without making a spectrum dictionary.
+        The parameters are the same as for init_known_spectrum, by default the header is read.
+        """
+        result = read_spectrum_data(filepath, start_str, stop_str, line_endings, delimiter, cache_dir, print_info=False)
+        if result is None:
+            raise ValueError(f"Could not read the data in {filepath}")
+        data, header = result
+        return self.add(data[1], header["livetime"] if header is not None else None)
+
+    def intensity(self):
+        """The summed counts normalised to the maximum, like s['intensity']."""
+        return self.counts / self.counts.max()
+
+    def intensity_std(self):
+        """The Poisson uncertainty of the intensity, sqrt(counts) / maximum."""
+        return np.sqrt(self.counts) / self.counts.max()
+
+    def counts_std(self):
+        """The Poisson uncertainty of the summed counts, sqrt(counts)."""
+        return np.sqrt(self.counts)
+
+    def rate(self):
+        """
+        Counts per second of live time, and its Poisson uncertainty.
+        Can be compared between sums with different live times.
+
+        Returns
+        -------
+        tuple
+            the rate and its standard deviation, [counts/s]
+        """
+        if not self.livetime_known or self.livetime == 0:
+            raise ValueError(f"The live time of {self.name} is not known for all the added spectra")
+        return self.counts / self.livetime, np.sqrt(self.counts) / self.livetime
+
+    def to_spectrum(self, peaks_keV=None, peaks_names=None, peaks_channel=None):
+        """
+        The sum as a spectrum dictionary, which can be fitted and calibrated as the other spectra.
+        The counts are copied, so more spectra can be added to the sum afterwards.
+
+        Returns
+        -------
+        dict
+            spectrum dictionary, with the total live time in s['header']['livetime']
+        """
+        counts = self.counts.astype(np.float64)
+        return {
+            "name": self.name,
+            "filepath": f"{self.name}.msa",
+            "channel": np.arange(self.n_channels),
+            "intensity": counts / counts.max(),
+            "counts": counts,
+            "peaks_keV": peaks_keV,
+            "peaks_names": peaks_names,
+            "peaks_channel": peaks_channel,
+            "dispersion": None,
+            "offset": None,
+            "kev_calibrated": None,
+            "fit_params": None,
+            "fit_cov": None,
+            "intensity_fit": None,
+            "header": {
+                "livetime": self.livetime if self.livetime_known else None,
+                "n_spectra": self.n_spectra,
+            },
+        }
@@ -0,0 +1,132 @@
+# helper file for removing the background (bremsstrahlung continuum) under the peaks
+# works on one spectrum or a whole (n_spectra, n_channels) array at once
+
+import numpy as np
+
+
+def snip_background(counts, width=20):
+    """
+    The SNIP background (Statistics-sensitive Non-linear Iterative Peak-clipping).
+    Each channel is replaced by the mean of the channels p away on each side, if that is lower,
+    for p = 1 to width. Peaks narrower than width are clipped away, while the slowly
+    varying continuum is kept. The counts are first compressed with log(log(sqrt(y + 1) + 1) + 1),
+    so the large peaks and the small background are treated the same.
+
+    Parameters
+    ----------
+    counts : np.array
+        the raw counts, 1d or (n_spectra, n_channels)
+    width : int, optional
+        the largest clipping window in channels, about the full width of the widest peak, by default 20
+
+    Returns
+    -------
+    np.array
+        the background, with the same shape as counts
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    v = np.log(np.log(np.sqrt(np.clip(counts, 0, None) + 1) + 1) + 1)
+
+    # each step is one vectorized operation over all channels and all spectra
+    for p in range(1, width + 1):
+        mean_of_neighbours = 0.5 * (v[..., : -2 * p] + v[..., 2 * p :])
+        np.minimum(v[..., p:-p], mean_of_neighbours, out=v[..., p:-p])
+
+    # back from the compressed scale
+    return (np.exp(np.exp(v) - 1) - 1) ** 2 - 1
+
+
+def polynomial_background(counts, degree=4, iterations=30):
+    """
+    Background from an iterative polynomial fit, where the peaks are clipped away.
+    A polynomial is fitted, every channel above it is set down to the polynomial, and it is fitted again.
+    All spectra share the same channels, so they are fitted with one least squares call per iteration.
+
+    Parameters
+    ----------
+    counts : np.array
+        the raw counts, 1d or (n_spectra, n_channels)
+    degree : int, optional
+        degree of the polynomial, by default 4
+    iterations : int, optional
+        number of fit and clip steps, by default 30
+
+    Returns
+    -------
+    np.array
+        the background, with the same shape as counts
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    y = np.atleast_2d(counts).T.copy()  # (n_channels, n_spectra), one column per spectrum
+    n_channels = y.shape[0]
+
+    # the channels are scaled to -1 to 1, so the polynomial fit is well conditioned
+    x = np.linspace(-1, 1, n_channels)
+    vandermonde = np.polynomial.polynomial.polyvander(x, degree)
+    # the pseudo-inverse is the same for all iterations and spectra
+    pseudo_inverse = np.linalg.pinv(vandermonde)
+
+    for _ in range(iterations):
+        fitted = vandermonde @ (pseudo_inverse @ y)
+        np.minimum(y, fitted, out=y)
+
+    background = vandermonde @ (pseudo_inverse @ y)
+    return background.T.reshape(counts.shape)
+
+
+# the background methods which can be chosen by name in subtract_background,
+# more can be added here, or a function can be given directly
+BACKGROUND_METHODS = {
+    "snip": snip_background,
+    "polynomial": polynomial_background,
+}
+
+
+def background(counts, method="snip", **kwargs):
+    """
+    The background of one or many spectra, with the method chosen by name or given as a function.
+
+    Parameters
+    ----------
+    counts : np.array
+        the raw counts, 1d or (n_spectra, n_channels)
+    method : string or function, optional
+        "snip", "polynomial", or a function(counts, **kwargs) -> background, by default "snip"
+    **kwargs
+        passed on to the method, eg width=30 for snip
+
+    Returns
+    -------
+    np.array
+        the background, with the same shape as counts
+    """
+    if callable(method):
+        return method(counts, **kwargs)
+    if method not in BACKGROUND_METHODS:
+        raise ValueError(f"Unknown background method {method}, choose from {list(BACKGROUND_METHODS)}")
+    return BACKGROUND_METHODS[method](counts, **kwargs)
+
+
+def subtract_background(s, method="snip", **kwargs):
+    """
+    Finds the background of a spectrum dictionary, and adds it as s['background'],
+    together with s['net_counts'] = s['counts'] - s['background'].
+    The peaks can then be fitted on the net counts in small windows around each peak.
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary
+    method : string or function, optional
+        see background, by default "snip"
+    **kwargs
+        passed on to the method
+
+    Returns
+    -------
+    dict
+        the same spectrum dictionary
+    """
+    s["background"] = background(s["counts"], method, **kwargs)
+    s["net_counts"] = s["counts"] - s["background"]
+    return s
@@ -0,0 +1,147 @@
+# helper file for calibrating many unknown spectra with one known spectrum
+# the same as init_unknown_spectrum_with_known, but for a whole folder at once, in parallel
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from helper_files.spectrum_dict import read_spectrum_data
+
+
+def read_counts_for_batch(filepath, read_params, n_channels, cache_dir=None):
+    """
+    Reads the counts of one file in the batch, without printing.
+    Is run in the worker processes or threads of calibrate_files_with_known.
+
+    Parameters
+    ----------
+    filepath : string
+        path to the data file
+    read_params : list
+        [start_str, stop_str, line_endings, delimiter], start_str None reads the header
+    n_channels : int
+        number of channels in the known spectrum
+    cache_dir : string, optional
+        folder for the cached counts, by default None
+
+    Returns
+    -------
+    tuple
+        (counts, None) if the file was read, or (None, error message) if not
+    """
+    try:
+        result = read_spectrum_data(filepath, *read_params, cache_dir=cache_dir, print_info=False)
+    except (OSError, ValueError) as error:
+        return None, f"{type(error).__name__}: {error}"
+    if result is None:
+        return None, "could not read the data, check the parameters for reading the file"
+
+    counts = result[0][1]
+    if len(counts) != n_channels:
+        return None, f"the calibrated spectrum has {n_channels} data points, while this one has {len(counts)}"
+    return np.asarray(counts), None
+
+
+def calibrate_files_with_known(
+    *,
+    known_spectrum,
+    filepaths,
+    start_str=None,
+    stop_str=None,
+    line_endings=None,
+    delimiter=None,
+    n_workers=None,
+    use_processes=True,
+    cache_dir=None,
+):
+    """
+    Calibrates many unknown files with the dispersion and offset of one known spectrum.
+    The files are read in parallel, and the counts are stacked in one 2d array,
+    which shares the kev_calibrated axis of the known spectrum.
+    Files which could not be read, or has the wrong number of channels,
+    are returned in 'errors' instead of being printed.
+
+    Parameters
+    ----------
+    known_spectrum : dictionary
+        a calibrated spectrum dictionary, since we will use the dispersion and offset
+    filepaths : string or list of strings
+        a glob pattern, eg "Lab3_data/SEM_*.msa", or a list of paths
+    start_str : string, optional
+        string that marks the start of the data, by default the same as the known spectrum
+    stop_str : string, optional
+        string that marks the end of the data, by default the same as the known spectrum
+    line_endings : string, optional
+        string that marks the end of each line, by default the same as the known spectrum
+    delimiter : string, optional
+        string that splits the data, by default the same as the known spectrum
+    n_workers : int, optional
+        number of processes or threads, by default None which uses the number of cpus
+    use_processes : bool, optional
+        use processes instead of threads, by default True
+    cache_dir : string, optional
+        folder to cache the parsed counts in, see spectrum_cache.py, by default None
+
+    Returns
+    -------
+    dict
+        batch dictionary with the keys:
+        filepaths (the files which were read), counts (2d np.array, one row per file),
+        kev_calibrated, dispersion, offset, known_name and errors ({filepath: message})
+    """
+    if known_spectrum["dispersion"] is None or known_spectrum["offset"] is None or known_spectrum["kev_calibrated"] is None:
+        raise ValueError(
+            f"The known_spectrum {known_spectrum['name']} lacks either dispersion, offset or kev_calibrated"
+        )
+
+    if isinstance(filepaths, (str, os.PathLike)):
+        filepaths = sorted(glob.glob(str(filepaths)))
+    filepaths = list(filepaths)
+
+    # assuming the filetype is the same as the known spectrum, as in init_unknown_spectrum_with_known
+    read_params = [
+        start_str if start_str is not None else known_spectrum.get("start_str"),
+        stop_str if stop_str is not None else known_spectrum.get("stop_str"),
+        line_endings if line_endings is not None else known_spectrum.get("line_endings"),
+        delimiter if delimiter is not None else known_spectrum.get("delimiter"),
+    ]
+    n_channels = len(known_spectrum["kev_calibrated"])
+
+    if n_workers is None:
+        n_workers = min(os.cpu_count() or 1, max(len(filepaths), 1))
+    # the processes get the files in chunks, to not send one message per file
+    chunksize = max(1, len(filepaths) // (4 * n_workers)) if use_processes else 1
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=n_workers) as executor:
+        results = list(
+            executor.map(
+                read_counts_for_batch,
+                filepaths,
+                [read_params] * len(filepaths),
+                [n_channels] * len(filepaths),
+                [cache_dir] * len(filepaths),
+                chunksize=chunksize,
+            )
+        )
+
+    # stacking the counts of the files which were read into one preallocated array
+    read_filepaths = [path for path, (counts, _) in zip(filepaths, results) if counts is not None]
+    counts = np.empty((len(read_filepaths), n_channels))
+    row = 0
+    for spectrum_counts, _ in results:
+        if spectrum_counts is not None:
+            counts[row] = spectrum_counts
+            row += 1
+
+    return {
+        "known_name": known_spectrum["name"],
+        "filepaths": read_filepaths,
+        "counts": counts,
+        "kev_calibrated": known_spectrum["kev_calibrated"],
+        "dispersion": known_spectrum["dispersion"],
+        "offset": known_spectrum["offset"],
+        "errors": {path: error for path, (_, error) in zip(filepaths, results) if error is not None},
+    }
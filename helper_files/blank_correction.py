@@ -0,0 +1,154 @@
+# helper file for subtracting a blank spectrum, eg Lab3_data/XRF_no_sample.mca
+# the blank is scaled by the live time, so spectra measured for different times can be corrected
+
+import os
+
+import numpy as np
+
+from helper_files.read_header import read_spectrum_file
+
+# the blanks which are read in this session, {(path, modification time): (counts, livetime)}
+_blank_cache = {}
+
+
+def load_blank(filepath):
+    """
+    Reads a blank spectrum and its live time from the header, only once per session.
+    Later calls with the same file give the same array, until the file is changed.
+
+    Parameters
+    ----------
+    filepath : string
+        path to the blank spectrum, a .msa, .emsa or .mca file with the live time in the header
+
+    Returns
+    -------
+    tuple
+        counts as a read-only np.array, and the live time in seconds
+    """
+    key = (os.path.abspath(filepath), os.stat(filepath).st_mtime_ns)
+    if key not in _blank_cache:
+        result = read_spectrum_file(filepath, print_info=False)
+        if result is None:
+            raise ValueError(f"Could not read the blank spectrum {filepath}")
+        header, data = result
+        if not header["livetime"]:
+            raise ValueError(f"The blank spectrum {filepath} has no live time in the header")
+        counts = data[1]
+        counts.flags.writeable = False
+        _blank_cache[key] = (counts, header["livetime"])
+    return _blank_cache[key]
+
+
+def clear_blank_cache():
+    """Forgets the blanks read by load_blank, eg when starting a new detector session."""
+    _blank_cache.clear()
+
+
+def spectrum_livetime(s):
+    """
+    The live time of a spectrum dictionary, from the header read by init_known_spectrum.
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary
+
+    Returns
+    -------
+    float
+        live time in seconds, or None if it is not known
+    """
+    header = s.get("header")
+    if header is None:
+        return None
+    return header.get("livetime")
+
+
+def subtract_blank(counts, livetime, blank_counts, blank_livetime):
+    """
+    Subtracts the blank, scaled to the live time of each spectrum, from one or many spectra.
+    counts - blank_counts * livetime / blank_livetime, as one array operation.
+
+    Parameters
+    ----------
+    counts : np.array
+        the counts, 1d or (n_spectra, n_channels)
+    livetime : float or np.array
+        live time of the spectrum, or one per spectrum
+    blank_counts : np.array
+        the counts of the blank
+    blank_livetime : float
+        live time of the blank
+
+    Returns
+    -------
+    tuple
+        the corrected counts, and their variance from the Poisson noise of both spectra
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    blank_counts = np.asarray(blank_counts, dtype=np.float64)
+    if counts.shape[-1] != len(blank_counts):
+        raise ValueError(f"The blank has {len(blank_counts)} channels, while the spectra have {counts.shape[-1]}")
+
+    # one scale per spectrum, as a column for 2d counts
+    scale = np.asarray(livetime, dtype=np.float64) / blank_livetime
+    if counts.ndim == 2:
+        scale = np.broadcast_to(scale, len(counts))[:, None]
+
+    corrected = counts - scale * blank_counts
+    variance = np.clip(counts, 0, None) + scale**2 * blank_counts
+    return corrected, variance
+
+
+def subtract_blank_from_spectrum(s, blank_filepath):
+    """
+    Subtracts a blank from a spectrum dictionary, adding s['blank_counts'] (the scaled blank),
+    s['counts_corrected'] = s['counts'] - s['blank_counts'] and its Poisson variance
+    s['counts_corrected_variance'], eg for weighting a fit.
+    The live times are read from the headers, so the spectrum must be read without start_str.
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary
+    blank_filepath : string
+        path to the blank spectrum, eg "Lab3_data/XRF_no_sample.mca"
+
+    Returns
+    -------
+    dict
+        the same spectrum dictionary
+    """
+    livetime = spectrum_livetime(s)
+    if not livetime:
+        raise ValueError(f"{s['name']} has no live time, read it with init_known_spectrum without start_str")
+    blank_counts, blank_livetime = load_blank(blank_filepath)
+
+    s["counts_corrected"], s["counts_corrected_variance"] = subtract_blank(
+        s["counts"], livetime, blank_counts, blank_livetime
+    )
+    s["blank_counts"] = s["counts"] - s["counts_corrected"]
+    return s
+
+
+def subtract_blank_from_collection(collection, blank_filepath):
+    """
+    Subtracts a blank from all spectra in a SpectrumCollection, using its livetime column.
+
+    Parameters
+    ----------
+    collection : SpectrumCollection
+        the spectra, with livetime set
+    blank_filepath : string
+        path to the blank spectrum
+
+    Returns
+    -------
+    tuple
+        the corrected counts (n_spectra, n_channels) and their variance
+    """
+    if np.isnan(collection.livetime).any():
+        raise ValueError("All spectra in the collection must have a live time to subtract a blank")
+    blank_counts, blank_livetime = load_blank(blank_filepath)
+    return subtract_blank(collection.counts, collection.livetime, blank_counts, blank_livetime)
@@ -1,5 +1,10 @@
 # helper file for calibration
 
+import functools
+import warnings
+
+import numpy as np
+
 
 def calibrate_channel_width_two_peaks(peaks_channel, peaks_keV):
     """
@@ -49,28 +54,349 @@ def channel_to_keV(spectrum=None, value=None, array=None, use_offset=True):
         spectrum dictionary
     value : int
         single value to convert
-    array : list
+    array : list or np.array
         array of values to convert
 
     Returns
     -------
-    int or list
+    float or np.array
         converted value or array
     """
 
+    if spectrum is None:
+        raise ValueError("No spectrum dictionary provided to chennel_to_keV()")
+
     # sometimes the offset is not used, eg when calculating the FWHM from std in channels
     if use_offset:
         offset = spectrum["offset"]
     else:
         offset = 0
-    
-    if spectrum is None:
-        raise ValueError("No spectrum dictionary provided to chennel_to_keV()")
 
     if value is not None:
         return (value - offset) * spectrum["dispersion"]
     if array is not None:
-        return [(x - offset) * spectrum["dispersion"] for x in array]
+        return (np.asarray(array, dtype=np.float64) - offset) * spectrum["dispersion"]
 
     else:
         raise ValueError("No value or array provided to chennel_to_keV()")
+
+
+def keV_to_channel(spectrum=None, value=None, array=None, use_offset=True):
+    """
+    Convert either single value or array of values from keV to channel, the inverse of channel_to_keV.
+    value / dispersion + offset
+
+    Parameters
+    ----------
+    spectrum : dict
+        spectrum dictionary
+    value : float
+        single value to convert
+    array : list or np.array
+        array of values to convert
+
+    Returns
+    -------
+    float or np.array
+        converted value or array
+    """
+
+    if spectrum is None:
+        raise ValueError("No spectrum dictionary provided to keV_to_channel()")
+
+    offset = spectrum["offset"] if use_offset else 0
+
+    if value is not None:
+        return value / spectrum["dispersion"] + offset
+    if array is not None:
+        return np.asarray(array, dtype=np.float64) / spectrum["dispersion"] + offset
+
+    else:
+        raise ValueError("No value or array provided to keV_to_channel()")
+
+
+# the most calibrated keV axes which are kept, see Calibration.axis
+AXIS_CACHE_SIZE = 32
+
+
+@functools.lru_cache(maxsize=AXIS_CACHE_SIZE)
+def _calibrated_axis(coefficients, n_channels):
+    """The read-only keV axis of a calibration, shared by all spectra with the same calibration."""
+    axis = Calibration(coefficients=coefficients).to_keV(np.arange(n_channels))
+    axis.flags.writeable = False
+    return axis
+
+
+class Calibration:
+    """
+    A calibration from channel to keV, keV = c0 + c1 * channel + c2 * channel^2 + ...
+    The linear calibration is the usual keV = (channel - offset) * dispersion.
+    Converts both ways, for single values and whole arrays,
+    and gives the channels of an energy window without searching the keV axis.
+
+    Parameters
+    ----------
+    dispersion : float, optional
+        keV/channel, by default None
+    offset : float, optional
+        channels, by default None
+    coefficients : list, optional
+        [c0, c1, c2, ...] instead of dispersion and offset, eg from calibrate_least_squares, by default None
+    """
+
+    def __init__(self, dispersion=None, offset=None, coefficients=None):
+        if coefficients is None:
+            if dispersion is None or offset is None:
+                raise ValueError("Calibration needs either dispersion and offset, or coefficients")
+            # keV = (channel - offset) * dispersion = -offset * dispersion + dispersion * channel
+            coefficients = [-offset * dispersion, dispersion]
+        # trailing zeros are removed, so eg a quadratic with c2 = 0 is treated as linear
+        coefficients = np.trim_zeros(np.asarray(coefficients, dtype=np.float64), "b")
+        if len(coefficients) < 2:
+            raise ValueError(f"The calibration must depend on the channel, got coefficients {coefficients}")
+        self.coefficients = coefficients
+
+    @classmethod
+    def from_spectrum(cls, s):
+        """Calibration with the dispersion and offset of a spectrum dictionary."""
+        return cls(dispersion=s["dispersion"], offset=s["offset"])
+
+    @classmethod
+    def from_least_squares(cls, calibration):
+        """Calibration from the calibration dictionary of calibrate_least_squares."""
+        return cls(coefficients=calibration["coefficients"])
+
+    @property
+    def degree(self):
+        return len(self.coefficients) - 1
+
+    @property
+    def dispersion(self):
+        """keV/channel at channel 0."""
+        return self.coefficients[1]
+
+    @property
+    def offset(self):
+        """The channel of 0 keV."""
+        return float(self.to_channel(0.0))
+
+    def to_keV(self, channel):
+        """
+        Converts channels to keV, works like a numpy ufunc on single values and arrays.
+
+        Parameters
+        ----------
+        channel : float or np.array
+            channel values
+
+        Returns
+        -------
+        float or np.array
+            keV values
+        """
+        channel = np.asarray(channel, dtype=np.float64)
+        # Horner's method, c0 + channel * (c1 + channel * (c2 + ...))
+        kev = np.full(channel.shape, self.coefficients[-1])
+        for coefficient in self.coefficients[-2::-1]:
+            kev = kev * channel + coefficient
+        return kev[()] if kev.ndim == 0 else kev
+
+    def derivative(self, channel):
+        """The dispersion, keV/channel, at the given channels."""
+        channel = np.asarray(channel, dtype=np.float64)
+        powers = np.arange(1, len(self.coefficients))
+        derivative = (self.coefficients[1:] * powers * channel[..., None] ** (powers - 1)).sum(axis=-1)
+        return derivative[()] if derivative.ndim == 0 else derivative
+
+    def to_channel(self, kev, iterations=8):
+        """
+        Converts keV to channels, the inverse of to_keV.
+        Linear calibrations are inverted exactly, non-linear ones with Newton's method
+        starting from the linear part, which converges in a few steps when the non-linearity is small.
+
+        Parameters
+        ----------
+        kev : float or np.array
+            keV values
+        iterations : int, optional
+            Newton steps for non-linear calibrations, by default 8
+
+        Returns
+        -------
+        float or np.array
+            channel values, not rounded
+        """
+        kev = np.asarray(kev, dtype=np.float64)
+        channel = (kev - self.coefficients[0]) / self.coefficients[1]
+        if self.degree > 1:
+            for _ in range(iterations):
+                channel = channel - (self.to_keV(channel) - kev) / self.derivative(channel)
+        return channel[()] if np.ndim(channel) == 0 else channel
+
+    def axis(self, n_channels):
+        """
+        The calibrated keV axis for n_channels, like s['kev_calibrated'].
+        The axis is made once for each calibration and number of channels,
+        and the same read-only array is returned to all spectra with the same detector setup.
+        Only the last AXIS_CACHE_SIZE axes are kept, so spectra with a calibration of their own,
+        eg corrected for drift, should use to_keV instead.
+
+        Parameters
+        ----------
+        n_channels : int
+            number of channels
+
+        Returns
+        -------
+        np.array
+            read-only keV axis
+        """
+        return _calibrated_axis(tuple(self.coefficients.tolist()), int(n_channels))
+
+    def channel_window(self, kev_low, kev_high, n_channels=None):
+        """
+        The channels from kev_low to kev_high, as start and stop for slicing, eg counts[start:stop].
+        Calculated directly with to_channel, so there is no search in the keV axis.
+
+        Parameters
+        ----------
+        kev_low : float or np.array
+            lower energy of the window
+        kev_high : float or np.array
+            upper energy of the window
+        n_channels : int, optional
+            the windows are cut to 0 to n_channels, by default None
+
+        Returns
+        -------
+        tuple
+            start, stop as ints, or int arrays for many windows
+        """
+        start = np.ceil(self.to_channel(kev_low)).astype(int)
+        stop = np.floor(self.to_channel(kev_high)).astype(int) + 1
+        if n_channels is not None:
+            start = np.clip(start, 0, n_channels)
+            stop = np.clip(stop, 0, n_channels)
+        if np.ndim(start) == 0:
+            return int(start), int(stop)
+        return start, stop
+
+    def __repr__(self):
+        return f"Calibration(coefficients={self.coefficients.tolist()})"
+
+
+def calibrate_least_squares(peaks_channel, peaks_keV, fit_cov=None, degree=1, print_info=True):
+    """
+    Calibration with a weighted least squares fit through all the known peaks,
+    keV = c0 + c1 * channel (+ c2 * channel^2 if degree=2).
+    The weights are 1 / variance of each fitted peak center, taken from fit_cov,
+    and the uncertainties of the calibration come from the same weights.
+    Without fit_cov all peaks have the same weight, and the uncertainties come from the residuals.
+    The same is done, with a warning, for the spectra where a variance in fit_cov is not a positive number,
+    eg inf from a fit which did not converge.
+
+    Many spectra can be calibrated at once by giving 2d peaks_channel (n_spectra, n_peaks),
+    which is solved as one stacked linear algebra call.
+    Only the first len(peaks_keV) peaks are used, the same as in calibrate_channel_width_two_peaks.
+
+    Parameters
+    ----------
+    peaks_channel : list or np.array
+        s['peaks_channel'], or (n_spectra, n_peaks) for many spectra
+    peaks_keV : list or np.array
+        s['peaks_keV'], the same for all spectra or (n_spectra, n_peaks)
+    fit_cov : np.array, optional
+        s['fit_cov'], or (n_spectra, 3 * n_peaks, 3 * n_peaks), by default None
+    degree : int, optional
+        1 for linear, 2 for quadratic, by default 1
+    print_info : bool, optional
+        printing the result for a single spectrum, by default True
+
+    Returns
+    -------
+    dict
+        calibration dictionary with:
+        dispersion [keV/channel] and offset [channels] from the linear part, with dispersion_std and offset_std,
+        coefficients [c0, c1, (c2)] and coefficients_cov, residuals [keV] and degree.
+        For degree 2 the offset is -c0 / c1, not the channel where the polynomial is 0 keV,
+        which is Calibration.from_least_squares(calibration).offset.
+        For many spectra each value has the spectra along the first axis.
+    """
+    n_keV = np.shape(peaks_keV)[-1]
+    if n_keV < degree + 1:
+        raise ValueError(f"At least {degree + 1} peaks are needed for a degree {degree} calibration, got {n_keV}")
+
+    # everything is done as a stack of spectra, a single spectrum is a stack of one
+    single = np.ndim(peaks_channel) == 1
+    channel = np.atleast_2d(np.asarray(peaks_channel, dtype=np.float64))[:, :n_keV]
+    kev = np.broadcast_to(np.asarray(peaks_keV, dtype=np.float64), channel.shape)
+    n_spectra, n_peaks = channel.shape
+
+    # the spectra where the uncertainties come from the residuals, instead of from fit_cov
+    unweighted = np.ones(n_spectra, dtype=bool)
+    weights = np.ones_like(channel)
+
+    # the variance of the fitted centers, the diagonal entries for mu1, mu2, ...
+    if fit_cov is not None:
+        fit_cov = np.asarray(fit_cov, dtype=np.float64).reshape(n_spectra, *np.shape(fit_cov)[-2:])
+        center_index = 3 * np.arange(n_peaks) + 1
+        channel_variance = fit_cov[:, center_index, center_index]
+        # inf (a fit which did not converge), nan or 0 would give weights of 0 or inf
+        unweighted = ~np.all(np.isfinite(channel_variance) & (channel_variance > 0), axis=1)
+        if unweighted.any():
+            warnings.warn(
+                f"{unweighted.sum()} of {n_spectra} spectra have variances in fit_cov which are not positive numbers, "
+                "they are calibrated with equal weights"
+            )
+        # the uncertainty in channels becomes an uncertainty in keV through the slope,
+        # which is found from the first and last peak
+        slope = (kev[:, -1] - kev[:, 0]) / (channel[:, -1] - channel[:, 0])
+        weighted = ~unweighted
+        weights[weighted] = 1 / (channel_variance[weighted] * slope[weighted, None] ** 2)
+
+    # design matrix with the columns 1, channel, (channel^2)
+    design = channel[:, :, None] ** np.arange(degree + 1)
+    weighted_design = design * weights[:, :, None]
+    normal_matrix = np.einsum("spi,spj->sij", weighted_design, design)
+    right_side = np.einsum("spi,sp->si", weighted_design, kev)
+    coefficients = np.linalg.solve(normal_matrix, right_side[:, :, None])[:, :, 0]
+    coefficients_cov = np.linalg.inv(normal_matrix)
+
+    residuals = kev - np.einsum("spi,si->sp", design, coefficients)
+    # without known uncertainties the covariance is scaled with the spread of the residuals
+    if unweighted.any():
+        dof = n_peaks - (degree + 1)
+        residual_variance = (residuals**2).sum(axis=1) / dof if dof > 0 else np.full(n_spectra, np.nan)
+        coefficients_cov[unweighted] *= residual_variance[unweighted, None, None]
+
+    # keV = c0 + c1 * channel = (channel - offset) * dispersion
+    c0, c1 = coefficients[:, 0], coefficients[:, 1]
+    var_c0, var_c1, cov_c01 = coefficients_cov[:, 0, 0], coefficients_cov[:, 1, 1], coefficients_cov[:, 0, 1]
+    dispersion = c1
+    offset = -c0 / c1
+    # error propagation of offset = -c0 / c1
+    offset_variance = var_c0 / c1**2 + c0**2 * var_c1 / c1**4 - 2 * c0 * cov_c01 / c1**3
+
+    calibration = {
+        "dispersion": dispersion,
+        "offset": offset,
+        "dispersion_std": np.sqrt(var_c1),
+        "offset_std": np.sqrt(offset_variance),
+        "coefficients": coefficients,
+        "coefficients_cov": coefficients_cov,
+        "residuals": residuals,
+        "degree": degree,
+    }
+
+    if single:
+        calibration = {key: value if key == "degree" else value[0] for key, value in calibration.items()}
+        for key in ("dispersion", "offset", "dispersion_std", "offset_std"):
+            calibration[key] = float(calibration[key])
+        if print_info:
+            print(
+                f"The calibration factor is: {calibration['dispersion']:.07f} +- {calibration['dispersion_std']:.07f} keV/channel, "
+                f"with {calibration['offset']:.03f} +- {calibration['offset_std']:.03f} channels zero offset"
+            )
+            print(f"Residuals of the {n_peaks} peaks [keV]: {np.round(calibration['residuals'], 5)}")
+
+    return calibration
@@ -0,0 +1,393 @@
+# command line tool for calibrating whole datasets without the notebook
+#
+#     python -m helper_files.cli calibrate Lab3_data/SEM_known_Cu.msa --lines Cu-La,Cu-Ka --output SEM.cal
+#     python -m helper_files.cli apply --ref SEM.cal "Lab3_data/SEM_*.msa" --out-dir calibrated --jobs 4 --fit
+#
+# calibrate fits the given X-ray lines in a reference spectrum and saves the calibration as a .cal (json) file.
+# apply calibrates many files with it and saves each as .npz (see saving_json.py). The finished files are
+# written to progress.jsonl in the output folder, so an interrupted run continues where it stopped,
+# and summary.json has the drift of the calibration and the fitted lines over the whole dataset.
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from helper_files.calibration import Calibration, calibrate_least_squares
+from helper_files.peak_search import find_peaks, match_lines_to_peaks
+from helper_files.quantification import FWHM_PER_STD
+from helper_files.read_header import header_calibration
+from helper_files.saving_json import npz_filename, save_spectrum_to_npz
+from helper_files.spectrum_dict import init_known_spectrum
+from helper_files.streaming import stream_spectra
+from helper_files.xray_lines import default_line_index
+
+logger = logging.getLogger("helper_files.cli")
+
+
+def quietly(func, *args, **kwargs):
+    """
+    Runs one of the helper functions, logging what it prints at the debug level instead.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = func(*args, **kwargs)
+    for line in output.getvalue().splitlines():
+        if line.strip():
+            logger.debug(line)
+    return result
+
+
+def expand_filepaths(patterns):
+    """The files of the arguments, where glob patterns are expanded (for shells which does not)."""
+    filepaths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        filepaths.extend(matches if matches else [pattern])
+    return filepaths
+
+
+def guess_line_channels(s, peaks_keV):
+    """
+    Where the lines are in the reference spectrum, before fitting.
+    Uses the calibration in the header if there is one, else the lines are matched with the found peaks.
+
+    Returns
+    -------
+    tuple
+        guessed channels, widths [channels] and amplitudes (for the intensity), or None
+    """
+    peaks = find_peaks(s["counts"])
+    calibration = header_calibration(s["header"]) if s.get("header") is not None else None
+    if calibration is not None:
+        logger.info("Using the calibration in the header to find the lines")
+        expected = Calibration(*calibration).to_channel(peaks_keV)
+        index = np.clip(np.rint(expected).astype(int), 0, len(s["counts"]) - 1)
+        # the width of the closest found peak, or 2 channels
+        std = np.full(len(expected), 2.0)
+        if len(peaks["channel"]):
+            closest = np.argmin(np.abs(peaks["channel"][None, :] - expected[:, None]), axis=1)
+            std = peaks["std"][closest]
+        return expected, std, s["intensity"][index]
+
+    if len(peaks_keV) < 2:
+        return None
+    matched = match_lines_to_peaks(peaks, peaks_keV, len(s["counts"]))
+    if matched is None:
+        return None
+    logger.info(f"Found the lines at channels {np.round(matched['channel'], 1).tolist()}")
+    return matched["channel"], matched["std"], matched["amp"]
+
+
+def calibrate(args):
+    """The calibrate command, see main."""
+    from helper_files.gaussian_fitting import fit_n_peaks_to_gaussian
+
+    index = default_line_index()
+    lines = [line.strip() for line in args.lines.split(",")]
+    try:
+        peaks_keV = index.energy_of(lines)
+    except KeyError as error:
+        logger.error(error.args[0])
+        return 1
+    if len(lines) < 2:
+        logger.error("At least two lines are needed for a calibration")
+        return 1
+
+    name = os.path.splitext(os.path.basename(args.reference))[0]
+    s = quietly(
+        init_known_spectrum,
+        name=name,
+        filepath=args.reference,
+        peaks_keV=peaks_keV,
+        peaks_names=lines,
+        cache_dir=args.cache_dir,
+    )
+    if s is None:
+        logger.error(f"Could not read {args.reference}")
+        return 1
+
+    if args.peaks:
+        guessed = [float(value) for value in args.peaks.split(",")]
+        if len(guessed) != len(lines):
+            logger.error(f"--peaks has {len(guessed)} channels, but there are {len(lines)} lines")
+            return 1
+        guess = (np.array(guessed), 2.0, s["intensity"][np.rint(guessed).astype(int)])
+    else:
+        guess = guess_line_channels(s, peaks_keV)
+        if guess is None:
+            logger.error("Could not find the lines in the spectrum, give their channels with --peaks")
+            return 1
+    guessed_channel, guessed_std, guessed_amp = guess
+
+    try:
+        s["fit_params"], s["fit_cov"] = fit_n_peaks_to_gaussian(
+            s["channel"], s["intensity"], guessed_channel, guessed_std, guessed_amp, window=args.window, bounded=True
+        )
+    except (RuntimeError, ValueError) as error:
+        logger.error(f"The fit of the lines failed: {error}")
+        return 1
+    s["peaks_channel"] = s["fit_params"][1::3]
+
+    calibration = calibrate_least_squares(s["peaks_channel"], peaks_keV, fit_cov=s["fit_cov"], print_info=False)
+    logger.info(
+        f"Calibrated {args.reference}: {calibration['dispersion']:.07f} +- {calibration['dispersion_std']:.07f} keV/channel, "
+        f"offset {calibration['offset']:.03f} +- {calibration['offset_std']:.03f} channels"
+    )
+
+    output = args.output if args.output else f"{name}.cal"
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "reference": args.reference,
+                "name": name,
+                "lines": lines,
+                "peaks_keV": list(peaks_keV),
+                "peaks_channel": s["peaks_channel"].tolist(),
+                "fit_params": s["fit_params"].tolist(),
+                "dispersion": calibration["dispersion"],
+                "offset": calibration["offset"],
+                "dispersion_std": calibration["dispersion_std"],
+                "offset_std": calibration["offset_std"],
+                "residuals_keV": calibration["residuals"].tolist(),
+                "n_channels": len(s["counts"]),
+                "start_str": s["start_str"],
+                "stop_str": s["stop_str"],
+                "line_endings": s["line_endings"],
+                "delimiter": s["delimiter"],
+            },
+            f,
+            indent=4,
+        )
+    logger.info(f"Saved the calibration to {output}")
+    # the only output on stdout, so it can be used in scripts
+    print(output)
+    return 0
+
+
+def read_progress(progress_file):
+    """The records of the files which are done, {absolute path: record}, from progress.jsonl."""
+    done = {}
+    if os.path.exists(progress_file):
+        with open(progress_file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be cut if the run was killed while writing
+                    continue
+                done[record["path"]] = record
+    return done
+
+
+def is_done(record, filepath):
+    """If the file was calibrated before, and has not changed since."""
+    if record is None or record["status"] != "ok":
+        return False
+    stat = os.stat(filepath)
+    return record["mtime_ns"] == stat.st_mtime_ns and record["size"] == stat.st_size
+
+
+def new_record(path, status="ok", error=None):
+    """
+    The progress record of a file, with the size and modification time it had when it was calibrated.
+    A file which can not be found any more, eg deleted while running, is a failed record.
+    """
+    record = {
+        "path": os.path.abspath(path),
+        "mtime_ns": None,
+        "size": None,
+        "status": status,
+        "error": error,
+        "output": None,
+        "centroid_keV": None,
+        "fwhm_keV": None,
+    }
+    try:
+        stat = os.stat(path)
+        record["mtime_ns"], record["size"] = stat.st_mtime_ns, stat.st_size
+    except OSError as stat_error:
+        record["status"] = "failed"
+        record["error"] = error if error is not None else f"{type(stat_error).__name__}: {stat_error}"
+    return record
+
+
+def summarize(records, lines):
+    """
+    The summary of all calibrated files, with the spread of the fitted lines over the dataset.
+
+    Returns
+    -------
+    dict
+        n_files, n_ok, n_failed, the failed files, and for each line the mean, std, min and max
+        of the centroid and FWHM [keV]
+    """
+    ok = [record for record in records.values() if record["status"] == "ok"]
+    summary = {
+        "n_files": len(records),
+        "n_ok": len(ok),
+        "n_failed": len(records) - len(ok),
+        "failed": {record["path"]: record["error"] for record in records.values() if record["status"] != "ok"},
+        "lines": {},
+    }
+    fitted = [record for record in ok if record.get("centroid_keV") is not None]
+    if fitted:
+        centroid = np.array([record["centroid_keV"] for record in fitted])
+        fwhm = np.array([record["fwhm_keV"] for record in fitted])
+        for i, line in enumerate(lines):
+            summary["lines"][line] = {
+                "centroid_keV_mean": float(np.mean(centroid[:, i])),
+                "centroid_keV_std": float(np.std(centroid[:, i])),
+                "centroid_keV_min": float(np.min(centroid[:, i])),
+                "centroid_keV_max": float(np.max(centroid[:, i])),
+                "fwhm_keV_mean": float(np.mean(fwhm[:, i])),
+            }
+    return summary
+
+
+def apply(args):
+    """The apply command, see main."""
+    with open(args.ref) as f:
+        ref = json.load(f)
+    calibration = Calibration(ref["dispersion"], ref["offset"])
+
+    # the reference as a known spectrum for stream_spectra, without reading it again
+    known_spectrum = {
+        "name": ref["name"],
+        "counts": np.zeros(ref["n_channels"]),
+        "dispersion": ref["dispersion"],
+        "offset": ref["offset"],
+        "fit_params": np.array(ref["fit_params"]),
+        "peaks_keV": ref["peaks_keV"],
+        "peaks_names": ref["lines"],
+        "start_str": ref["start_str"],
+        "stop_str": ref["stop_str"],
+        "line_endings": ref["line_endings"],
+        "delimiter": ref["delimiter"],
+    }
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    progress_file = os.path.join(args.out_dir, "progress.jsonl")
+    if args.restart and os.path.exists(progress_file):
+        os.remove(progress_file)
+    records = read_progress(progress_file)
+
+    filepaths = expand_filepaths(args.files)
+    # the files which are not calibrated, with the reason
+    rejected = []
+    # the .npz files are named after the input files, so eg a/x.msa and b/x.msa would overwrite each other,
+    # the first one keeps the name, and the others are failed
+    outputs = {
+        record["output"]: path for path, record in records.items() if record["status"] == "ok" and record["output"]
+    }
+    todo = []
+    for path in filepaths:
+        if not os.path.isfile(path):
+            rejected.append((path, "is a directory" if os.path.isdir(path) else "does not exist"))
+            continue
+        output = npz_filename(path, args.out_dir)
+        owner = outputs.setdefault(output, os.path.abspath(path))
+        if owner != os.path.abspath(path):
+            rejected.append((path, f"the output {output} is already used for {owner}"))
+        elif not is_done(records.get(os.path.abspath(path)), path):
+            todo.append(path)
+    n_skipped = len(filepaths) - len(rejected) - len(todo)
+    logger.info(f"{len(filepaths)} files, {n_skipped} already calibrated, {len(todo)} to do")
+
+    n_failed = 0
+    with open(progress_file, "a") as progress:
+
+        def write_record(record):
+            records[record["path"]] = record
+            progress.write(json.dumps(record) + "\n")
+            # flushed for each file, so the progress is kept if the run is stopped
+            progress.flush()
+
+        for path, error in rejected:
+            n_failed += 1
+            logger.warning(f"{path}: {error}")
+            write_record(new_record(path, status="failed", error=error))
+
+        results = stream_spectra(
+            todo, known_spectrum, fit=args.fit, window=args.window, n_workers=args.jobs, max_pending=4 * args.jobs
+        )
+        for i, s in enumerate(results, 1):
+            path = s["name"]
+            record = new_record(path, error=s["error"])
+            if s["counts"] is None or (s["error"] is not None and s["fit_params"] is None and args.fit):
+                record["status"] = "failed"
+            elif record["status"] == "ok":
+                try:
+                    record["output"] = quietly(save_spectrum_to_npz, s, args.out_dir)
+                except OSError as error:
+                    record["status"], record["error"] = "failed", f"{type(error).__name__}: {error}"
+                if s["fit_params"] is not None:
+                    record["centroid_keV"] = calibration.to_keV(s["fit_params"][1::3]).tolist()
+                    record["fwhm_keV"] = (np.abs(s["fit_params"][2::3]) * FWHM_PER_STD * ref["dispersion"]).tolist()
+            if record["status"] == "failed":
+                n_failed += 1
+                logger.warning(f"{path}: {record['error']}")
+
+            write_record(record)
+            if i % 100 == 0:
+                logger.info(f"{i} / {len(todo)} files")
+
+    summary = summarize(records, ref["lines"])
+    summary_file = os.path.join(args.out_dir, "summary.json")
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=4)
+
+    logger.info(
+        f"Calibrated {len(todo) + len(rejected) - n_failed} files, skipped {n_skipped}, {n_failed} failed. "
+        f"In total {summary['n_ok']} of {summary['n_files']} files are calibrated"
+    )
+    for line, values in summary["lines"].items():
+        logger.info(
+            f"{line:<8} centroid {values['centroid_keV_mean']:.4f} +- {values['centroid_keV_std']:.4f} keV, "
+            f"FWHM {values['fwhm_keV_mean']:.4f} keV"
+        )
+    logger.info(f"Saved the summary to {summary_file}")
+    return 1 if n_failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m helper_files.cli", description="Calibrate spectra from the command line."
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="also log what the helper functions print")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only log warnings and errors")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    calibrate_parser = commands.add_parser("calibrate", help="calibrate a reference spectrum with known lines")
+    calibrate_parser.add_argument("reference", help="the reference spectrum, eg Lab3_data/SEM_known_Cu.msa")
+    calibrate_parser.add_argument("--lines", required=True, help="comma separated lines, eg Cu-La,Cu-Ka")
+    calibrate_parser.add_argument("--peaks", help="comma separated channels of the lines, if they are not found")
+    calibrate_parser.add_argument("--window", type=float, default=20, help="channels around the lines to fit")
+    calibrate_parser.add_argument("--output", help="the .cal file to save, by default <reference name>.cal")
+    calibrate_parser.add_argument("--cache-dir", help="folder to cache the parsed spectra in")
+    calibrate_parser.set_defaults(func=calibrate)
+
+    apply_parser = commands.add_parser("apply", help="calibrate many spectra with a .cal file")
+    apply_parser.add_argument("files", nargs="+", help="the spectra, or glob patterns like 'data/*.msa'")
+    apply_parser.add_argument("--ref", required=True, help="the .cal file from calibrate")
+    apply_parser.add_argument("--out-dir", default="calibrated", help="folder for the .npz files and the summary")
+    apply_parser.add_argument("--jobs", type=int, default=1, help="number of processes")
+    apply_parser.add_argument("--fit", action="store_true", help="also fit the reference lines in each spectrum")
+    apply_parser.add_argument("--window", type=float, default=20, help="channels around the lines to fit")
+    apply_parser.add_argument("--restart", action="store_true", help="start over, instead of continuing")
+    apply_parser.set_defaults(func=apply)
+
+    args = parser.parse_args(argv)
+    level = logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
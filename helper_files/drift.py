@@ -0,0 +1,255 @@
+# helper file for following the drift of the detector calibration over a long series of spectra
+# each new spectrum is calibrated from the calibration of the spectrum before,
+# by fitting only the known lines in narrow windows, instead of a full fit of the spectrum
+
+import numpy as np
+
+from helper_files.calibration import Calibration, calibrate_least_squares
+
+
+def cross_correlation_shift(reference, counts, max_shift=None):
+    """
+    The shift in channels of one or many spectra compared to a reference spectrum,
+    from the maximum of the cross-correlation, which is calculated with FFT.
+    The maximum is interpolated with a parabola, so the shift is not only whole channels.
+    Only finds a shift of the whole spectrum, not a change of the dispersion.
+
+    Parameters
+    ----------
+    reference : np.array
+        counts of the reference spectrum
+    counts : np.array
+        counts of the spectrum, 1d or (n_spectra, n_channels)
+    max_shift : int, optional
+        largest shift to look for in channels, by default None which is half the channels
+
+    Returns
+    -------
+    float or np.array
+        the shift, positive when the peaks in counts are at higher channels than in the reference
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    n_channels = len(reference)
+    if max_shift is None:
+        max_shift = n_channels // 2
+
+    # zero padding to 2n, so the spectrum does not wrap around at the ends
+    n_fft = 2 * n_channels
+    reference_fft = np.fft.rfft(reference - reference.mean(), n_fft)
+    counts_fft = np.fft.rfft(counts - counts.mean(axis=-1, keepdims=True), n_fft)
+    correlation = np.fft.irfft(counts_fft * np.conj(reference_fft), n_fft)
+
+    # the shifts -max_shift to max_shift, the negative ones are at the end of the array
+    lags = np.arange(-max_shift, max_shift + 1)
+    correlation = correlation[..., lags]
+    best = np.argmax(correlation, axis=-1)
+
+    # parabola through the maximum and the two neighbours
+    inside = np.clip(best, 1, len(lags) - 2)
+    left = np.take_along_axis(correlation, (inside - 1)[..., None], axis=-1)[..., 0]
+    middle = np.take_along_axis(correlation, inside[..., None], axis=-1)[..., 0]
+    right = np.take_along_axis(correlation, (inside + 1)[..., None], axis=-1)[..., 0]
+    curvature = left - 2 * middle + right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        step = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.0)
+    shift = lags[inside] + np.clip(step, -1, 1)
+    return shift[()] if np.ndim(shift) == 0 else shift
+
+
+class DriftTracker:
+    """
+    Follows the calibration of the detector over time, starting from a calibrated known spectrum.
+    For each new spectrum, the known lines (peaks_keV) are expected at the channels given by the
+    calibration of the spectrum before. Each line is fitted with one gaussian in a narrow window
+    around that channel, and the new dispersion and offset come from calibrate_least_squares.
+    When a fit fails, or there is only one line, the offset is found from the cross-correlation
+    with the known spectrum instead, which is only valid with the dispersion of the known spectrum,
+    so the dispersion is set back to it.
+
+    Parameters
+    ----------
+    known_spectrum : dict
+        a fitted and calibrated spectrum dictionary, with peaks_keV
+    window : float, optional
+        channels on each side of the expected line to fit, by default 10
+    max_dispersion_drift : float, optional
+        flag spectra where the dispersion has changed more than this, relative to the known spectrum,
+        by default 0.005 (0.5 %)
+    max_offset_drift : float, optional
+        flag spectra where the offset has changed more than this many channels, by default 2.0
+    """
+
+    def __init__(self, known_spectrum, window=10, max_dispersion_drift=0.005, max_offset_drift=2.0):
+        for key in ("dispersion", "offset", "peaks_keV", "fit_params"):
+            if known_spectrum.get(key) is None:
+                raise ValueError(f"The known_spectrum {known_spectrum['name']} has no {key}")
+        self.known_name = known_spectrum["name"]
+        self.reference_counts = np.asarray(known_spectrum["counts"], dtype=np.float64)
+        self.peaks_keV = np.asarray(known_spectrum["peaks_keV"], dtype=np.float64)
+        self.peaks_names = known_spectrum.get("peaks_names")
+
+        # the width of each known line, from the fit of the known spectrum
+        n_lines = len(self.peaks_keV)
+        self.peaks_std = np.abs(np.asarray(known_spectrum["fit_params"], dtype=np.float64)[2 : 3 * n_lines : 3])
+        if len(self.peaks_std) != n_lines:
+            raise ValueError(
+                f"The known_spectrum {known_spectrum['name']} has {n_lines} peaks_keV, "
+                f"but only {len(self.peaks_std)} fitted peaks"
+            )
+
+        self.window = window
+        self.max_dispersion_drift = max_dispersion_drift
+        self.max_offset_drift = max_offset_drift
+
+        self.reference_dispersion = float(known_spectrum["dispersion"])
+        self.reference_offset = float(known_spectrum["offset"])
+        # the latest calibration, which the next spectrum starts from
+        self.dispersion = self.reference_dispersion
+        self.offset = self.reference_offset
+
+        # the time series, one entry per spectrum, see history
+        self._history = {key: [] for key in ("name", "time", "dispersion", "offset", "flagged", "method")}
+
+    def fit_lines(self, counts):
+        """
+        Fits each known line in a window around where the current calibration expects it.
+
+        Parameters
+        ----------
+        counts : np.array
+            the counts of the spectrum
+
+        Returns
+        -------
+        tuple
+            the fitted centers [channels] and their variances, or None if a fit failed
+        """
+        # imported here, so only the drift tracking needs scipy
+        from helper_files.gaussian_fitting import fit_n_peaks_to_gaussian
+
+        intensity = counts / counts.max()
+        channel = np.arange(len(counts))
+        expected = Calibration(self.dispersion, self.offset).to_channel(self.peaks_keV)
+
+        centers = np.empty(len(expected))
+        variances = np.empty(len(expected))
+        for i, (center, std) in enumerate(zip(expected, self.peaks_std)):
+            index = int(np.clip(np.rint(center), 0, len(counts) - 1))
+            try:
+                fit_params, fit_cov = fit_n_peaks_to_gaussian(
+                    channel,
+                    intensity,
+                    [center],
+                    guessed_std=std,
+                    guessed_amp=intensity[index],
+                    window=self.window,
+                    bounded=True,
+                )
+            except (RuntimeError, ValueError):
+                return None
+            centers[i], variances[i] = fit_params[1], fit_cov[1, 1]
+        if not np.all(np.isfinite(variances)) or np.any(variances <= 0):
+            return None
+        return centers, variances
+
+    def update(self, counts, time=None, name=None):
+        """
+        Finds the calibration of a new spectrum, and adds it to the time series.
+
+        Parameters
+        ----------
+        counts : np.array
+            the counts of the spectrum, with the same channels as the known spectrum
+        time : float, optional
+            when the spectrum was measured, by default None which uses the number of the spectrum
+        name : string, optional
+            name of the spectrum, by default None
+
+        Returns
+        -------
+        dict
+            dispersion, offset, dispersion_drift (relative), offset_drift [channels], flagged and method
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        if len(counts) != len(self.reference_counts):
+            raise ValueError(
+                f"The known spectrum has {len(self.reference_counts)} channels, while this one has {len(counts)}"
+            )
+
+        fitted = self.fit_lines(counts) if len(self.peaks_keV) >= 2 else None
+        if fitted is not None:
+            centers, variances = fitted
+            # calibrate_least_squares takes the covariance of [amp, mu, std] for each peak
+            n_lines = len(centers)
+            fit_cov = np.zeros((3 * n_lines, 3 * n_lines))
+            fit_cov[3 * np.arange(n_lines) + 1, 3 * np.arange(n_lines) + 1] = variances
+            calibration = calibrate_least_squares(centers, self.peaks_keV, fit_cov=fit_cov, print_info=False)
+            self.dispersion, self.offset = calibration["dispersion"], calibration["offset"]
+            method = "line fit"
+        else:
+            # the shift is from the known spectrum, so it gives the offset with the known dispersion
+            shift = cross_correlation_shift(self.reference_counts, counts)
+            self.dispersion = self.reference_dispersion
+            self.offset = self.reference_offset + float(shift)
+            method = "cross-correlation"
+
+        dispersion_drift = self.dispersion / self.reference_dispersion - 1
+        offset_drift = self.offset - self.reference_offset
+        flagged = abs(dispersion_drift) > self.max_dispersion_drift or abs(offset_drift) > self.max_offset_drift
+
+        history = self._history
+        history["name"].append(name)
+        history["time"].append(len(history["time"]) if time is None else time)
+        history["dispersion"].append(self.dispersion)
+        history["offset"].append(self.offset)
+        history["flagged"].append(flagged)
+        history["method"].append(method)
+
+        return {
+            "dispersion": self.dispersion,
+            "offset": self.offset,
+            "dispersion_drift": dispersion_drift,
+            "offset_drift": offset_drift,
+            "flagged": flagged,
+            "method": method,
+        }
+
+    def calibrate_spectrum(self, s, time=None):
+        """
+        Updates the tracker with a spectrum dictionary, and sets its dispersion, offset and kev_calibrated.
+        Used instead of init_unknown_spectrum_with_known, when the detector may have drifted.
+
+        Parameters
+        ----------
+        s : dict
+            spectrum dictionary
+        time : float, optional
+            see update, by default None
+
+        Returns
+        -------
+        dict
+            the same spectrum dictionary, with 'drift' from update
+        """
+        drift = self.update(s["counts"], time=time, name=s["name"])
+        s["dispersion"], s["offset"] = drift["dispersion"], drift["offset"]
+        # made for this spectrum, since a drifted calibration is not shared with other spectra
+        s["kev_calibrated"] = Calibration(s["dispersion"], s["offset"]).to_keV(np.arange(len(s["counts"])))
+        s["drift"] = drift
+        return s
+
+    def history(self):
+        """
+        The time series of the calibration, as columns with one entry per spectrum.
+
+        Returns
+        -------
+        dict
+            name, time, dispersion, offset, flagged and method as np.arrays
+        """
+        return {key: np.array(values) for key, values in self._history.items()}
+
+    def flagged(self):
+        """The names of the spectra which has drifted more than the thresholds."""
+        return [name for name, flagged in zip(self._history["name"], self._history["flagged"]) if flagged]
@@ -1,8 +1,8 @@
 # this is the helper file for the gaussian fitting
 
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-from scipy.optimize import curve_fit
-from scipy.stats import norm
 
 
 def gaussian(x, amp, mu, std):
@@ -47,11 +47,41 @@ def n_gaussians(x, *args):
     List or np.array
         The n gaussian function with the given parameters over the given x values.
     """
-    n = int(len(args) / 3)
-    y = np.zeros(len(x))
-    for i in range(n):
-        y += gaussian(x, args[3 * i], args[3 * i + 1], args[3 * i + 2])
-    return y
+    # all the peaks are made at once, as a (n_peaks, n_x) array which is summed over the peaks
+    amp, mu, std = np.reshape(args, (-1, 3)).T[:, :, None]
+    x = np.asarray(x, dtype=np.float64)
+    return (amp * np.exp(-((x - mu) ** 2) / (2 * std**2))).sum(axis=0)
+
+
+def n_gaussians_jacobian(x, *args):
+    """
+    The analytic derivatives of n_gaussians with respect to each parameter,
+    used by curve_fit instead of finite differences.
+
+    Parameters
+    ----------
+    x : list or np.array
+        The channel values where the gaussian is made.
+    *args : list or np.array
+        The parameters for the gaussians, must be in the order:
+        [amp1, peak1, std1, amp2, peak2, std2, ...]
+
+    Returns
+    -------
+    np.array
+        (n_x, 3 * n_peaks) array, with [d/d_amp1, d/d_peak1, d/d_std1, d/d_amp2, ...] in each row
+    """
+    amp, mu, std = np.reshape(args, (-1, 3)).T[:, :, None]
+    x = np.asarray(x, dtype=np.float64)
+    distance = x - mu
+    exp = np.exp(-(distance**2) / (2 * std**2))
+
+    # g = amp * exp(-(x - mu)^2 / (2 std^2))
+    jacobian = np.empty((len(amp), 3, len(x)))
+    jacobian[:, 0] = exp  # dg/d_amp
+    jacobian[:, 1] = amp * exp * distance / std**2  # dg/d_mu
+    jacobian[:, 2] = amp * exp * distance**2 / std**3  # dg/d_std
+    return jacobian.reshape(-1, len(x)).T
 
 
 # now we need a functions which fits peak guesses to gaussian curves
@@ -61,6 +91,8 @@ def fit_n_peaks_to_gaussian(
     guessed_peaks,
     guessed_std=1,
     guessed_amp=1,
+    window=None,
+    bounded=False,
 ):
     """
     Fits n peaks to n gaussians, given an array and the guessed centers.
@@ -70,6 +102,9 @@ def fit_n_peaks_to_gaussian(
     which means that it tries to find the parameters that minimize the sum of the squares of the residuals.
     The residuals are the difference between the data and the model.
     The model is the sum of the gaussians, and the parameters are the amplitudes, means and standard deviations of the gaussians.
+    The derivatives of the model are given to curve_fit (see n_gaussians_jacobian).
+    With bounded=True the amplitudes and widths must be positive, and the centers inside the fitted range,
+    which makes curve_fit use the 'trf' method instead of 'lm', so the result can differ a little.
 
     Parameters
     ----------
@@ -83,36 +118,191 @@ def fit_n_peaks_to_gaussian(
         Initial guess of the amplitude, and not that important, by default 1
     guess_wid : int, optional
         Initial guess of the width, and not that important, by default 1
+    window : float, optional
+        only fit the x values from window below the lowest peak to window above the highest peak,
+        by default None which fits all x values
+    bounded : bool, optional
+        keep amp >= 0, std > 0 and the peaks inside the fitted x values, by default False
     Returns
     -------
     np.array
         The fitted param [[amp, peak, std], covar].
     """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    guessed_peaks = np.asarray(guessed_peaks, dtype=np.float64)
+    n_peaks = len(guessed_peaks)
+
+    # only the part of the spectrum around the peaks is fitted
+    if window is not None:
+        in_window = (x >= guessed_peaks.min() - window) & (x <= guessed_peaks.max() + window)
+        x = x[in_window]
+        y = y[in_window]
+        if len(x) < 3 * n_peaks:
+            raise ValueError(
+                f"Only {len(x)} x values are within window={window} of the guessed peaks {guessed_peaks.tolist()}, "
+                f"at least {3 * n_peaks} are needed to fit {n_peaks} gaussians"
+            )
+
+    # making the list of the initial guesses, [amp1, peak1, std1, amp2, ...]
     # the std and amp are usually fine as 1 in the initial guess
-    if guessed_std == 1:
-        guessed_std = np.ones(len(guessed_peaks))
-    if guessed_amp == 1:
-        guessed_amp = np.ones(len(guessed_peaks))
-
-    # making the list of the initial guesses
-    for i in range(len(guessed_peaks)):
-        if i == 0:
-            init_vals = [guessed_amp[i], guessed_peaks[i], guessed_std[i]]
-        else:
-            init_vals += [guessed_amp[i], guessed_peaks[i], guessed_std[i]]
+    init_vals = np.empty((n_peaks, 3))
+    init_vals[:, 0] = np.broadcast_to(guessed_amp, n_peaks)
+    init_vals[:, 1] = guessed_peaks
+    init_vals[:, 2] = np.broadcast_to(guessed_std, n_peaks)
+
+    if bounded:
+        # amp >= 0, the peak inside the fitted range and 0 < std < the fitted range
+        x_span = x.max() - x.min()
+        lower = np.tile([0, x.min(), 1e-6 * x_span], n_peaks)
+        upper = np.tile([np.inf, x.max(), x_span], n_peaks)
+        init_vals = np.clip(init_vals.ravel(), lower, upper)
+        bounds = (lower, upper)
+    else:
+        init_vals = init_vals.ravel()
+        bounds = (-np.inf, np.inf)
+
+    # scipy is imported on the first fit, so reading and calibrating does not need it
+    from scipy.optimize import curve_fit
+
     # fitting the data to the gaussians
-    fit_vals, covar = curve_fit(n_gaussians, x, y, p0=init_vals)
+    fit_vals, covar = curve_fit(
+        n_gaussians, x, y, p0=init_vals, jac=n_gaussians_jacobian, bounds=bounds
+    )
     return [fit_vals, covar]
 
 
+def fit_series_chunk(x, y_series, guessed_params, window=None, bounded=True):
+    """
+    Fits the same peaks in each spectrum of y_series, one after the other.
+    Each fit starts from the fitted parameters of the spectrum before,
+    since the peaks move very little from one spectrum to the next.
+    Used by fit_n_peaks_to_gaussian_batch.
+
+    Parameters
+    ----------
+    x : np.array
+        x values to fit the gaussians to, the same for all spectra
+    y_series : np.array
+        (n_spectra, n_x) array with the spectra
+    guessed_params : np.array
+        [amp1, peak1, std1, amp2, ...] used as the guess for the first spectrum
+    window : float, optional
+        see fit_n_peaks_to_gaussian, by default None
+    bounded : bool, optional
+        see fit_n_peaks_to_gaussian, by default True
+
+    Returns
+    -------
+    list
+        [fit_params, fit_cov] with shapes (n_spectra, 3 * n_peaks) and (n_spectra, 3 * n_peaks, 3 * n_peaks),
+        nan for the spectra where the fit failed
+    """
+    n_params = len(guessed_params)
+    fit_params = np.full((len(y_series), n_params), np.nan)
+    fit_cov = np.full((len(y_series), n_params, n_params), np.nan)
+
+    start_params = guessed_params
+    for i, y in enumerate(y_series):
+        try:
+            fit_params[i], fit_cov[i] = fit_n_peaks_to_gaussian(
+                x,
+                y,
+                guessed_peaks=start_params[1::3],
+                guessed_std=start_params[2::3],
+                guessed_amp=start_params[0::3],
+                window=window,
+                bounded=bounded,
+            )
+        except (RuntimeError, ValueError):
+            # the fit failed, the next spectrum starts from the original guess again
+            start_params = guessed_params
+            continue
+        start_params = fit_params[i]
+    return [fit_params, fit_cov]
+
+
+def fit_n_peaks_to_gaussian_batch(
+    x,
+    y_batch,
+    guessed_peaks,
+    guessed_std=1,
+    guessed_amp=1,
+    window=None,
+    bounded=True,
+    n_workers=None,
+):
+    """
+    Fits the same n peaks in many spectra, eg to follow the drift of the detector in a long series.
+    Each fit is started from the result of the spectrum before (see fit_series_chunk).
+    With n_workers > 1 the series is split in n_workers consecutive parts,
+    which are fitted in parallel processes.
+
+    Parameters
+    ----------
+    x : list or np.array
+        x values to fit the gaussians to, the same for all spectra
+    y_batch : np.array
+        (n_spectra, n_x) array with the spectra, eg SpectrumCollection.intensity()
+    guessed_peaks : list or np.array
+        Inital guesses of the n peaks in the first spectrum
+    guessed_std : float or list, optional
+        Initial guess of the width, by default 1
+    guessed_amp : float or list, optional
+        Initial guess of the amplitude, by default 1
+    window : float, optional
+        see fit_n_peaks_to_gaussian, by default None
+    bounded : bool, optional
+        see fit_n_peaks_to_gaussian, by default True
+    n_workers : int, optional
+        number of processes, by default None which fits all in this process
+
+    Returns
+    -------
+    list
+        [fit_params, fit_cov], where fit_params has shape (n_spectra, 3 * n_peaks)
+        and fit_cov has shape (n_spectra, 3 * n_peaks, 3 * n_peaks). Failed fits are nan.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y_batch = np.atleast_2d(np.asarray(y_batch, dtype=np.float64))
+    n_peaks = len(guessed_peaks)
+
+    guessed_params = np.empty((n_peaks, 3))
+    guessed_params[:, 0] = np.broadcast_to(guessed_amp, n_peaks)
+    guessed_params[:, 1] = guessed_peaks
+    guessed_params[:, 2] = np.broadcast_to(guessed_std, n_peaks)
+    guessed_params = guessed_params.ravel()
+
+    if n_workers is None or n_workers <= 1 or len(y_batch) < 2 * n_workers:
+        return fit_series_chunk(x, y_batch, guessed_params, window, bounded)
+
+    # consecutive parts, so the spectra in each part are still next to each other in time
+    chunks = np.array_split(y_batch, n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(
+            executor.map(
+                fit_series_chunk,
+                [x] * n_workers,
+                chunks,
+                [guessed_params] * n_workers,
+                [window] * n_workers,
+                [bounded] * n_workers,
+            )
+        )
+    fit_params = np.concatenate([result[0] for result in results])
+    fit_cov = np.concatenate([result[1] for result in results])
+    return [fit_params, fit_cov]
+
+
+# erf(3 / sqrt(2)), the part of a gaussian between -3 and +3 sigma
+AREA_WITHIN_3_SIGMA = 0.9973002039367398
+
+
 def area_under_peak(peak_channel, peak_sigma, peak_height):
     """Calculates the area under the peak, using the peak sigma and height.
-    The area is calculated using the cumulative distribution function of a normal distribution,
-    calculating the area between peak-3*sigma and peak+3*sigma.
+    The area between peak-3*sigma and peak+3*sigma of a gaussian with amplitude peak_height is
+    peak_height * sigma * sqrt(2 pi) * erf(3 / sqrt(2)), which is 99.73 % of the total area.
+    Works on single values and arrays. peak_channel is not needed, but kept so old calls still work.
+    For the total area with uncertainties, see quantification.peak_areas.
     """
-    integrate_area = 3 * peak_sigma
-    area = norm.cdf(
-        peak_channel + integrate_area, loc=peak_channel, scale=peak_sigma
-    ) - norm.cdf(peak_channel - integrate_area, peak_channel, peak_sigma)
-    area *= peak_height
-    return area
+    return peak_height * np.abs(peak_sigma) * np.sqrt(2 * np.pi) * AREA_WITHIN_3_SIGMA
@@ -0,0 +1,202 @@
+# helper file for finding the peaks in a spectrum automatically
+# gives the guesses for peaks_channel, so they do not have to be found by looking at the plot
+
+import numpy as np
+
+
+def second_derivative_kernel(width):
+    """
+    The negative second derivative of a gaussian with standard deviation width,
+    which gives a positive response on peaks and zero on flat or straight backgrounds.
+
+    Parameters
+    ----------
+    width : float
+        standard deviation of the smoothing gaussian, in channels
+
+    Returns
+    -------
+    np.array
+        the kernel, with sum 0
+    """
+    half_length = int(np.ceil(4 * width))
+    i = np.arange(-half_length, half_length + 1, dtype=np.float64)
+    kernel = (1 - i**2 / width**2) * np.exp(-(i**2) / (2 * width**2))
+    # the cut tails make the sum a little off from 0, which would give a response on the background
+    kernel -= kernel.mean()
+    return kernel
+
+
+def find_peaks(counts, width=2.0, threshold=5.0, max_peaks=None):
+    """
+    Finds the peaks in a spectrum with the smoothed second derivative method.
+    The counts are convolved with the negative second derivative of a gaussian,
+    which is large where the spectrum curves down, ie on the peaks.
+    Since the counts are Poisson distributed, the variance of the convolution is the
+    counts convolved with the squared kernel, and a peak must be threshold standard deviations above 0.
+
+    Parameters
+    ----------
+    counts : np.array
+        the raw counts, not normalised, since the noise is found from them
+    width : float, optional
+        standard deviation of the smoothing in channels, about the std of the peaks, by default 2.0
+    threshold : float, optional
+        how many standard deviations of the noise a peak must be, by default 5.0
+    max_peaks : int, optional
+        only return the most significant peaks, by default None which returns all
+
+    Returns
+    -------
+    dict
+        peaks dictionary with np.arrays sorted by channel:
+        channel (centers), height (counts at the center), std (widths in channels),
+        amp (height / counts.max(), the amplitude for fitting on s['intensity']) and significance.
+        The arrays are empty if the spectrum is shorter than the smoothing kernel
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    kernel = second_derivative_kernel(width)
+    if len(counts) < len(kernel):
+        # too few channels to find a peak of this width, and np.convolve would give the length of the kernel
+        empty = np.empty(0)
+        return {"channel": empty, "height": empty, "std": empty, "amp": empty, "significance": empty}
+
+    # the filtered spectrum and its variance from the Poisson noise of the counts
+    response = np.convolve(counts, kernel, mode="same")
+    variance = np.convolve(counts, kernel**2, mode="same")
+    significance = response / np.sqrt(variance + 1)
+
+    # the peaks are local maxima of the response which are significant
+    is_max = np.zeros(len(counts), dtype=bool)
+    is_max[1:-1] = (response[1:-1] > response[:-2]) & (response[1:-1] >= response[2:])
+    candidates = np.flatnonzero(is_max & (significance > threshold))
+
+    if max_peaks is not None and len(candidates) > max_peaks:
+        most_significant = np.argsort(significance[candidates])[::-1][:max_peaks]
+        candidates = np.sort(candidates[most_significant])
+
+    # the center is found between the channels with a parabola through the three highest points
+    left, middle, right = response[candidates - 1], response[candidates], response[candidates + 1]
+    curvature = left - 2 * middle + right
+    shift = np.where(curvature < 0, 0.5 * (left - right) / np.where(curvature < 0, curvature, 1), 0)
+    channel = candidates + shift
+
+    # the response of a gaussian peak crosses 0 at center +- sqrt(std^2 + width^2),
+    # so the width of the peak is found from the zero crossings on each side
+    crossings = np.flatnonzero(np.diff(np.signbit(response)))
+    # interpolating the crossing between the channels
+    crossings = crossings + response[crossings] / (response[crossings] - response[crossings + 1])
+    if len(crossings) == 0:
+        total_width = np.full(len(channel), width)
+    else:
+        after = np.searchsorted(crossings, channel)
+        has_before = after > 0
+        has_after = after < len(crossings)
+        distance_before = np.where(has_before, channel - crossings[np.clip(after - 1, 0, None)], 0)
+        distance_after = np.where(has_after, crossings[np.clip(after, None, len(crossings) - 1)] - channel, 0)
+        # the mean of the distances on each side, or only one side at the ends of the spectrum
+        n_sides = has_before.astype(int) + has_after
+        total_width = np.where(n_sides > 0, (distance_before + distance_after) / np.maximum(n_sides, 1), width)
+    std = np.sqrt(np.clip(total_width**2 - width**2, 0.25, None))
+
+    height = counts[candidates]
+    return {
+        "channel": channel,
+        "height": height,
+        "std": std,
+        "amp": height / counts.max(),
+        "significance": significance[candidates],
+    }
+
+
+def find_peaks_in_spectrum(s, width=2.0, threshold=5.0, max_peaks=None):
+    """
+    Finds the peaks in a spectrum dictionary and puts the centers in s['peaks_channel'].
+    The result can be given directly to the fitting:
+
+    peaks = find_peaks_in_spectrum(s)
+    fit_n_peaks_to_gaussian(s['channel'], s['intensity'], peaks['channel'], peaks['std'], peaks['amp'])
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary
+    width : float, optional
+        see find_peaks, by default 2.0
+    threshold : float, optional
+        see find_peaks, by default 5.0
+    max_peaks : int, optional
+        see find_peaks, by default None
+
+    Returns
+    -------
+    dict
+        peaks dictionary, see find_peaks
+    """
+    peaks = find_peaks(s["counts"], width, threshold, max_peaks)
+    s["peaks_channel"] = peaks["channel"]
+    return peaks
+
+
+def match_lines_to_peaks(peaks, peaks_keV, n_channels, max_offset=0.1, max_candidates=20):
+    """
+    Finds which of the found peaks are the known lines, without any calibration.
+    Each pair of peaks is tried as the lowest and highest line, which gives a dispersion and offset,
+    and the pair where the other lines also land on significant peaks is used.
+    Pairs giving a negative dispersion, or an offset further than max_offset * n_channels from 0, are skipped.
+
+    Parameters
+    ----------
+    peaks : dict
+        peaks dictionary from find_peaks
+    peaks_keV : list of float
+        energies of the known lines, at least two
+    n_channels : int
+        number of channels in the spectrum
+    max_offset : float, optional
+        largest offset as a part of the channels, by default 0.1
+    max_candidates : int, optional
+        only the most significant peaks are tried, by default 20
+
+    Returns
+    -------
+    dict
+        peaks dictionary with one peak per line, in the order of peaks_keV, or None if no pair fits
+    """
+    peaks_keV = np.asarray(peaks_keV, dtype=np.float64)
+    if len(peaks_keV) < 2:
+        raise ValueError("At least two lines are needed to find them without a calibration")
+    order = np.argsort(peaks_keV)
+    sorted_keV = peaks_keV[order]
+
+    candidates = np.argsort(peaks["significance"])[::-1][:max_candidates]
+    channel = peaks["channel"][candidates]
+    significance = peaks["significance"][candidates]
+    tolerance = 3 * peaks["std"][candidates]
+
+    best_score, best = -np.inf, None
+    for low in range(len(candidates)):
+        for high in range(len(candidates)):
+            if channel[high] <= channel[low]:
+                continue
+            dispersion = (sorted_keV[-1] - sorted_keV[0]) / (channel[high] - channel[low])
+            offset = channel[low] - sorted_keV[0] / dispersion
+            if abs(offset) > max_offset * n_channels:
+                continue
+            # the closest peak to where each line should be
+            expected = sorted_keV / dispersion + offset
+            closest = np.argmin(np.abs(channel[None, :] - expected[:, None]), axis=1)
+            matched = np.abs(channel[closest] - expected) <= tolerance[closest]
+            # every line on its own peak, in the same order as the energies
+            if not matched.all() or np.any(np.diff(channel[closest]) <= 0):
+                continue
+            score = significance[closest].sum()
+            if score > best_score:
+                best_score, best = score, closest
+
+    if best is None:
+        return None
+    # back to the order of peaks_keV
+    chosen = np.empty(len(peaks_keV), dtype=int)
+    chosen[order] = candidates[best]
+    return {key: value[chosen] for key, value in peaks.items()}
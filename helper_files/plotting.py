@@ -1,10 +1,51 @@
 # this is the helper file for the plotting
 
-import plotly.graph_objects as go
+import numpy as np
 
 from helper_files.gaussian_fitting import area_under_peak, gaussian
 
 
+def decimate_min_max(x, y, max_points):
+    """
+    Reduces the number of points to plot, keeping the shape of the spectrum.
+    The points are split in max_points / 2 buckets, and the lowest and highest point
+    in each bucket are kept, so no peaks disappear from the plot.
+
+    Parameters
+    ----------
+    x : list or np.array
+        x values
+    y : list or np.array
+        y values
+    max_points : int
+        the maximum number of points to return
+
+    Returns
+    -------
+    tuple
+        x and y as np.arrays, with at most max_points points
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n_points = len(y)
+    if max_points is None or n_points <= max_points:
+        return x, y
+
+    # the buckets must be equally long to reshape, so the last bucket is filled with its last value
+    n_buckets = max(max_points // 2, 1)
+    bucket_size = int(np.ceil(n_points / n_buckets))
+    padded = np.empty(n_buckets * bucket_size, dtype=np.float64)
+    padded[:n_points] = y
+    padded[n_points:] = y[-1]
+    buckets = padded.reshape(n_buckets, bucket_size)
+
+    # index of the lowest and highest point in each bucket
+    bucket_start = np.arange(n_buckets) * bucket_size
+    keep = np.concatenate([bucket_start + buckets.argmin(axis=1), bucket_start + buckets.argmax(axis=1)])
+    keep = np.unique(np.clip(keep, 0, n_points - 1))
+    return x[keep], y[keep]
+
+
 def plot_lines(
     x,
     y,
@@ -34,6 +75,9 @@ def plot_lines(
     yaxis_title : str, optional
         y axis, by default 'y'
     """
+    # plotly is imported when plotting, so importing the helper files stays fast
+    import plotly.graph_objects as go
+
     # make a figure
     fig = go.Figure()
 
@@ -73,11 +117,15 @@ def plotly_plot(
     title="Untitled",
     xaxis_title="Channel number [~10eV]",
     yaxis_title="Relative intensity",
+    max_points=4000,
+    webgl=False,
 ):
     """
     Using plotly to make a interactive plot of the data and the fit.
     Can add vertical lines to the plot at the peaks with vlines.
     Can add each gaussian to the plot with fit_params.
+    Lines with more than max_points points are decimated (see decimate_min_max),
+    which keeps the html files small when plotting large or many spectra.
 
     Parameters
     ----------
@@ -107,6 +155,10 @@ def plotly_plot(
         x axis name, by default "Channel number [~10eV]"
     yaxis_title : str, optional
         y axis name, by default "Relative intensity"
+    max_points : int, optional
+        maximum number of points in each line, None plots all points, by default 4000
+    webgl : bool, optional
+        use go.Scattergl, which is faster when plotting many spectra in one figure, by default False
 
     Returns
     -------
@@ -118,17 +170,25 @@ def plotly_plot(
         print("You must specify the x values! Returned None")
         return None
 
+    # plotly is imported when plotting, so importing the helper files stays fast
+    import plotly.graph_objects as go
+
     # if no figure is given, make a new one.
     # with this you can plot multiple figures in one plot by calling this function multiple times.
     if fig is None:
         fig = go.Figure()
 
+    # WebGL draws many lines faster than the default SVG
+    scatter = go.Scattergl if webgl else go.Scatter
+    x_cropped = x[start:stop]
+
     # plotting the raw data
     if y is not None:
+        x_plot, y_plot = decimate_min_max(x_cropped, y[start:stop], max_points)
         fig.add_trace(
-            go.Scatter(
-                x=x[start:stop],
-                y=y[start:stop],
+            scatter(
+                x=x_plot,
+                y=y_plot,
                 mode="lines+markers",
                 name=f"raw data",
             )
@@ -136,38 +196,33 @@ def plotly_plot(
 
     # if there is a fit to plot
     if y_fit is not None:  # is false if None
+        x_plot, y_plot = decimate_min_max(x_cropped, y_fit[start:stop], max_points)
         fig.add_trace(
-            go.Scatter(
-                x=x[start:stop],
-                y=y_fit[start:stop],
+            scatter(
+                x=x_plot,
+                y=y_plot,
                 mode="lines",
                 name="gaussian fit",
             )
         )
 
     if y_named is not None:
+        x_plot, y_plot = decimate_min_max(x_cropped, y_named[0][start:stop], max_points)
         fig.add_trace(
-            go.Scatter(
-                x=x[start:stop],
-                y=y_named[0][start:stop],
+            scatter(
+                x=x_plot,
+                y=y_plot,
                 mode="lines",
                 name=y_named[1],
             )
         )
 
-    # # add vertical dotted lines with a small annotation, eg for the peak positions
-    # if vlines is not None:
-    #     for vline in vlines:
-    #         fig.add_vline(
-    #             x=vline,
-    #             line_dash="dot",
-    #             annotation_text=f"{vline:.3f}",
-    #             line_width=0.3,
-    #             annotation_font_size=8,
-    #         )
-
-    # add vertical dotted lines with a small annotation, eg for the peak positions
-    if vlines is not None:
+    # add vertical dotted lines with a small annotation, eg for the peak positions.
+    # all the lines are one trace, separated by None, instead of one trace per line
+    if vlines is not None and len(vlines) > 0:
+        vlines_x = []
+        vlines_y = []
+        vlines_text = []
         for i in range(len(vlines)):
             vline = vlines[i]
 
@@ -176,32 +231,36 @@ def plotly_plot(
                 line_name = f"{vlines_name[i]}: {vline:.4f}"
             except (IndexError, TypeError):
                 line_name = f"{vline:.4f}"
-            fig.add_trace(
-                go.Scatter(
-                    x=[vline, vline],
-                    y=[-0.05, 1],
-                    line_dash="dot",
-                    line_width=1,
-                    text=[line_name, line_name],
-                    textposition="bottom right",
-                    mode="lines+text",
-                    name=line_name,
-                    marker=dict(color="black"),
-                )
+            vlines_x += [vline, vline, None]
+            vlines_y += [-0.05, 1, None]
+            vlines_text += [line_name, line_name, None]
+        fig.add_trace(
+            go.Scatter(
+                x=vlines_x,
+                y=vlines_y,
+                line_dash="dot",
+                line_width=1,
+                text=vlines_text,
+                textposition="bottom right",
+                textfont_size=8,
+                mode="lines+text",
+                name="peaks",
+                marker=dict(color="black"),
             )
-            fig.update_traces(textfont_size=8)
+        )
 
     # plotting eventual gaussian fitted curves from fit_vals
     if fit_params is not None:
         for i in range(0, len(fit_params), 3):
             gauss_y = gaussian(
-                x[start:stop], fit_params[i], fit_params[i + 1], fit_params[i + 2]
+                np.asarray(x_cropped), fit_params[i], fit_params[i + 1], fit_params[i + 2]
             )
+            x_plot, y_plot = decimate_min_max(x_cropped, gauss_y, max_points)
             area = area_under_peak(fit_params[i + 1], fit_params[2 + i], fit_params[i])
             fig.add_trace(
-                go.Scatter(
-                    x=x[start:stop],
-                    y=gauss_y,  # is made from [start:stop] above
+                scatter(
+                    x=x_plot,
+                    y=y_plot,  # is made from [start:stop] above
                     mode="lines",
                     name=f"a={fit_params[i]:.2f}, mu={fit_params[i + 1]:.2f}, std={fit_params[i + 2]:.2f}, area={area:.3f}",
                 )
@@ -0,0 +1,190 @@
+# helper file for the areas of the fitted peaks, and a table of them for quantification
+# everything is calculated from fit_params and fit_cov, for all peaks and spectra at once
+
+import numpy as np
+
+# FWHM = std * 2 * sqrt(2 * ln(2)), see https://en.wikipedia.org/wiki/Full_width_at_half_maximum
+FWHM_PER_STD = 2 * np.sqrt(2 * np.log(2))
+
+
+def peak_areas(fit_params, fit_cov=None):
+    """
+    The total area of each fitted gaussian, amp * std * sqrt(2 pi), with uncertainty.
+    The uncertainty comes from the variances and covariance of amp and std in fit_cov.
+
+    Parameters
+    ----------
+    fit_params : np.array
+        [amp1, mu1, std1, amp2, ...], or (n_spectra, 3 * n_peaks) for many spectra
+    fit_cov : np.array, optional
+        the covariance from the fit, (3 * n_peaks, 3 * n_peaks) or (n_spectra, 3 * n_peaks, 3 * n_peaks),
+        by default None which gives nan uncertainties
+
+    Returns
+    -------
+    tuple
+        areas and their standard deviations, with shape (n_peaks) or (n_spectra, n_peaks)
+    """
+    fit_params = np.asarray(fit_params, dtype=np.float64)
+    amp = fit_params[..., 0::3]
+    std = np.abs(fit_params[..., 2::3])
+    sqrt_2pi = np.sqrt(2 * np.pi)
+    areas = amp * std * sqrt_2pi
+
+    if fit_cov is None:
+        return areas, np.full(areas.shape, np.nan)
+
+    fit_cov = np.asarray(fit_cov, dtype=np.float64)
+    amp_index = 3 * np.arange(amp.shape[-1])
+    std_index = amp_index + 2
+    var_amp = fit_cov[..., amp_index, amp_index]
+    var_std = fit_cov[..., std_index, std_index]
+    cov_amp_std = fit_cov[..., amp_index, std_index]
+
+    # d_area/d_amp = std * sqrt(2 pi) and d_area/d_std = amp * sqrt(2 pi)
+    area_variance = (
+        (std * sqrt_2pi) ** 2 * var_amp
+        + (amp * sqrt_2pi) ** 2 * var_std
+        + 2 * (std * sqrt_2pi) * (amp * sqrt_2pi) * cov_amp_std
+    )
+    return areas, np.sqrt(np.clip(area_variance, 0, None))
+
+
+def quantification_table(
+    fit_params,
+    fit_cov,
+    dispersion,
+    offset,
+    norm_max=1.0,
+    peaks_names=None,
+    spectrum_names=None,
+):
+    """
+    A table with one row per peak per spectrum, with the position, width and net counts of each peak.
+    The table is columnar, a dict of np.arrays with the same length,
+    which is easy to filter, sort or give to eg pandas.DataFrame.
+
+    The fits in the notebook are done on the intensity, the counts divided by the maximum count.
+    norm_max is that maximum, and multiplies the areas back to counts.
+
+    Parameters
+    ----------
+    fit_params : np.array
+        [amp1, mu1, std1, amp2, ...], or (n_spectra, 3 * n_peaks) for many spectra
+    fit_cov : np.array
+        the covariance from the fit, see peak_areas, can be None
+    dispersion : float or np.array
+        keV/channel, one value or one per spectrum
+    offset : float or np.array
+        channels, one value or one per spectrum
+    norm_max : float or np.array, optional
+        what the fitted spectrum was divided by, eg s['counts'].max(), by default 1.0
+    peaks_names : list of string, optional
+        names of the peaks, by default "peak i"
+    spectrum_names : list of string, optional
+        names of the spectra, by default the index of the spectrum
+
+    Returns
+    -------
+    dict
+        columns spectrum, line, centroid_keV, centroid_keV_std, fwhm_keV, net_counts and net_counts_std
+    """
+    fit_params = np.atleast_2d(np.asarray(fit_params, dtype=np.float64))
+    n_spectra, n_params = fit_params.shape
+    n_peaks = n_params // 3
+    if fit_cov is not None:
+        fit_cov = np.asarray(fit_cov, dtype=np.float64).reshape(n_spectra, n_params, n_params)
+
+    # one value per spectrum, as a column to broadcast over the peaks
+    dispersion = np.broadcast_to(np.asarray(dispersion, dtype=np.float64), n_spectra)[:, None]
+    offset = np.broadcast_to(np.asarray(offset, dtype=np.float64), n_spectra)[:, None]
+    norm_max = np.broadcast_to(np.asarray(norm_max, dtype=np.float64), n_spectra)[:, None]
+
+    mu = fit_params[:, 1::3]
+    std = np.abs(fit_params[:, 2::3])
+    if fit_cov is not None:
+        mu_index = 3 * np.arange(n_peaks) + 1
+        mu_std = np.sqrt(np.clip(fit_cov[:, mu_index, mu_index], 0, None))
+    else:
+        mu_std = np.full(mu.shape, np.nan)
+
+    areas, area_std = peak_areas(fit_params, fit_cov)
+
+    if peaks_names is None:
+        peaks_names = [f"peak {i}" for i in range(n_peaks)]
+    else:
+        # missing names are filled in, as in the table in the notebook
+        peaks_names = [peaks_names[i] if i < len(peaks_names) else f"peak {i}" for i in range(n_peaks)]
+    if spectrum_names is None:
+        spectrum_names = np.arange(n_spectra)
+
+    # the rows are spectrum 0 peak 0, spectrum 0 peak 1, ..., spectrum 1 peak 0, ...
+    return {
+        "spectrum": np.repeat(np.asarray(spectrum_names), n_peaks),
+        "line": np.tile(np.asarray(peaks_names), n_spectra),
+        "centroid_keV": ((mu - offset) * dispersion).ravel(),
+        "centroid_keV_std": (mu_std * dispersion).ravel(),
+        "fwhm_keV": (std * FWHM_PER_STD * dispersion).ravel(),
+        "net_counts": (areas * norm_max).ravel(),
+        "net_counts_std": (area_std * norm_max).ravel(),
+    }
+
+
+def quantification_table_from_spectra(spectra):
+    """
+    The quantification table for a list of fitted and calibrated spectrum dictionaries.
+    Spectra with the same number of peaks are calculated together.
+
+    Parameters
+    ----------
+    spectra : list of dict
+        spectrum dictionaries with fit_params, fit_cov, dispersion and offset
+
+    Returns
+    -------
+    dict
+        the table, see quantification_table, with the names of the spectra in the spectrum column,
+        and no rows for an empty list
+    """
+    if len(spectra) == 0:
+        # the same empty columns as quantification_table gives for no spectra
+        return quantification_table(np.empty((0, 0)), None, dispersion=[], offset=[], norm_max=[], spectrum_names=[])
+
+    # grouping the spectra by number of fitted parameters, so each group is one array
+    groups = {}
+    for s in spectra:
+        groups.setdefault(len(s["fit_params"]), []).append(s)
+
+    tables = []
+    for group in groups.values():
+        fit_cov = None
+        if all(s.get("fit_cov") is not None for s in group):
+            fit_cov = np.array([s["fit_cov"] for s in group])
+        # the peaks are named by the first spectrum in the group
+        tables.append(
+            quantification_table(
+                np.array([s["fit_params"] for s in group]),
+                fit_cov,
+                dispersion=[s["dispersion"] for s in group],
+                offset=[s["offset"] for s in group],
+                norm_max=[np.max(s["counts"]) for s in group],
+                peaks_names=group[0].get("peaks_names"),
+                spectrum_names=[s["name"] for s in group],
+            )
+        )
+    return {key: np.concatenate([table[key] for table in tables]) for key in tables[0]}
+
+
+def print_quantification_table(table):
+    """
+    Prints the table from quantification_table, like the table of fitted peaks in the notebook.
+    """
+    print(
+        f"{'Spectrum':<20} | {'Line':<9} | {'Centroid [keV]':<20} | {'FWHM [keV]':<10} | Net counts"
+    )
+    for i in range(len(table["line"])):
+        print(
+            f"{str(table['spectrum'][i]):<20} | {str(table['line'][i]):<9} | "
+            f"{table['centroid_keV'][i]:>8.4f} +- {table['centroid_keV_std'][i]:<6.4f} | "
+            f"{table['fwhm_keV'][i]:<10.4f} | {table['net_counts'][i]:.1f} +- {table['net_counts_std'][i]:.1f}"
+        )
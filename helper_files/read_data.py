@@ -1,16 +1,46 @@
 # helper file for reading the data
 # contains the functions read_lines, read_xy_data and read_only_y_data
+# read_data_block and parse_data_block does the actual work, the others are built on top of them
+
+import warnings
 
 import numpy as np
 
 
-def read_lines(filepath, start_string, stop_string, line_endings, print_info=True):
+def find_line(text, line_start, begin=0):
     """
-    Reads the data from the file and returns the data as a numpy array.
-    See the comments iside the function for more information.
-    Will normally print the information about the data.
+    Finds the index in text where a line starting with line_start begins.
+    Used instead of splitting the file into lines and searching the list.
 
-    Remember to put the correct values for the parameters.
+    Parameters
+    ----------
+    text : string
+        the whole file as one string
+    line_start : string
+        what the line starts with
+    begin : int, optional
+        index in text to start searching from, by default 0
+
+    Returns
+    -------
+    int
+        index of the first character of the line, or -1 if not found
+    """
+    # the line can be the very first line in the file
+    if begin == 0 and text.startswith(line_start):
+        return 0
+
+    index = text.find("\n" + line_start, max(begin - 1, 0))
+    if index == -1:
+        return -1
+    return index + 1
+
+
+def read_data_block(filepath, start_string, stop_string, print_info=True):
+    """
+    Reads the file once and returns only the text between the start and stop line.
+    The start and stop lines are found with str.find on the whole file,
+    so the file is never split into a list of lines.
 
     Parameters
     ----------
@@ -20,51 +50,131 @@ def read_lines(filepath, start_string, stop_string, line_endings, print_info=Tru
         the line above the data starts
     stop_string : string
         the line after the data ends
-    line_endings : string
-        line endings in the file, often '\n' or ', \n'
     print_info : bool, optional
         printing a summary at the end, by default True
 
     Returns
     -------
-    list of strings
-        list of the lines in the file
+    string
+        the data lines as one string, or None if the start or stop string is not found
     """
-    # open the file in read mode, and closes f when the block is done
     # encoding='cp1252' is for the special characters in the .mca file
-    with open(filepath, "r", encoding='cp1252') as f:
-        # read the file line by line
-        lines = f.readlines()
+    with open(filepath, "r", encoding="cp1252") as f:
+        text = f.read()
 
+    if print_info:
+        print(f"Reading {filepath}")
+        print(f"The first line looks like this: {repr(text[:text.find(chr(10)) + 1])}")
+
+    # find the start line, and the stop line after it
+    start_index = find_line(text, start_string)
+    stop_index = -1
+    if start_index != -1:
+        stop_index = find_line(text, stop_string, start_index + len(start_string))
+    # if the start or stop string is not found
+    if start_index == -1 or stop_index == -1:
         if print_info:
-            print(f"Reading {filepath}")
-            print(f"The first line looks like this: {repr(lines[0])}")
-
-        # remove the line endings, specified by line_endings
-        lines = [line.rstrip(line_endings) for line in lines]
-
-        # find the start and stop index
-        try:
-            start_index = lines.index(start_string)
-            stop_index = lines.index(stop_string)
-        # if the start or stop string is not found
-        except ValueError:
             print(
                 f"Could not find {start_string} or {stop_string} in the file, returning None."
             )
-            return None
+        return None
 
-        if print_info:
-            print(f"Reading from line {start_index} to {stop_index}.")
+    # the data starts on the line after the start line
+    data_start = text.find("\n", start_index) + 1
+
+    if print_info:
+        # counting lines is only needed for the print
+        print(
+            f"Reading from line {text.count(chr(10), 0, start_index)} to {text.count(chr(10), 0, stop_index)}."
+        )
+
+    return text[data_start:stop_index]
+
+
+def parse_data_block(block, n_columns=1, delimiter=None, line_endings=None, count=-1):
+    """
+    Parses a block of numbers into a 2d numpy array with shape (n_columns, n_rows).
+    All the numbers are parsed in one call to np.fromstring, instead of one float() per value.
+
+    Parameters
+    ----------
+    block : string
+        the data lines as one string, from read_data_block
+    n_columns : int, optional
+        number of columns in the data, by default 1
+    delimiter : string, optional
+        the delimiter between the columns, by default None
+    line_endings : string, optional
+        line endings in the file, often '\n' or ', \n', by default None
+    count : int, optional
+        number of rows to read, -1 reads all, by default -1
+
+    Returns
+    -------
+    np.array
+        array with shape (n_columns, n_rows), or None if the block could not be parsed
+    """
+    # the delimiter and the non-whitespace part of the line endings (eg the ',' in ', \n')
+    # are turned into spaces, so the block is just numbers separated by whitespace
+    separators = set()
+    if delimiter:
+        separators.add(delimiter)
+    if line_endings:
+        separators.update(c for c in line_endings if not c.isspace())
+    for separator in separators:
+        block = block.replace(separator, " ")
+
+    if count != -1:
+        count *= n_columns
+
+    # np.fromstring only warns when it meets something that is not a number, we want an error
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(block, dtype=np.float64, sep=" ", count=count)
+    except (ValueError, DeprecationWarning):
+        return None
+
+    if len(values) % n_columns != 0:
+        return None
+
+    # the values are read row by row, so the columns are every n_columns value.
+    # the copy makes each column contiguous in memory
+    return np.ascontiguousarray(values.reshape(-1, n_columns).T)
 
-        start_index = lines.index(start_string)
-        stop_index = lines.index(stop_string)
 
-        # the data contains stop_index - start_index - 1 lines of data
-        # number_of_data_points = stop_index - start_index - 1
+def read_lines(filepath, start_string, stop_string, line_endings, print_info=True):
+    """
+    Reads the data from the file and returns the data lines as a list of strings.
+    See read_data_block for how the data is found.
+    Will normally print the information about the data.
 
-    # return the data as a list of strings, to be used by one of the functions below
-    return lines[start_index + 1 : stop_index]
+    Remember to put the correct values for the parameters.
+
+    Parameters
+    ----------
+    filepath : string / path
+        path to the file
+    start_string : string
+        the line above the data starts
+    stop_string : string
+        the line after the data ends
+    line_endings : string
+        line endings in the file, often '\n' or ', \n'
+    print_info : bool, optional
+        printing a summary at the end, by default True
+
+    Returns
+    -------
+    list of strings
+        list of the lines in the file
+    """
+    block = read_data_block(filepath, start_string, stop_string, print_info)
+    if block is None:
+        return None
+
+    # remove the line endings, specified by line_endings
+    return [line.rstrip(line_endings) for line in block.splitlines(keepends=True)]
 
 
 def read_xy_data(
@@ -97,28 +207,26 @@ def read_xy_data(
         array with the channels and counts
     """
 
-    # read the lines only containing the data
-    lines = read_lines(filepath, start_string, stop_string, line_endings, print_info)
-
-    # make an empty list to store the data
-    data = []
-
-    # loop over the lines of data and split them into a list with floats
-    for line in lines:
-        data.append([float(x) for x in line.split(delimiter)])
+    # read the text only containing the data
+    block = read_data_block(filepath, start_string, stop_string, print_info)
+    if block is None:
+        return None
 
-    # convert the data to two numpy arrays
-    raw_channels = np.array([x[0] for x in data])
-    counts = np.array([x[1] for x in data])
+    # parse all the numbers at once, into [raw_channels, counts]
+    data = parse_data_block(block, 2, delimiter, line_endings)
+    if data is None:
+        if print_info:
+            print("Could not convert the data to floats, returning None.")
+        return None
 
     # optional print of the information about the data
     if print_info:
         print(
-            f"{len(lines)} data points, first entry = {data[0]}, last entry = {data[-1]}\n"
+            f"{data.shape[1]} data points, first entry = {data.T[0].tolist()}, last entry = {data.T[-1].tolist()}\n"
         )
 
     # returns the raw_channels and counts as numpy arrays
-    return np.array([raw_channels, counts])
+    return data
 
 
 def read_only_y_data(
@@ -150,29 +258,26 @@ def read_only_y_data(
         array with the channels and counts
     """
 
-    # read the lines only containing the data
-    lines = read_lines(filepath, start_string, stop_string, line_endings, print_info)
-
-    # make an empty list to store the data
-    counts = []
-
-    # loop over the lines of y data and turn the strings into floats
-    try:
-        for line in lines:
-            counts.append(float(line))
-    except ValueError:
-        print("Could not convert the data to floats, returning None.")
+    # read the text only containing the data
+    block = read_data_block(filepath, start_string, stop_string, print_info)
+    if block is None:
         return None
 
-    # making the channels, just the index of the data point
-    channels = np.arange(len(counts))
+    # parse all the numbers at once
+    counts = parse_data_block(block, 1, line_endings=line_endings)
+    if counts is None:
+        if print_info:
+            print("Could not convert the data to floats, returning None.")
+        return None
 
-    # put [counts, channels]
-    data = np.array([channels, counts])
+    # preallocating [channels, counts], the channels are just the index of the data point
+    data = np.empty((2, counts.shape[1]))
+    data[0] = np.arange(counts.shape[1])
+    data[1] = counts[0]
 
     # optional print of the information about the data
     if print_info:
-        print(f"{len(lines)} data points, first entry = {data.T[0]}, last entry = {data.T[-1]}\n")
+        print(f"{data.shape[1]} data points, first entry = {data.T[0]}, last entry = {data.T[-1]}\n")
 
     # returns the data, which is only raw counts and channels
     return data
@@ -0,0 +1,374 @@
+# helper file for reading the header of the data files
+# knows the EMSA/MSA (.msa, .emsa) and the Amptek PMCA (.mca) formats,
+# so the start_str, stop_str, line_endings and delimiter does not have to be given by hand
+
+import numpy as np
+
+from helper_files.read_data import parse_data_block
+
+# the line before the data in each format
+DATA_START_STRINGS = {
+    "emsa": "#SPECTRUM",
+    "pmca": "<<DATA>>",
+}
+
+# the line after the data in each format
+DATA_STOP_STRINGS = {
+    "emsa": "#ENDOFDATA",
+    "pmca": "<<END>>",
+}
+
+# the EMSA keywords which are numbers, the rest are kept as strings
+EMSA_FLOAT_KEYS = {
+    "NPOINTS": "npoints",
+    "NCOLUMNS": "n_columns",
+    "XPERCHAN": "xperchan",
+    "OFFSET": "offset",
+    "CHOFFSET": "choffset",
+    "LIVETIME": "livetime",
+    "REALTIME": "realtime",
+    "BEAMKV": "beam_kv",
+}
+
+# the PMCA keywords which are numbers, the rest are kept as strings
+PMCA_FLOAT_KEYS = {
+    "LIVE_TIME": "livetime",
+    "REAL_TIME": "realtime",
+    "GAIN": "gain",
+}
+
+
+def detect_format(first_line):
+    """
+    Finds the file format from the first line of the file.
+
+    Parameters
+    ----------
+    first_line : string
+        the first line in the file
+
+    Returns
+    -------
+    string
+        'emsa' or 'pmca', or None if the format is unknown
+    """
+    if first_line.startswith("#FORMAT"):
+        return "emsa"
+    if first_line.startswith("<<PMCA SPECTRUM>>"):
+        return "pmca"
+    return None
+
+
+def empty_header():
+    """
+    Makes the header dictionary with all the keys, which is filled by read_header.
+    Values not found in the file are None, so every header has the same keys.
+
+    Returns
+    -------
+    dict
+        header dictionary
+    """
+    return {
+        "format": None,
+        "title": None,
+        "npoints": None,
+        "n_columns": None,
+        "xunits": None,
+        "xperchan": None,
+        "offset": None,
+        "choffset": None,
+        "livetime": None,
+        "realtime": None,
+        "beam_kv": None,
+        "gain": None,
+        "labels": [],  # [[atomic number, keV, element], ...] from ##OXINSTLABEL
+        "calibration": [],  # [[channel, keV], ...] from <<CALIBRATION>>
+        "data_start": None,  # index in the file text where the data starts
+        "start_str": None,
+        "stop_str": None,
+        "line_endings": None,
+        "delimiter": None,
+    }
+
+
+def to_float(value):
+    """Converts a header value to float, returns None for empty or broken values."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_emsa_line(header, line):
+    """
+    Puts one EMSA header line, eg '#NPOINTS     : 1024', into the header dictionary.
+    """
+    key, _, value = line.lstrip("#").partition(":")
+    # some keys have units in them, eg '#XPOSITION mm'
+    key = key.split()[0] if key.strip() else ""
+    value = value.strip()
+
+    if key in EMSA_FLOAT_KEYS:
+        header[EMSA_FLOAT_KEYS[key]] = to_float(value)
+    elif key == "XUNITS":
+        header["xunits"] = value
+    elif key == "TITLE":
+        header["title"] = value
+    elif key == "OXINSTLABEL":
+        # eg '26, 6.404, Fe'
+        parts = [part.strip() for part in value.split(",")]
+        if len(parts) == 3:
+            atomic_number, energy = to_float(parts[0]), to_float(parts[1])
+            # broken labels are skipped, like other broken header values
+            if atomic_number is not None and energy is not None:
+                header["labels"].append([int(atomic_number), energy, parts[2]])
+
+
+def parse_pmca_line(header, line, section):
+    """
+    Puts one PMCA header line, eg 'LIVE_TIME - 0.451710', into the header dictionary.
+    In the <<CALIBRATION>> section the lines are 'channel keV' pairs.
+    """
+    if section == "<<CALIBRATION>>":
+        parts = line.split()
+        if len(parts) == 2 and to_float(parts[0]) is not None:
+            header["calibration"].append([float(parts[0]), float(parts[1])])
+        return
+
+    key, _, value = line.partition(" - ")
+    key = key.strip()
+    if key in PMCA_FLOAT_KEYS:
+        header[PMCA_FLOAT_KEYS[key]] = to_float(value)
+    elif key == "DESCRIPTION":
+        header["title"] = value.strip()
+
+
+def data_line_layout(line):
+    """
+    Finds the line_endings and delimiter from the first line of data.
+    Eg '0.000000, ' is one column with line ending ', \\n',
+    and '-0.20000, 0.0' is two columns with ', ' as delimiter.
+
+    Parameters
+    ----------
+    line : string
+        first line of data, without the newline
+
+    Returns
+    -------
+    tuple
+        line_endings, delimiter, n_columns
+    """
+    stripped = line.rstrip()
+    if stripped.endswith(","):
+        return ", \n", None, 1
+    if "," in stripped:
+        return "\n", ", ", 2
+    if len(stripped.split()) == 2:
+        return "\n", " ", 2
+    return "\n", None, 1
+
+
+def read_header(filepath, text=None, print_info=True):
+    """
+    Reads the header of a .msa, .emsa or .mca file into a header dictionary.
+    Only the header lines are looked at, the data lines are left for read_spectrum_file.
+
+    Parameters
+    ----------
+    filepath : string / path
+        path to the file
+    text : string, optional
+        the file as a string, if it is already read, by default None
+    print_info : bool, optional
+        printing why the header could not be read, by default True
+
+    Returns
+    -------
+    dict
+        header dictionary, see empty_header, or None if the format is unknown
+    """
+    if text is None:
+        # encoding='cp1252' is for the special characters in the .mca file
+        with open(filepath, "r", encoding="cp1252") as f:
+            text = f.read()
+
+    header = empty_header()
+    header["format"] = detect_format(text[: text.find("\n")])
+    if header["format"] is None:
+        if print_info:
+            print(f"Unknown file format of {filepath}, returning None.")
+        return None
+    start_str = DATA_START_STRINGS[header["format"]]
+
+    # going through the header line by line, stopping at the line before the data
+    position = 0
+    section = None
+    while True:
+        line_end = text.find("\n", position)
+        if line_end == -1:
+            if print_info:
+                print(f"Could not find {start_str} in {filepath}, returning None.")
+            return None
+        line = text[position:line_end].rstrip("\r")
+        position = line_end + 1
+
+        if line.startswith(start_str):
+            header["start_str"] = line
+            break
+        if header["format"] == "emsa":
+            parse_emsa_line(header, line)
+        elif line.startswith("<<"):
+            section = line
+        else:
+            parse_pmca_line(header, line, section)
+
+    header["data_start"] = position
+    header["stop_str"] = DATA_STOP_STRINGS[header["format"]]
+
+    # the layout of the data is found from the first data line
+    first_data_line = text[position : text.find("\n", position)]
+    line_endings, delimiter, n_columns = data_line_layout(first_data_line)
+    header["line_endings"] = line_endings
+    header["delimiter"] = delimiter
+    # some files says DATATYPE XY but only has one column, so the data decides
+    header["n_columns"] = n_columns
+
+    if header["npoints"] is not None:
+        header["npoints"] = int(header["npoints"])
+
+    return header
+
+
+def header_calibration(header):
+    """
+    The calibration stored in the header by the instrument, as dispersion and offset.
+    Can be used as a starting point, or instead of the gaussian fit and calibration.
+
+    EMSA files with XUNITS keV or eV have XPERCHAN and OFFSET (the energy of the first channel).
+    PMCA files can have a <<CALIBRATION>> section with channel-energy pairs,
+    which is fitted with a straight line if there are two or more pairs.
+
+    Parameters
+    ----------
+    header : dict
+        header dictionary from read_header
+
+    Returns
+    -------
+    tuple
+        dispersion [keV/channel], offset [channels], or None if the header has no calibration
+    """
+    if header["format"] == "emsa":
+        xunits = (header["xunits"] or "").lower()
+        if xunits not in ("kev", "ev") or not header["xperchan"]:
+            return None
+        # converting eV to keV
+        scale = 1e-3 if xunits == "ev" else 1
+        dispersion = header["xperchan"] * scale
+        # OFFSET is the energy of channel 0, keV = (channel - offset) * dispersion
+        offset = -(header["offset"] or 0) * scale / dispersion
+        return (dispersion, offset)
+
+    if header["format"] == "pmca":
+        if len(header["calibration"]) < 2:
+            return None
+        calibration = np.array(header["calibration"])
+        # keV = dispersion * channel + intercept, and intercept = - offset * dispersion
+        dispersion, intercept = np.polyfit(calibration[:, 0], calibration[:, 1], 1)
+        return (float(dispersion), float(-intercept / dispersion))
+
+    return None
+
+
+def read_spectrum_file(filepath, print_info=True):
+    """
+    Reads a .msa, .emsa or .mca file, finding the data from the header.
+    When the header has NPOINTS, exactly that many points are read,
+    so there is no search for the line after the data.
+
+    Parameters
+    ----------
+    filepath : string / path
+        path to the file
+    print_info : bool, optional
+        printing a summary at the end, by default True
+
+    Returns
+    -------
+    tuple
+        header dictionary and np.array with [channels, counts], or None if the file could not be read
+    """
+    # encoding='cp1252' is for the special characters in the .mca file
+    with open(filepath, "r", encoding="cp1252") as f:
+        text = f.read()
+    return parse_spectrum_text(text, filepath, print_info)
+
+
+def parse_spectrum_text(text, filepath="<buffer>", print_info=True):
+    """
+    Reads the header and data of a spectrum file which is already in memory, see read_spectrum_file.
+    Used for spectra which does not come from a file, eg bytes from the acquisition system,
+    which can be decoded with data.decode("cp1252").
+
+    Parameters
+    ----------
+    text : string
+        the whole file as a string
+    filepath : string, optional
+        name of the spectrum, only used in the prints, by default "<buffer>"
+    print_info : bool, optional
+        printing a summary at the end, and why the text could not be read, by default True
+
+    Returns
+    -------
+    tuple
+        header dictionary and np.array with [channels, counts], or None if the text could not be read
+    """
+    header = read_header(filepath, text, print_info)
+    if header is None:
+        return None
+
+    npoints = header["npoints"]
+    if npoints is None:
+        # no number of points in the header, so the data ends at the stop string
+        stop_index = text.find("\n" + header["stop_str"], header["data_start"] - 1)
+        block = text[header["data_start"] : stop_index if stop_index != -1 else None]
+        values = parse_data_block(
+            block, header["n_columns"], header["delimiter"], header["line_endings"]
+        )
+    else:
+        # the data is read straight after the header, and only npoints lines are parsed
+        values = parse_data_block(
+            text[header["data_start"] :],
+            header["n_columns"],
+            header["delimiter"],
+            header["line_endings"],
+            count=npoints,
+        )
+        if values is not None and values.shape[1] != npoints:
+            values = None
+
+    if values is None:
+        if print_info:
+            print(f"Could not read the data in {filepath}, returning None.")
+        return None
+
+    # preallocating [channels, counts], the channels are just the index of the data point
+    n_points = values.shape[1]
+    data = np.empty((2, n_points))
+    data[0] = np.arange(n_points)
+    data[1] = values[-1]
+
+    if print_info:
+        print(f"Reading {filepath} as {header['format']}")
+        print(f"{n_points} data points, live time = {header['livetime']} s")
+        calibration = header_calibration(header)
+        if calibration is not None:
+            print(
+                f"The header calibration is: {calibration[0]:.07f} keV/channel, with {calibration[1]:.03f} channels zero offset"
+            )
+        print()
+
+    return header, data
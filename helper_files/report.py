@@ -0,0 +1,219 @@
+# helper file for making a report of many calibrated spectra, without the notebook
+# all the figures are put in one html file, which includes plotly.js only once
+
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from helper_files.plotting import plotly_plot
+from helper_files.saving_json import read_saved_spectrum_from_json, read_saved_spectrum_from_npz
+
+
+def load_spectrum(spectrum):
+    """
+    Gives a spectrum dictionary, reading it from a saved file if a filename is given.
+
+    Parameters
+    ----------
+    spectrum : dict or string
+        spectrum dictionary, or a .json or .npz file from saving_json.py
+
+    Returns
+    -------
+    dict
+        spectrum dictionary
+    """
+    if isinstance(spectrum, dict):
+        return spectrum
+    if str(spectrum).endswith(".npz"):
+        return read_saved_spectrum_from_npz(spectrum)
+    return read_saved_spectrum_from_json(spectrum)
+
+
+def spectrum_figure(s, max_points=4000):
+    """
+    The figure of one spectrum in the report, the same as the calibrated plot in the notebook.
+    Spectra which are not calibrated are plotted on channels.
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary
+    max_points : int, optional
+        see plotly_plot, by default 4000
+
+    Returns
+    -------
+    go.Figure()
+        the figure
+    """
+    if s.get("kev_calibrated") is not None:
+        x = s["kev_calibrated"]
+        xaxis_title = "energy [keV], calibrated"
+        title = f"Calibrated {s['name']}"
+        vlines = s.get("peaks_keV")
+    else:
+        x = s["channel"]
+        xaxis_title = "channel"
+        title = f"{s['name']} (not calibrated)"
+        vlines = s.get("peaks_channel")
+
+    return plotly_plot(
+        x=x,
+        y_named=[s["intensity"], "intensity"],
+        y_fit=s.get("intensity_fit"),
+        vlines=vlines,
+        vlines_name=s.get("peaks_names"),
+        title=title,
+        xaxis_title=xaxis_title,
+        stop=len(x),
+        max_points=max_points,
+    )
+
+
+def figure_html(spectrum, max_points=4000):
+    """
+    The html <div> of one figure, without plotly.js.
+    Is run in the worker processes of write_report.
+
+    Parameters
+    ----------
+    spectrum : dict or string
+        spectrum dictionary, or a saved file, see load_spectrum
+    max_points : int, optional
+        see plotly_plot, by default 4000
+
+    Returns
+    -------
+    tuple
+        the name of the spectrum and the html
+    """
+    s = load_spectrum(spectrum)
+    fig = spectrum_figure(s, max_points)
+    return s["name"], fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def write_report(spectra, filename, title="Calibrated spectra", plotlyjs="cdn", n_workers=None, max_points=4000):
+    """
+    Makes one html report with a figure for each spectrum, in parallel processes.
+    plotly.js is only included once for the whole report, not once per figure.
+
+    Parameters
+    ----------
+    spectra : list of dict or string
+        spectrum dictionaries, or .json / .npz files saved with saving_json.py
+    filename : string
+        the html file to write
+    title : str, optional
+        title of the report, by default "Calibrated spectra"
+    plotlyjs : str, optional
+        "cdn" links to plotly.js online, "inline" puts it in the file (works offline),
+        "directory" writes plotly.min.js next to the report, which can be shared by many reports,
+        by default "cdn"
+    n_workers : int, optional
+        number of processes, by default None which uses the number of cpus
+    max_points : int, optional
+        see plotly_plot, by default 4000
+
+    Returns
+    -------
+    string
+        the filename
+    """
+    # imported here, it is only needed for the report
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+    if plotlyjs == "cdn":
+        script = f'<script src="https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js" charset="utf-8"></script>'
+    elif plotlyjs == "inline":
+        script = f'<script type="text/javascript">{get_plotlyjs()}</script>'
+    elif plotlyjs == "directory":
+        js_path = os.path.join(os.path.dirname(os.path.abspath(filename)), "plotly.min.js")
+        if not os.path.exists(js_path):
+            with open(js_path, "w", encoding="utf-8") as f:
+                f.write(get_plotlyjs())
+        script = '<script src="plotly.min.js" charset="utf-8"></script>'
+    else:
+        raise ValueError(f"plotlyjs must be 'cdn', 'inline' or 'directory', got {plotlyjs}")
+
+    spectra = list(spectra)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        figures = list(executor.map(figure_html, spectra, [max_points] * len(spectra)))
+
+    # a list of contents at the top, and then the figures
+    contents = "\n".join(
+        f'<li><a href="#spectrum-{i}">{html.escape(name)}</a></li>' for i, (name, _) in enumerate(figures)
+    )
+    sections = "\n".join(
+        f'<section id="spectrum-{i}"><h2>{html.escape(name)}</h2>\n{div}\n</section>'
+        for i, (name, div) in enumerate(figures)
+    )
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(
+            f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+{script}
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+<ul>
+{contents}
+</ul>
+{sections}
+</body>
+</html>
+"""
+        )
+    print(f"Saved the report with {len(figures)} spectra to: {filename}")
+    return filename
+
+
+def write_image(spectrum, folder, image_format, max_points):
+    """
+    Saves the figure of one spectrum as an image, used by write_images.
+    """
+    s = load_spectrum(spectrum)
+    fig = spectrum_figure(s, max_points)
+    image_name = os.path.join(folder, f"{s['filepath'].split('/')[-1].split('.')[0]}_calibrated.{image_format}")
+    fig.write_image(image_name)
+    return image_name
+
+
+def write_images(spectra, folder="plots", image_format="png", n_workers=None, max_points=4000):
+    """
+    Saves the figure of each spectrum as a static image, eg png or svg, in parallel processes.
+    Needs the kaleido package (pip install kaleido), which plotly uses to make images.
+
+    Parameters
+    ----------
+    spectra : list of dict or string
+        spectrum dictionaries, or .json / .npz files saved with saving_json.py
+    folder : str, optional
+        folder to save the images in, by default "plots"
+    image_format : str, optional
+        "png", "svg", "pdf" or "jpeg", by default "png"
+    n_workers : int, optional
+        number of processes, by default None which uses the number of cpus
+    max_points : int, optional
+        see plotly_plot, by default 4000
+
+    Returns
+    -------
+    list of string
+        the image filenames
+    """
+    try:
+        import kaleido  # noqa: F401, only checking that it is installed
+    except ImportError:
+        raise ImportError("write_images needs the kaleido package, install it with 'pip install kaleido'")
+
+    os.makedirs(folder, exist_ok=True)
+    spectra = list(spectra)
+    n = len(spectra)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        image_names = list(executor.map(write_image, spectra, [folder] * n, [image_format] * n, [max_points] * n))
+    print(f"Saved {len(image_names)} images to: {folder}")
+    return image_names
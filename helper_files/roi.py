@@ -0,0 +1,189 @@
+# helper file for summing the counts in energy windows (regions of interest), eg around the lines of each element
+# the windows are turned into channels once, and all windows of all spectra are summed with one cumulative sum
+
+import numpy as np
+
+from helper_files.calibration import Calibration
+
+
+class RegionsOfInterest:
+    """
+    A set of energy windows on a calibrated channel axis.
+    The channels of the windows are found once, and integrate sums all windows of any number of spectra
+    from one cumulative sum over the channels, so the cost does not grow with the width of the windows.
+
+    With fractional=True the channels at the edges of a window are counted with the part of the channel
+    inside the window, as if the counts are spread evenly over each channel (from channel - 0.5 to channel + 0.5).
+    Otherwise whole channels are used, the channels with the center inside the window.
+
+    Parameters
+    ----------
+    kev_low : list of float
+        lower energy of each window
+    kev_high : list of float
+        upper energy of each window
+    calibration : Calibration or dict
+        the calibration, or a calibrated spectrum dictionary
+    n_channels : int
+        number of channels in the spectra
+    names : list of string, optional
+        names of the windows, by default "roi i"
+    fractional : bool, optional
+        count the part of the edge channels inside the window, by default False
+    """
+
+    def __init__(self, kev_low, kev_high, calibration, n_channels, names=None, fractional=False):
+        if isinstance(calibration, dict):
+            calibration = Calibration.from_spectrum(calibration)
+        self.kev_low = np.atleast_1d(np.asarray(kev_low, dtype=np.float64))
+        self.kev_high = np.atleast_1d(np.asarray(kev_high, dtype=np.float64))
+        if self.kev_low.shape != self.kev_high.shape:
+            raise ValueError("kev_low and kev_high must have the same length")
+        if np.any(self.kev_high < self.kev_low):
+            raise ValueError("The upper energy of a window is lower than the lower energy")
+        self.calibration = calibration
+        self.n_channels = int(n_channels)
+        self.names = list(names) if names is not None else [f"roi {i}" for i in range(len(self.kev_low))]
+        self.fractional = fractional
+
+        if fractional:
+            # the window edges as positions on the channel edges, where edge j is at channel j - 0.5
+            low = np.clip(calibration.to_channel(self.kev_low) + 0.5, 0, self.n_channels)
+            high = np.clip(calibration.to_channel(self.kev_high) + 0.5, 0, self.n_channels)
+            # the channel each edge is in, and how far into the channel it is
+            self._low_channel = np.minimum(np.floor(low).astype(int), self.n_channels - 1)
+            self._high_channel = np.minimum(np.floor(high).astype(int), self.n_channels - 1)
+            self._low_part = low - self._low_channel
+            self._high_part = high - self._high_channel
+        else:
+            self.start, self.stop = calibration.channel_window(self.kev_low, self.kev_high, self.n_channels)
+            self.stop = np.maximum(self.stop, self.start)
+
+    @classmethod
+    def from_lines(cls, lines, calibration, n_channels, width=None, fractional=False, index=None):
+        """
+        Windows centered on X-ray lines, eg ["Cu-Ka", "Fe-Ka"].
+
+        Parameters
+        ----------
+        lines : list of string
+            names of the lines, see xray_lines.py
+        calibration : Calibration or dict
+            the calibration, or a calibrated spectrum dictionary
+        n_channels : int
+            number of channels
+        width : float or list of float, optional
+            full width of each window [keV], by default None which uses 2 * the FWHM of the detector at the line,
+            FWHM = sqrt(0.13^2 + 2.5e-3 * (E - 5.895)) keV, which is 0.13 keV at Mn-Ka
+        fractional : bool, optional
+            see RegionsOfInterest, by default False
+        index : XrayLineIndex, optional
+            the table of lines, by default the bundled one
+
+        Returns
+        -------
+        RegionsOfInterest
+        """
+        # imported here, so the table is only loaded when lines are used
+        from helper_files.xray_lines import default_line_index
+
+        if index is None:
+            index = default_line_index()
+        energy = np.asarray(index.energy_of(list(lines)))
+        if width is None:
+            # the resolution of an EDS detector grows with the square root of the energy (Fiori and Newbury),
+            # starting from a typical 130 eV at Mn-Ka
+            fwhm_squared = 0.13**2 + 2.5e-3 * (energy - 5.895)
+            width = 2 * np.sqrt(np.clip(fwhm_squared, 0.04**2, None))
+        width = np.broadcast_to(np.asarray(width, dtype=np.float64), energy.shape)
+        return cls(energy - width / 2, energy + width / 2, calibration, n_channels, names=list(lines), fractional=fractional)
+
+    def __len__(self):
+        return len(self.kev_low)
+
+    def weights(self):
+        """
+        The weight of each channel in each window, as a (windows, channels) array.
+        integrate gives the same as counts @ weights().T, but faster.
+        """
+        weights = np.zeros((len(self), self.n_channels))
+        if not self.fractional:
+            for i, (start, stop) in enumerate(zip(self.start, self.stop)):
+                weights[i, start:stop] = 1
+            return weights
+        for i in range(len(self)):
+            low, high = self._low_channel[i], self._high_channel[i]
+            weights[i, low:high] = 1
+            weights[i, low] -= self._low_part[i]
+            weights[i, high] += self._high_part[i]
+        return weights
+
+    def integrate(self, counts):
+        """
+        The sum of the counts in each window, with the Poisson uncertainty, for one or many spectra.
+
+        Parameters
+        ----------
+        counts : np.array
+            counts with the channels last, eg (n_channels), (n_spectra, n_channels) or (rows, columns, n_channels)
+
+        Returns
+        -------
+        tuple
+            sums and their standard deviations, with the shape of counts but windows instead of channels
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        if counts.shape[-1] != self.n_channels:
+            raise ValueError(f"The windows are made for {self.n_channels} channels, the counts have {counts.shape[-1]}")
+
+        # cumulative[..., j] is the sum of the channels before j
+        cumulative = np.zeros(counts.shape[:-1] + (self.n_channels + 1,))
+        np.cumsum(counts, axis=-1, out=cumulative[..., 1:])
+
+        if not self.fractional:
+            sums = cumulative[..., self.stop] - cumulative[..., self.start]
+            # the variance of a Poisson count is the count
+            return sums, np.sqrt(np.clip(sums, 0, None))
+
+        low, high = self._low_channel, self._high_channel
+        low_counts, high_counts = counts[..., low], counts[..., high]
+        # the whole channels from low to high, then the part of the low channel outside is removed,
+        # and the part of the high channel inside is added
+        whole = cumulative[..., high] - cumulative[..., low]
+        sums = whole - self._low_part * low_counts + self._high_part * high_counts
+
+        # the variance of weight * count is weight^2 * count
+        low_weight = np.where(low == high, self._high_part - self._low_part, 1 - self._low_part)
+        inner = np.where(low == high, 0.0, whole - low_counts)
+        high_weight = np.where(low == high, 0.0, self._high_part)
+        variance = inner + low_weight**2 * low_counts + high_weight**2 * high_counts
+        return sums, np.sqrt(np.clip(variance, 0, None))
+
+    def table(self, counts, spectrum_names=None):
+        """
+        The sums as a table with one row per window per spectrum, like quantification_table.
+
+        Parameters
+        ----------
+        counts : np.array
+            (n_channels) or (n_spectra, n_channels)
+        spectrum_names : list of string, optional
+            names of the spectra, by default the index of the spectrum
+
+        Returns
+        -------
+        dict
+            columns spectrum, roi, kev_low, kev_high, counts and counts_std
+        """
+        sums, std = self.integrate(np.atleast_2d(counts))
+        n_spectra = len(sums)
+        if spectrum_names is None:
+            spectrum_names = np.arange(n_spectra)
+        return {
+            "spectrum": np.repeat(np.asarray(spectrum_names), len(self)),
+            "roi": np.tile(np.asarray(self.names), n_spectra),
+            "kev_low": np.tile(self.kev_low, n_spectra),
+            "kev_high": np.tile(self.kev_high, n_spectra),
+            "counts": sums.ravel(),
+            "counts_std": std.ravel(),
+        }
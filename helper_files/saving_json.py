@@ -1,6 +1,10 @@
 # Saving and loading the spectrum-dictionary to a file
 
 import json
+import os
+import struct
+import zipfile
+
 import numpy as np
 
 
@@ -19,7 +23,7 @@ def save_spectrum_to_json(s):
     # first make a dictionary where the ndarrays are converted to lists
     s_list = {}
     for key in s.keys():
-        if type(s[key]) == np.ndarray:
+        if isinstance(s[key], np.ndarray):  # also np.memmap from the cache
             s_list[key] = s[key].tolist()
         else:
             s_list[key] = s[key]
@@ -57,6 +61,8 @@ def read_saved_spectrum_from_json(filename):
         "fit_params",
         "fit_cov",
         "intensity_fit",
+        "background",
+        "net_counts",
     ]
     with open(filename, "r") as f:
         s = json.load(f)
@@ -68,3 +74,164 @@ def read_saved_spectrum_from_json(filename):
 
     print(f"Read the spectrum from: {filename}")
     return s
+
+
+def derived_arrays(s):
+    """
+    Makes the arrays which can be calculated from the rest of the spectrum dictionary.
+    These are not saved by save_spectrum_to_npz, but made again when reading.
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary, at least with counts
+
+    Returns
+    -------
+    dict
+        the derived arrays, channel and intensity, and kev_calibrated and intensity_fit if possible
+    """
+    counts = s["counts"]
+    channel = np.arange(len(counts))
+    derived = {"channel": channel, "intensity": counts / counts.max()}
+    if s.get("dispersion") is not None and s.get("offset") is not None:
+        derived["kev_calibrated"] = (channel - s["offset"]) * s["dispersion"]
+    if s.get("fit_params") is not None:
+        # imported here, since it is only needed for fitted spectra
+        from helper_files.gaussian_fitting import n_gaussians
+
+        derived["intensity_fit"] = n_gaussians(channel, *s["fit_params"])
+    return derived
+
+
+def npz_filename(filepath, folder="Lab3_data_calibrated"):
+    """
+    The file save_spectrum_to_npz saves the spectrum of filepath to, eg x.v1.msa to folder/x.v1_calibrated.npz.
+    Only the last suffix is removed, so files which differ after the first dot get different names.
+    """
+    return f"{folder}/{os.path.splitext(os.path.basename(filepath))[0]}_calibrated.npz"
+
+
+def save_spectrum_to_npz(s, folder="Lab3_data_calibrated"):
+    """
+    Save a spectrum dict to a binary .npz file, a much smaller and faster alternative to save_spectrum_to_json.
+    The ndarrays are saved as raw binary, and the other values as a small json string in the same file.
+    Arrays which can be made from the rest (channel, intensity, kev_calibrated and intensity_fit)
+    are not saved if they are the same as the derived ones.
+    Saves the file to the folder Lab3_data_calibrated, adding the suffix _calibrated to the filename.
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary
+    folder : string, optional
+        folder to save the file in, by default "Lab3_data_calibrated"
+
+    Returns
+    -------
+    string
+        the filename
+    """
+    derived = derived_arrays(s)
+
+    arrays = {}
+    metadata = {}
+    for key in s.keys():
+        if isinstance(s[key], np.ndarray):
+            # only saved if it is different from what can be calculated,
+            # the tolerance is for rounding errors when summing the gaussians
+            if key in derived and np.allclose(s[key], derived[key], rtol=1e-12, atol=1e-15):
+                continue
+            arrays[key] = s[key]
+        else:
+            metadata[key] = s[key]
+
+    filename = npz_filename(s["filepath"], folder)
+    print(f"Saved the spectrum to: {filename}")
+
+    # np.savez does not compress, so the arrays can be memory-mapped when reading
+    np.savez(filename, metadata=np.array(json.dumps(metadata).encode()), **arrays)
+    return filename
+
+
+def npz_member_memmap(filename, info):
+    """
+    Memory-maps one array in an uncompressed .npz file, without reading it.
+    The .npz is a zip file, where each array is a .npy file stored as it is.
+
+    Parameters
+    ----------
+    filename : string
+        the .npz file
+    info : zipfile.ZipInfo
+        the zip entry of the array
+
+    Returns
+    -------
+    np.memmap
+        the array, read-only
+    """
+    with open(filename, "rb") as f:
+        # the local zip header is 30 bytes, followed by the filename and an extra field
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        # then the .npy header
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return np.memmap(
+        filename,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+def read_saved_spectrum_from_npz(filename, mmap=False):
+    """
+    Reading a spectrum dictionary from a .npz file saved by save_spectrum_to_npz.
+    The arrays which were not saved are calculated again.
+
+    Parameters
+    ----------
+    filename : string
+        which file to read
+    mmap : bool, optional
+        memory-map the saved arrays instead of reading them, by default False
+
+    Returns
+    -------
+    dict
+        spectrum dictionary
+    """
+    with zipfile.ZipFile(filename) as zf:
+        with zf.open("metadata.npy") as f:
+            s = json.loads(np.lib.format.read_array(f).item().decode())
+
+        for info in zf.infolist():
+            key = info.filename[: -len(".npy")]
+            if key == "metadata":
+                continue
+            # np.savez does not compress, but compressed arrays must be read
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                s[key] = npz_member_memmap(filename, info)
+            else:
+                with zf.open(info) as f:
+                    s[key] = np.lib.format.read_array(f)
+
+    # adding the arrays which were not saved
+    for key, array in derived_arrays(s).items():
+        if key not in s:
+            s[key] = array
+
+    print(f"Read the spectrum from: {filename}")
+    return s
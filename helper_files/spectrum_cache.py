@@ -0,0 +1,193 @@
+# helper file for caching the parsed spectra as binary .npy files
+# the first read of a file parses the text, later reads are memory-mapped with np.load(mmap_mode='r')
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# the cache is cleaned down to this size when it grows larger, 1 GB
+MAX_CACHE_BYTES = 1024**3
+
+
+def file_hash(filepath):
+    """
+    sha1 hash of the content of a file.
+
+    Parameters
+    ----------
+    filepath : string / path
+        path to the file
+
+    Returns
+    -------
+    string
+        hex digest of the content
+    """
+    with open(filepath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def cache_key(filepath, read_params=None):
+    """
+    The name of the cached file, made from the path, modification time and size of the file.
+    The parameters used to read the file are included, since they decide what is read.
+    The key only uses this metadata, not the content, so a file rewritten with the same size
+    within the resolution of the modification time has the same key, see verify in load_cached_counts.
+
+    Parameters
+    ----------
+    filepath : string / path
+        path to the file
+    read_params : list, optional
+        eg [start_str, stop_str, line_endings, delimiter], by default None
+
+    Returns
+    -------
+    string
+        the key, a hex digest
+    """
+    stat = os.stat(filepath)
+    key = f"{os.path.abspath(filepath)}|{stat.st_mtime_ns}|{stat.st_size}|{read_params!r}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def cache_paths(cache_dir, key):
+    """Paths to the .npy file with the counts and the .json file with the metadata."""
+    return os.path.join(cache_dir, f"{key}.npy"), os.path.join(cache_dir, f"{key}.json")
+
+
+def load_cached_counts(filepath, cache_dir, read_params=None, verify=False):
+    """
+    Loads the counts of a file from the cache, memory-mapped and read-only.
+
+    Parameters
+    ----------
+    filepath : string / path
+        path to the original data file
+    cache_dir : string / path
+        folder with the cached files
+    read_params : list, optional
+        the parameters used to read the file, see cache_key, by default None
+    verify : bool, optional
+        compare the hash of the file content with the cached hash, by default False
+
+    Returns
+    -------
+    tuple
+        counts as np.memmap and the metadata dictionary, or None if the file is not cached
+    """
+    key = cache_key(filepath, read_params)
+    npy_path, json_path = cache_paths(cache_dir, key)
+    if not (os.path.exists(npy_path) and os.path.exists(json_path)):
+        return None
+
+    with open(json_path, "r") as f:
+        metadata = json.load(f)
+
+    # the path and modification time can be the same even if the content is changed, eg when copying
+    if verify and metadata["content_hash"] != file_hash(filepath):
+        return None
+
+    counts = np.load(npy_path, mmap_mode="r")
+
+    # updating the modification time, so the least recently used files are removed first
+    os.utime(npy_path)
+    return counts, metadata
+
+
+def save_cached_counts(filepath, cache_dir, counts, header=None, read_params=None, max_bytes=MAX_CACHE_BYTES):
+    """
+    Saves the counts of a file to the cache, and removes old files if the cache is too large.
+
+    Parameters
+    ----------
+    filepath : string / path
+        path to the original data file
+    cache_dir : string / path
+        folder with the cached files, made if it does not exist
+    counts : np.array
+        the counts read from the file
+    header : dict, optional
+        header dictionary from read_header, by default None
+    read_params : list, optional
+        the parameters used to read the file, see cache_key, by default None
+    max_bytes : int, optional
+        maximum size of the cache folder, by default MAX_CACHE_BYTES
+
+    Returns
+    -------
+    np.memmap
+        the cached counts, memory-mapped and read-only
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key(filepath, read_params)
+    npy_path, json_path = cache_paths(cache_dir, key)
+
+    metadata = {
+        "filepath": os.path.abspath(filepath),
+        "content_hash": file_hash(filepath),
+        "header": header,
+    }
+
+    # writing to temporary files first, so other processes never see a half written file,
+    # and the .json is replaced last, since load_cached_counts needs both
+    tmp_npy_path = f"{npy_path}.{os.getpid()}.tmp"
+    tmp_json_path = f"{json_path}.{os.getpid()}.tmp"
+    with open(tmp_npy_path, "wb") as f:
+        np.save(f, np.asarray(counts))
+    with open(tmp_json_path, "w") as f:
+        f.write(json.dumps(metadata))
+    os.replace(tmp_npy_path, npy_path)
+    os.replace(tmp_json_path, json_path)
+
+    cached_counts = np.load(npy_path, mmap_mode="r")
+    # the new file is kept, even if it is larger than max_bytes on its own
+    evict_cache(cache_dir, max_bytes, keep=key)
+    return cached_counts
+
+
+def evict_cache(cache_dir, max_bytes=MAX_CACHE_BYTES, keep=None):
+    """
+    Removes the least recently used files until the cache folder is smaller than max_bytes.
+
+    Parameters
+    ----------
+    cache_dir : string / path
+        folder with the cached files
+    max_bytes : int, optional
+        maximum size of the cache folder, by default MAX_CACHE_BYTES
+    keep : string, optional
+        key of a spectrum which is not removed, eg the one just saved, by default None
+
+    Returns
+    -------
+    int
+        number of removed spectra
+    """
+    entries = []
+    total_bytes = 0
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".npy") or entry.name == f"{keep}.npy":
+            continue
+        stat = entry.stat()
+        json_path = entry.path[: -len(".npy")] + ".json"
+        size = stat.st_size + (os.path.getsize(json_path) if os.path.exists(json_path) else 0)
+        entries.append((stat.st_mtime, size, entry.path, json_path))
+        total_bytes += size
+
+    # oldest first
+    entries.sort()
+    removed = 0
+    for _, size, npy_path, json_path in entries:
+        if total_bytes <= max_bytes:
+            break
+        for path in (npy_path, json_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+        total_bytes -= size
+        removed += 1
+    return removed
@@ -0,0 +1,214 @@
+# helper file for holding many spectra at once
+# instead of one dictionary per spectrum, the counts of all spectra are in one 2d array,
+# and the numbers of each spectrum (dispersion, offset, ...) are in 1d arrays
+
+import numpy as np
+
+from helper_files.calibration import Calibration
+
+
+class SpectrumCollection:
+    """
+    Many spectra with the same number of channels, stored as one (n_spectra, n_channels) array.
+    The channel axis is shared, and the kev_calibrated axis is made once for each calibration.
+    Each spectrum can still be taken out as a spectrum dictionary with collection[i],
+    so the plotting and saving functions can be used as before.
+    The counts are read-only, since the normalisation of intensity is calculated once,
+    so corrections like background or blank subtraction make a new collection.
+
+    Parameters
+    ----------
+    counts : np.array
+        2d array with the counts, one row per spectrum
+    names : list of string, optional
+        names of the spectra, by default "spectrum i"
+    filepaths : list of string, optional
+        paths to the data files, by default None
+    dispersion : float or np.array, optional
+        dispersion [keV/channel] of all or each spectrum, by default None
+    offset : float or np.array, optional
+        offset [channels] of all or each spectrum, by default None
+    livetime : float or np.array, optional
+        live time [s] of all or each spectrum, by default None
+    """
+
+    def __init__(self, counts, names=None, filepaths=None, dispersion=None, offset=None, livetime=None):
+        # one contiguous block of memory for all the spectra, as a read-only view,
+        # so the array given (eg from a batch) is not changed
+        self.counts = np.ascontiguousarray(counts, dtype=np.float64).view()
+        self.counts.flags.writeable = False
+        if self.counts.ndim != 2:
+            raise ValueError(f"counts must be 2d (n_spectra, n_channels), got shape {self.counts.shape}")
+        n_spectra, n_channels = self.counts.shape
+
+        self.names = list(names) if names is not None else [f"spectrum {i}" for i in range(n_spectra)]
+        self.filepaths = list(filepaths) if filepaths is not None else [None] * n_spectra
+
+        # the numbers of each spectrum are columns, nan when unknown
+        self.dispersion = self._column(dispersion)
+        self.offset = self._column(offset)
+        self.livetime = self._column(livetime)
+
+        # the channel axis is the same for all spectra, and should not be changed
+        self.channel = np.arange(n_channels)
+        self.channel.flags.writeable = False
+
+        self._norm_max = None
+
+    def _column(self, values):
+        """Makes a 1d float array with one value per spectrum, nan for None."""
+        column = np.full(len(self.counts), np.nan)
+        if values is not None:
+            column[:] = np.array(values, dtype=np.float64)
+        return column
+
+    @classmethod
+    def from_spectra(cls, spectra):
+        """
+        Makes a collection from a list of spectrum dictionaries, eg from init_known_spectrum.
+
+        Parameters
+        ----------
+        spectra : list of dict
+            spectrum dictionaries, with the same number of channels
+
+        Returns
+        -------
+        SpectrumCollection
+        """
+        n_channels = len(spectra[0]["counts"])
+        counts = np.empty((len(spectra), n_channels))
+        for i, s in enumerate(spectra):
+            if len(s["counts"]) != n_channels:
+                raise ValueError(
+                    f"{s['name']} has {len(s['counts'])} channels, while {spectra[0]['name']} has {n_channels}"
+                )
+            counts[i] = s["counts"]
+
+        def get_column(key):
+            return [np.nan if s.get(key) is None else s[key] for s in spectra]
+
+        def get_livetime(s):
+            header = s.get("header")
+            if header is None or header.get("livetime") is None:
+                return np.nan
+            return header["livetime"]
+
+        return cls(
+            counts,
+            names=[s["name"] for s in spectra],
+            filepaths=[s.get("filepath") for s in spectra],
+            dispersion=get_column("dispersion"),
+            offset=get_column("offset"),
+            livetime=[get_livetime(s) for s in spectra],
+        )
+
+    @classmethod
+    def from_batch(cls, batch):
+        """
+        Makes a collection from the batch dictionary of calibrate_files_with_known.
+        The counts are used as they are, without copying.
+
+        Parameters
+        ----------
+        batch : dict
+            batch dictionary from batch_calibration.calibrate_files_with_known
+
+        Returns
+        -------
+        SpectrumCollection
+        """
+        return cls(
+            batch["counts"],
+            names=[path.split("/")[-1] for path in batch["filepaths"]],
+            filepaths=batch["filepaths"],
+            dispersion=batch["dispersion"],
+            offset=batch["offset"],
+        )
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def n_channels(self):
+        return self.counts.shape[1]
+
+    @property
+    def norm_max(self):
+        """The maximum of each spectrum, which intensity is normalised to. Calculated once."""
+        if self._norm_max is None:
+            self._norm_max = self.counts.max(axis=1)
+        return self._norm_max
+
+    def intensity(self, index=None):
+        """
+        Counts normalised to the maximum of each spectrum, made when asked for.
+
+        Parameters
+        ----------
+        index : int or slice, optional
+            which spectra, by default None which is all
+
+        Returns
+        -------
+        np.array
+            the intensity, 1d for one spectrum and 2d for more
+        """
+        if index is None:
+            index = slice(None)
+        norm_max = self.norm_max[index]
+        if np.ndim(norm_max) == 1:
+            norm_max = norm_max[:, None]
+        return self.counts[index] / norm_max
+
+    def kev_calibrated(self, index):
+        """
+        The calibrated keV axis of one spectrum.
+        Spectra with the same dispersion and offset share one read-only array (see Calibration.axis).
+
+        Parameters
+        ----------
+        index : int
+            which spectrum
+
+        Returns
+        -------
+        np.array
+            the keV axis, or None if the spectrum is not calibrated
+        """
+        dispersion, offset = self.dispersion[index], self.offset[index]
+        if np.isnan(dispersion) or np.isnan(offset):
+            return None
+        return Calibration(dispersion=dispersion, offset=offset).axis(self.n_channels)
+
+    def __getitem__(self, index):
+        """
+        One spectrum as a spectrum dictionary, like the ones from spectrum_dict.py.
+        The counts are a read-only view into the collection, use .copy() to change them.
+        The headers are not kept in the collection, so 'header' is None, and a spectrum without
+        a filepath gets its name as filepath, which the saving and report functions name the files from.
+        """
+        if index < 0:
+            index += len(self)
+        dispersion, offset = self.dispersion[index], self.offset[index]
+        return {
+            "name": self.names[index],
+            "filepath": self.filepaths[index] if self.filepaths[index] is not None else self.names[index],
+            "channel": self.channel,
+            "intensity": self.intensity(index),
+            "counts": self.counts[index],
+            "peaks_keV": None,
+            "peaks_names": None,
+            "peaks_channel": None,
+            "dispersion": None if np.isnan(dispersion) else float(dispersion),
+            "offset": None if np.isnan(offset) else float(offset),
+            "kev_calibrated": self.kev_calibrated(index),
+            "fit_params": None,
+            "fit_cov": None,
+            "intensity_fit": None,
+            "header": None,
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
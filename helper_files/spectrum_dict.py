@@ -2,7 +2,85 @@
 
 import numpy as np
 
+from helper_files.calibration import Calibration
 from helper_files.read_data import read_xy_data, read_only_y_data
+from helper_files.read_header import header_calibration, read_spectrum_file
+from helper_files.spectrum_cache import load_cached_counts, save_cached_counts
+
+
+def read_spectrum_data(
+    filepath, start_str, stop_str, line_endings, delimiter, cache_dir=None, print_info=True, verify_cache=False
+):
+    """
+    Reads the data of a spectrum file, used by the init functions below.
+    If start_str is None the file format is found from the header (see read_header.py),
+    else the file is read with the given strings.
+    With a cache_dir the counts are saved as .npy the first time,
+    and memory-mapped from there the next times (see spectrum_cache.py).
+
+    Parameters
+    ----------
+    filepath : string
+        relative path to the data file
+    start_str : string
+        string that marks the start of the data, or None to read the header
+    stop_str : string
+        string that marks the end of the data
+    line_endings : string
+        string that marks the end of each line
+    delimiter : string
+        string that splits the data, only to be used on eg .emsa files with x&y
+    cache_dir : string, optional
+        folder for the cached counts, by default None which does not cache
+    print_info : bool, optional
+        printing information about the file, by default True
+    verify_cache : bool, optional
+        also compare the content of the file with the cached one, since the cache only checks
+        the modification time and size, by default False
+
+    Returns
+    -------
+    tuple
+        [channels, counts] and the header dictionary (None if not read), or None
+    """
+    read_params = [start_str, stop_str, line_endings, delimiter]
+    if cache_dir is not None:
+        cached = load_cached_counts(filepath, cache_dir, read_params, verify=verify_cache)
+        if cached is not None:
+            counts, metadata = cached
+            if print_info:
+                print(f"Read {filepath} from the cache in {cache_dir}")
+            return [np.arange(len(counts)), counts], metadata["header"]
+
+    result = read_spectrum_data_from_file(filepath, start_str, stop_str, line_endings, delimiter, print_info)
+    if result is None or cache_dir is None:
+        return result
+
+    data_raw, header = result
+    counts = save_cached_counts(filepath, cache_dir, data_raw[1], header, read_params)
+    return [data_raw[0], counts], header
+
+
+def read_spectrum_data_from_file(filepath, start_str, stop_str, line_endings, delimiter, print_info=True):
+    """
+    Reads the text file for read_spectrum_data, see there for the parameters.
+    """
+    # the header tells how to read the file
+    if start_str is None:
+        result = read_spectrum_file(filepath, print_info)
+        if result is None:
+            return None
+        header, data_raw = result
+        return data_raw, header
+
+    # if the file is with x and y, delimiter must be specified
+    if delimiter:
+        data_raw = read_xy_data(filepath, start_str, stop_str, delimiter, line_endings, print_info)
+    else:
+        data_raw = read_only_y_data(filepath, start_str, stop_str, line_endings, print_info)
+    if data_raw is None:
+        return None
+    return data_raw, None
 
 
 # the '*' argument is that all arguments (after) must be named (kwarg) and not just positional arguments
@@ -10,17 +88,22 @@ def init_known_spectrum(
     *,
     name,
     filepath,
-    start_str,
-    stop_str,
-    line_endings,
+    start_str=None,
+    stop_str=None,
+    line_endings=None,
     delimiter=None,
     peaks_keV=None,
     peaks_names=None,
     peaks_channel=None,
+    use_header_calibration=False,
+    cache_dir=None,
+    verify_cache=False,
 ):
     """
     initializing the spectrum dictionary. 
-    Must have a name, filepath, start and stop string, and line endings to read the data.
+    Must have a name and filepath.
+    The start and stop string, and line endings are found from the header of .msa, .emsa and .mca files,
+    but can be given to read other files.
     Can have peaks_keV, peaks_names, peaks_channel.
 
     Parameters
@@ -29,12 +112,12 @@ def init_known_spectrum(
         Name of the spectrum, used in plots
     filepath : string
         relative path to the data file
-    start_str : string
-        string that marks the start of the data
-    stop_str : string
-        string that marks the end of the data
-    line_endings : string
-        string that marks the end of each line
+    start_str : string, optional
+        string that marks the start of the data, by default None which reads the header
+    stop_str : string, optional
+        string that marks the end of the data, by default None
+    line_endings : string, optional
+        string that marks the end of each line, by default None
     delimiter : string, optional
         string that splits the data, only to be used on eg .emsa files with x&y, by default None
     peaks_keV : list of floats, optional
@@ -43,6 +126,13 @@ def init_known_spectrum(
         names of the peaks, by default None
     peaks_channel : list of int, optional
         channel values of the peaks, first a guess then corrected after fitting, by default None
+    use_header_calibration : bool, optional
+        set dispersion, offset and kev_calibrated from the calibration in the file header,
+        skipping the fitting and calibration, by default False
+    cache_dir : string, optional
+        folder to cache the parsed counts in, so the file is only parsed once, by default None
+    verify_cache : bool, optional
+        compare the content of the file with the cached one, see read_spectrum_data, by default False
 
     Returns
     -------
@@ -50,18 +140,15 @@ def init_known_spectrum(
         spectrum dictionary
     """
 
-    # if the file is with x and y, delimiter must be specified
-    if delimiter:
-        data_raw = read_xy_data(filepath, start_str, stop_str, delimiter, line_endings)
-        keV_uncalibrated = data_raw[0]  # unused. Not needed, but could be for xy-data in the future
-    else:
-        data_raw = read_only_y_data(filepath, start_str, stop_str, line_endings)
-        keV_uncalibrated = None
-    if data_raw is None:
+    result = read_spectrum_data(
+        filepath, start_str, stop_str, line_endings, delimiter, cache_dir, verify_cache=verify_cache
+    )
+    if result is None:
         print(
             "ERROR: could not read the data properly, please check the parameters for reading the file"
         )
         return None
+    data_raw, header = result
 
     # this is the data set we will be working with.
     #       - y: counts normalized to the maximum peak
@@ -88,12 +175,24 @@ def init_known_spectrum(
         "start_str": start_str,
         "stop_str": stop_str,
         "line_endings": line_endings,
-        "delimiter": delimiter
+        "delimiter": delimiter,
+        "header": header,
     }
+
+    # the instrument calibration from the header, eg #XPERCHAN and #OFFSET in .emsa files
+    if use_header_calibration:
+        calibration = header_calibration(header) if header is not None else None
+        if calibration is None:
+            print(f"WARNING: {filepath} has no calibration in the header, it must be calibrated by fitting")
+        else:
+            spectrum["dispersion"], spectrum["offset"] = calibration
+            # the same read-only axis is shared with all spectra from the same detector setup
+            spectrum["kev_calibrated"] = Calibration(*calibration).axis(len(channels))
+
     return spectrum
 
 
-def init_unknown_spectrum_with_known(*, known_spectrum, name, filepath, start_str=None, stop_str=None, line_endings=None, delimiter=None, peaks_keV=None, peaks_names=None, peaks_channel=None):
+def init_unknown_spectrum_with_known(*, known_spectrum, name, filepath, start_str=None, stop_str=None, line_endings=None, delimiter=None, peaks_keV=None, peaks_names=None, peaks_channel=None, cache_dir=None, verify_cache=False):
     """
     initializing a unknown spectrum dictionary, from a calibrated spectrum.
     assuming the same dispersion and offset as the known spectrum
@@ -121,6 +220,10 @@ def init_unknown_spectrum_with_known(*, known_spectrum, name, filepath, start_st
         names of the peaks, by default None
     peaks_channel : list of int, optional
         channel values of the peaks, first a guess then corrected after fitting, by default None
+    cache_dir : string, optional
+        folder to cache the parsed counts in, so the file is only parsed once, by default None
+    verify_cache : bool, optional
+        compare the content of the file with the cached one, see read_spectrum_data, by default False
 
     Returns
     -------
@@ -141,28 +244,26 @@ def init_unknown_spectrum_with_known(*, known_spectrum, name, filepath, start_st
         print('Returned None')
         return None
 
-    # assuming the filetype is the same as the known spectrum, we just use the same values
+    # assuming the filetype is the same as the known spectrum, we just use the same values.
+    # if the known spectrum was read from the header, start_str is None and so is the new one
     if start_str is None:
-        start_str = known_spectrum["start_str"]
+        start_str = known_spectrum.get("start_str")
     if stop_str is None:
-        stop_str = known_spectrum["stop_str"]
+        stop_str = known_spectrum.get("stop_str")
     if line_endings is None:
-        line_endings = known_spectrum["line_endings"]
+        line_endings = known_spectrum.get("line_endings")
     if delimiter is None:
-        delimiter = known_spectrum["delimiter"]
+        delimiter = known_spectrum.get("delimiter")
     
-    # if the file is with x and y, delimiter must be specified
-    if delimiter:
-        data_raw = read_xy_data(filepath, start_str, stop_str, delimiter, line_endings)
-        keV_uncalibrated = data_raw[0]  # unused
-    else:
-        data_raw = read_only_y_data(filepath, start_str, stop_str, line_endings)
-        keV_uncalibrated = None
-    if data_raw is None:
+    result = read_spectrum_data(
+        filepath, start_str, stop_str, line_endings, delimiter, cache_dir, verify_cache=verify_cache
+    )
+    if result is None:
         print(
             "ERROR: could not read the data properly, please check the parameters for reading the file. Returning None"
         )
         return None
+    data_raw, header = result
     
     # this is the data set we will be working with.
     #       - y: counts normalized to the maximum peak
@@ -193,6 +294,7 @@ def init_unknown_spectrum_with_known(*, known_spectrum, name, filepath, start_st
         "fit_params": None,
         "fit_cov": None,
         "intensity_fit": None,
+        "header": header,
     }
 
     print(f"Success! {spectrum['filepath']} was read into a dictionary\n")
@@ -0,0 +1,314 @@
+# helper file for spectrum images (EDS maps), with one spectrum in every pixel
+# the cube (rows, columns, channels) is memory-mapped from disk, and is processed a block of rows at a time,
+# so maps larger than the memory can be calibrated, integrated and fitted
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from helper_files.calibration import Calibration
+from helper_files.roi import RegionsOfInterest
+
+# the default size of the blocks of rows which are processed at a time
+CHUNK_BYTES = 64 * 2**20
+
+
+def open_cube(source):
+    """
+    Memory-maps the cube read-only, from (filepath, shape, dtype, offset).
+    .npy files have the shape and dtype in the file, other files are raw binary, eg the .raw of a .rpl/.raw pair.
+    Is run in the worker processes, so the cube is never sent between processes.
+    """
+    filepath, shape, dtype, offset = source
+    if filepath.endswith(".npy"):
+        return np.load(filepath, mmap_mode="r")
+    return np.memmap(filepath, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+def run_on_chunks(func, source, row_chunks, args, n_workers=None):
+    """
+    Runs func(source, rows, *args) on each block of rows, in worker processes.
+    Only 2 * n_workers blocks are given to the workers at a time, so the results waiting
+    to be used stays small when the cube is large.
+
+    Yields
+    ------
+    tuple
+        the rows (a slice) and the result of func, in the order they are finished
+    """
+    if n_workers is None or n_workers <= 1:
+        for rows in row_chunks:
+            yield rows, func(source, rows, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = {}
+        for rows in row_chunks:
+            pending[executor.submit(func, source, rows, *args)] = rows
+            while len(pending) >= 2 * n_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def sum_chunk(source, rows):
+    """The sum of all the spectra in a block of rows, used by SpectrumImage.sum_spectrum."""
+    return open_cube(source)[rows].sum(axis=(0, 1), dtype=np.float64)
+
+
+def window_chunk(source, rows, roi):
+    """
+    The counts in each window for each pixel in a block of rows, used by SpectrumImage.window_maps.
+    """
+    sums, _ = roi.integrate(open_cube(source)[rows])
+    # (windows, rows, columns)
+    return np.moveaxis(sums, 2, 0)
+
+
+def fit_chunk(source, rows, guessed_params, window, bounded):
+    """
+    Fits the gaussians in each pixel of a block of rows, used by SpectrumImage.fit_maps.
+    The pixels are fitted one after the other along each row, starting from the pixel before,
+    and each pixel is normalised to its maximum, as the intensity of a spectrum dictionary.
+    """
+    # imported here, so only the workers which fit need scipy
+    from helper_files.gaussian_fitting import fit_series_chunk
+
+    block = np.asarray(open_cube(source)[rows], dtype=np.float64)
+    n_rows, n_columns, n_channels = block.shape
+    pixels = block.reshape(-1, n_channels)
+    maximum = pixels.max(axis=1, keepdims=True)
+    # empty pixels are nan, and the fit of them fails and gives nan
+    intensity = np.divide(pixels, maximum, out=np.full(pixels.shape, np.nan), where=maximum > 0)
+
+    fit_params, _ = fit_series_chunk(np.arange(n_channels), intensity, guessed_params, window, bounded)
+    # the amplitudes back to counts
+    fit_params[:, 0::3] *= maximum
+    return fit_params.reshape(n_rows, n_columns, -1)
+
+
+class SpectrumImage:
+    """
+    A spectrum image, with a spectrum in every pixel, stored as a memory-mapped (rows, columns, channels) array.
+    The cube is read from disk a block of rows at a time, so it does not need to fit in memory,
+    and the blocks can be processed by many processes at once.
+
+    Parameters
+    ----------
+    filepath : string
+        a .npy file, or a raw binary file which needs shape and dtype
+    shape : tuple, optional
+        (rows, columns, channels) of a raw file, by default None
+    dtype : np.dtype, optional
+        data type of a raw file, eg np.uint16, by default None
+    offset : int, optional
+        bytes before the data in a raw file, by default 0
+    name : string, optional
+        name used in plots, by default the filename
+    chunk_bytes : int, optional
+        largest size of the blocks of rows, by default CHUNK_BYTES (64 MB)
+    """
+
+    def __init__(self, filepath, shape=None, dtype=None, offset=0, name=None, chunk_bytes=CHUNK_BYTES):
+        filepath = str(filepath)
+        if not filepath.endswith(".npy") and (shape is None or dtype is None):
+            raise ValueError("A raw spectrum image needs the shape (rows, columns, channels) and dtype")
+        self.source = (filepath, shape, dtype, offset)
+        self.cube = open_cube(self.source)
+        if self.cube.ndim != 3:
+            raise ValueError(f"The spectrum image must be (rows, columns, channels), got shape {self.cube.shape}")
+
+        self.name = name if name is not None else os.path.basename(filepath)
+        self.filepath = filepath
+        self.chunk_bytes = chunk_bytes
+        self.dispersion = None
+        self.offset = None
+
+    @classmethod
+    def create(cls, filepath, shape, dtype=np.uint16, **kwargs):
+        """
+        Makes a new, empty .npy spectrum image on disk, which can be filled a block at a time
+        with SpectrumImage.write_rows, eg while the map is measured.
+        """
+        np.lib.format.open_memmap(filepath, mode="w+", dtype=dtype, shape=tuple(shape)).flush()
+        return cls(filepath, **kwargs)
+
+    @classmethod
+    def from_array(cls, filepath, cube, **kwargs):
+        """Saves a cube which is in memory as a .npy spectrum image."""
+        np.save(filepath, np.asarray(cube))
+        return cls(filepath, **kwargs)
+
+    def write_rows(self, start_row, block):
+        """
+        Writes a block of spectra to the .npy file, starting at start_row.
+
+        Parameters
+        ----------
+        start_row : int
+            the first row of the block
+        block : np.array
+            (rows, columns, channels)
+        """
+        cube = np.load(self.filepath, mmap_mode="r+")
+        cube[start_row : start_row + len(block)] = block
+        cube.flush()
+
+    @property
+    def shape(self):
+        return self.cube.shape
+
+    @property
+    def n_channels(self):
+        return self.cube.shape[2]
+
+    def row_chunks(self):
+        """The blocks of rows as slices, each block smaller than chunk_bytes."""
+        n_rows, n_columns, n_channels = self.cube.shape
+        # the size of one row, as float64 since the blocks are converted
+        row_bytes = n_columns * n_channels * 8
+        rows_per_chunk = max(1, self.chunk_bytes // row_bytes)
+        return [slice(start, min(start + rows_per_chunk, n_rows)) for start in range(0, n_rows, rows_per_chunk)]
+
+    def calibrate_with_known(self, known_spectrum):
+        """
+        Uses the dispersion and offset of a calibrated spectrum, like init_unknown_spectrum_with_known.
+        The spectra must have the same number of channels.
+
+        Parameters
+        ----------
+        known_spectrum : dict
+            a calibrated spectrum dictionary
+        """
+        if known_spectrum["dispersion"] is None or known_spectrum["offset"] is None:
+            raise ValueError(f"The known_spectrum {known_spectrum['name']} lacks either dispersion or offset")
+        if len(known_spectrum["counts"]) != self.n_channels:
+            raise ValueError(
+                f"The calibrated spectrum has {len(known_spectrum['counts'])} data points, while {self.name} has {self.n_channels}"
+            )
+        self.dispersion = known_spectrum["dispersion"]
+        self.offset = known_spectrum["offset"]
+        return self
+
+    @property
+    def calibration(self):
+        if self.dispersion is None or self.offset is None:
+            raise ValueError(f"{self.name} is not calibrated, use calibrate_with_known first")
+        return Calibration(self.dispersion, self.offset)
+
+    @property
+    def kev_calibrated(self):
+        """The keV axis, shared with the spectra with the same calibration."""
+        return self.calibration.axis(self.n_channels)
+
+    def sum_spectrum(self, n_workers=None):
+        """
+        The sum of the spectra in all pixels, as a spectrum dictionary.
+        Used to find and fit the peaks, which are then mapped with window_maps or fit_maps.
+
+        Parameters
+        ----------
+        n_workers : int, optional
+            number of processes, by default None which uses this process
+
+        Returns
+        -------
+        dict
+            spectrum dictionary, calibrated if the spectrum image is
+        """
+        counts = np.zeros(self.n_channels)
+        for _, chunk_sum in run_on_chunks(sum_chunk, self.source, self.row_chunks(), (), n_workers):
+            counts += chunk_sum
+        calibrated = self.dispersion is not None and self.offset is not None
+        return {
+            "name": f"sum of {self.name}",
+            "filepath": self.filepath,
+            "channel": np.arange(self.n_channels),
+            "intensity": counts / counts.max(),
+            "counts": counts,
+            "peaks_keV": None,
+            "peaks_names": None,
+            "peaks_channel": None,
+            "dispersion": self.dispersion,
+            "offset": self.offset,
+            "kev_calibrated": self.kev_calibrated if calibrated else None,
+            "fit_params": None,
+            "fit_cov": None,
+            "intensity_fit": None,
+        }
+
+    def window_maps(self, kev_low, kev_high, fractional=False, n_workers=None):
+        """
+        Maps of the counts in energy windows, eg around the lines of each element, see roi.py.
+
+        Parameters
+        ----------
+        kev_low : list of float
+            lower energy of each window
+        kev_high : list of float
+            upper energy of each window
+        fractional : bool, optional
+            count the part of the edge channels inside the window, see RegionsOfInterest, by default False
+        n_workers : int, optional
+            number of processes, by default None which uses this process
+
+        Returns
+        -------
+        np.array
+            (windows, rows, columns) with the counts in each window
+        """
+        roi = RegionsOfInterest(kev_low, kev_high, self.calibration, self.n_channels, fractional=fractional)
+        maps = np.empty((len(roi),) + self.shape[:2])
+        for rows, chunk_maps in run_on_chunks(window_chunk, self.source, self.row_chunks(), (roi,), n_workers):
+            maps[:, rows] = chunk_maps
+        return maps
+
+    def fit_maps(self, guessed_peaks, guessed_std=1, window=None, bounded=True, n_workers=None, out=None):
+        """
+        Fits gaussians to the spectrum of every pixel, eg with the peaks found in sum_spectrum.
+        The amplitudes are in counts, and the centers and widths in channels.
+
+        Parameters
+        ----------
+        guessed_peaks : list of float
+            channels of the peaks
+        guessed_std : float or list, optional
+            width of the peaks in channels, by default 1
+        window : float, optional
+            only fit the channels around the peaks, see fit_n_peaks_to_gaussian, by default None
+        bounded : bool, optional
+            see fit_n_peaks_to_gaussian, by default True
+        n_workers : int, optional
+            number of processes, by default None which uses this process
+        out : string, optional
+            a .npy file to write the maps to, for maps too large for the memory, by default None
+
+        Returns
+        -------
+        np.array
+            (rows, columns, 3 * n_peaks) with [amp1, mu1, std1, amp2, ...] in each pixel, nan where the fit failed
+        """
+        n_peaks = len(guessed_peaks)
+        guessed_params = np.empty((n_peaks, 3))
+        guessed_params[:, 0] = 1
+        guessed_params[:, 1] = guessed_peaks
+        guessed_params[:, 2] = np.broadcast_to(guessed_std, n_peaks)
+        guessed_params = guessed_params.ravel()
+
+        shape = self.shape[:2] + (3 * n_peaks,)
+        if out is None:
+            maps = np.empty(shape)
+        else:
+            maps = np.lib.format.open_memmap(out, mode="w+", dtype=np.float64, shape=shape)
+
+        args = (guessed_params, window, bounded)
+        for rows, chunk_params in run_on_chunks(fit_chunk, self.source, self.row_chunks(), args, n_workers):
+            maps[rows] = chunk_params
+        if out is not None:
+            maps.flush()
+        return maps
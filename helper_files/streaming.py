@@ -0,0 +1,249 @@
+# helper file for calibrating and fitting spectra while they are measured
+# the spectra come from a folder the detector writes to, or as bytes from the acquisition system,
+# and each result is given as soon as it is ready, with only a few spectra in memory at a time
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from fnmatch import fnmatch
+
+import numpy as np
+
+from helper_files.calibration import Calibration
+from helper_files.read_header import parse_spectrum_text
+from helper_files.spectrum_dict import read_spectrum_data
+
+
+def watch_folder(folder, pattern="*.msa", poll_interval=1.0, timeout=None, include_existing=True):
+    """
+    Gives the path of each new file in the folder, as the detector writes them.
+    A file is given when its size is the same in two checks, so it is not read while it is written.
+    Each file is only given once, and the generator stops when no new file has come for timeout seconds.
+    Only the files which are still in the folder are remembered, so the memory does not grow when
+    old files are moved away, but a file which is removed and written again is given again.
+
+    Parameters
+    ----------
+    folder : string
+        the folder the detector writes to
+    pattern : string, optional
+        which files, eg "*.mca", by default "*.msa"
+    poll_interval : float, optional
+        seconds between each look in the folder, by default 1.0
+    timeout : float, optional
+        stop after this many seconds without a new file, by default None which never stops
+    include_existing : bool, optional
+        also give the files which are in the folder from before, by default True
+
+    Yields
+    ------
+    string
+        path to a new file
+    """
+    seen = set()
+    # {path: size} of the files which may still be written to
+    growing = {}
+    if not include_existing:
+        seen.update(entry.path for entry in os.scandir(folder) if fnmatch(entry.name, pattern))
+
+    last_new_file = time.monotonic()
+    while timeout is None or time.monotonic() - last_new_file < timeout:
+        in_folder = set()
+        # os.scandir gives the size without an extra stat per file
+        for entry in os.scandir(folder):
+            if not entry.is_file() or not fnmatch(entry.name, pattern):
+                continue
+            in_folder.add(entry.path)
+            if entry.path in seen:
+                continue
+            size = entry.stat().st_size
+            if size > 0 and growing.get(entry.path) == size:
+                del growing[entry.path]
+                seen.add(entry.path)
+                last_new_file = time.monotonic()
+                yield entry.path
+            else:
+                growing[entry.path] = size
+        # forgetting the files which are gone
+        seen &= in_folder
+        growing = {path: size for path, size in growing.items() if path in in_folder}
+        time.sleep(poll_interval)
+
+
+def read_stream_item(item, read_params):
+    """
+    Reads one spectrum from the stream, which is a filepath or a (name, bytes) tuple.
+
+    Parameters
+    ----------
+    item : string or tuple
+        path to the file, or (name, bytes of the whole file) for .msa, .emsa and .mca files
+    read_params : list
+        [start_str, stop_str, line_endings, delimiter] for files, start_str None reads the header
+
+    Returns
+    -------
+    tuple
+        name, counts and header, counts is None if it could not be read
+    """
+    if isinstance(item, tuple):
+        name, buffer = item
+        if isinstance(buffer, (bytes, bytearray, memoryview)):
+            buffer = bytes(buffer).decode("cp1252")
+        result = parse_spectrum_text(buffer, name, print_info=False)
+        if result is None:
+            return name, None, None
+        header, data = result
+        return name, data[1], header
+
+    result = read_spectrum_data(item, *read_params, print_info=False)
+    if result is None:
+        return item, None, None
+    data, header = result
+    return item, np.asarray(data[1]), header
+
+
+def process_stream_item(item, read_params, n_channels, guessed_params=None, window=None):
+    """
+    Reads one spectrum and fits the peaks, run in the worker processes of stream_spectra.
+    The fit starts from the fitted peaks of the known spectrum.
+
+    Parameters
+    ----------
+    item : string or tuple
+        see read_stream_item
+    read_params : list
+        see read_stream_item
+    n_channels : int
+        number of channels in the known spectrum
+    guessed_params : np.array, optional
+        [amp1, peak1, std1, amp2, ...] to start the fit from, by default None which does not fit
+    window : float, optional
+        channels around the peaks to fit, see fit_n_peaks_to_gaussian, by default None
+
+    Returns
+    -------
+    dict
+        name, counts, header, fit_params, fit_cov and error (None if all went well)
+    """
+    name = item[0] if isinstance(item, tuple) else item
+    result = {"name": name, "counts": None, "header": None, "fit_params": None, "fit_cov": None, "error": None}
+    try:
+        name, counts, header = read_stream_item(item, read_params)
+    except (OSError, ValueError) as error:
+        # eg a file which was deleted, or is not a text file, must not stop the stream
+        result["error"] = f"{type(error).__name__}: {error}"
+        return result
+    result["counts"], result["header"] = counts, header
+    if counts is None:
+        result["error"] = "could not read the data"
+        return result
+    if len(counts) != n_channels:
+        result["error"] = f"the calibrated spectrum has {n_channels} data points, while this one has {len(counts)}"
+        return result
+
+    if guessed_params is not None:
+        # imported here, so the reading workers does not need scipy
+        from helper_files.gaussian_fitting import fit_n_peaks_to_gaussian
+
+        try:
+            result["fit_params"], result["fit_cov"] = fit_n_peaks_to_gaussian(
+                np.arange(n_channels),
+                counts / counts.max(),
+                guessed_peaks=guessed_params[1::3],
+                guessed_std=guessed_params[2::3],
+                guessed_amp=guessed_params[0::3],
+                window=window,
+                bounded=True,
+            )
+        except (RuntimeError, ValueError) as error:
+            result["error"] = f"the fit failed: {error}"
+    return result
+
+
+def stream_spectra(source, known_spectrum, fit=True, window=20, n_workers=None, max_pending=None):
+    """
+    Calibrates the spectra in source with the known spectrum, and fits the same peaks as in the known spectrum.
+    Works like init_unknown_spectrum_with_known, but one spectrum at a time as they arrive,
+    without printing. Each spectrum dictionary is given as soon as it is ready.
+
+    source can be a never-ending generator, eg watch_folder("data", "*.msa").
+    At most max_pending spectra are read from it before the results are taken out (back-pressure),
+    so the memory used stays the same no matter how many spectra are streamed.
+
+    Parameters
+    ----------
+    source : iterable
+        filepaths, or (name, bytes) tuples with the whole .msa, .emsa or .mca file
+    known_spectrum : dict
+        a calibrated spectrum dictionary, with fit_params if fit is True
+    fit : bool, optional
+        fit the peaks of the known spectrum in each spectrum, by default True
+    window : float, optional
+        channels around the peaks to fit, by default 20
+    n_workers : int, optional
+        number of processes, by default None which does everything in this process
+    max_pending : int, optional
+        most spectra read or fitted at the same time, by default 2 * n_workers
+
+    Yields
+    ------
+    dict
+        spectrum dictionary with the calibration of the known spectrum, and an 'error' key.
+        With n_workers the spectra may come in a different order than in source.
+    """
+    if known_spectrum["dispersion"] is None or known_spectrum["offset"] is None:
+        raise ValueError(f"The known_spectrum {known_spectrum['name']} lacks either dispersion or offset")
+
+    read_params = [known_spectrum.get(key) for key in ("start_str", "stop_str", "line_endings", "delimiter")]
+    n_channels = len(known_spectrum["counts"])
+    guessed_params = None
+    if fit:
+        if known_spectrum.get("fit_params") is None:
+            raise ValueError(f"The known_spectrum {known_spectrum['name']} is not fitted, use fit=False")
+        guessed_params = np.asarray(known_spectrum["fit_params"], dtype=np.float64)
+    # the same read-only keV axis for all the spectra
+    kev_calibrated = Calibration(known_spectrum["dispersion"], known_spectrum["offset"]).axis(n_channels)
+
+    def to_spectrum(result):
+        counts = result["counts"]
+        return {
+            "name": result["name"],
+            "filepath": result["name"],
+            "channel": np.arange(len(counts)) if counts is not None else None,
+            "intensity": counts / counts.max() if counts is not None else None,
+            "counts": counts,
+            "peaks_keV": known_spectrum.get("peaks_keV"),
+            "peaks_names": known_spectrum.get("peaks_names"),
+            "peaks_channel": result["fit_params"][1::3] if result["fit_params"] is not None else None,
+            "dispersion": known_spectrum["dispersion"],
+            "offset": known_spectrum["offset"],
+            "kev_calibrated": kev_calibrated,
+            "fit_params": result["fit_params"],
+            "fit_cov": result["fit_cov"],
+            "intensity_fit": None,
+            "header": result["header"],
+            "error": result["error"],
+        }
+
+    if n_workers is None or n_workers <= 1:
+        for item in source:
+            yield to_spectrum(process_stream_item(item, read_params, n_channels, guessed_params, window))
+        return
+
+    if max_pending is None:
+        max_pending = 2 * n_workers
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = set()
+        for item in source:
+            pending.add(executor.submit(process_stream_item, item, read_params, n_channels, guessed_params, window))
+            # waiting for a result before reading more, when enough spectra are in the workers
+            while len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield to_spectrum(future.result())
+        # the source is empty, giving the rest as they finish
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield to_spectrum(future.result())
@@ -0,0 +1,252 @@
+# helper file for finding which element and X-ray line a peak is, from its energy
+# the lines are in xray_lines.csv, and are kept sorted by energy so they can be searched with np.searchsorted
+
+import copy
+import os
+
+import numpy as np
+
+from helper_files.calibration import Calibration
+
+# the table of lines which is bundled with the helper files
+XRAY_LINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xray_lines.csv")
+
+# the index of XRAY_LINES_FILE, loaded the first time it is used, see default_line_index
+_default_index = None
+
+
+class XrayLineIndex:
+    """
+    A table of X-ray emission lines, sorted by energy.
+    Finding the lines close to an energy is a binary search, and many energies,
+    eg the fitted peaks of all spectra, are matched with one np.searchsorted call.
+
+    The lines are named like 'Cu-Ka', with the element and the line (Ka, Kb, La, Lb, Ma).
+
+    Parameters
+    ----------
+    filename : string, optional
+        csv file with the columns element, atomic_number, line and energy_keV,
+        by default the bundled xray_lines.csv
+    """
+
+    def __init__(self, filename=XRAY_LINES_FILE):
+        elements, atomic_numbers, lines, energies = [], [], [], []
+        with open(filename, "r", encoding="utf-8") as f:
+            for row in f:
+                if row.startswith("#") or row.startswith("element") or not row.strip():
+                    continue
+                element, atomic_number, line, energy = row.strip().split(",")
+                elements.append(element)
+                atomic_numbers.append(int(atomic_number))
+                lines.append(line)
+                energies.append(float(energy))
+
+        # everything is sorted by energy, which the binary search needs
+        order = np.argsort(energies, kind="stable")
+        self.energy = np.array(energies)[order]
+        self.element = np.array(elements)[order]
+        self.atomic_number = np.array(atomic_numbers)[order]
+        self.line = np.array(lines)[order]
+        self.name = np.char.add(np.char.add(self.element, "-"), self.line)
+        self._energy_of_name = dict(zip(self.name.tolist(), self.energy.tolist()))
+
+    def __len__(self):
+        return len(self.energy)
+
+    def energy_of(self, names):
+        """
+        The energy of lines given by name.
+
+        Parameters
+        ----------
+        names : string or list of string
+            eg "Cu-Ka" or ["Cu-Ka", "Cu-La"]
+
+        Returns
+        -------
+        float or list of float
+            energies [keV]
+        """
+        if isinstance(names, str):
+            if names not in self._energy_of_name:
+                raise KeyError(f"The line {names} is not in the table, the names are like 'Cu-Ka'")
+            return self._energy_of_name[names]
+        return [self.energy_of(name) for name in names]
+
+    def lines_of(self, element):
+        """The names and energies of all lines of an element, eg 'Fe'."""
+        is_element = self.element == element
+        return self.name[is_element].tolist(), self.energy[is_element].tolist()
+
+    def subset(self, elements):
+        """
+        An index with only the lines of some elements, eg the elements known to be in the sample.
+        Avoids matching a peak with a line of an element which is not there, eg Cu-Kb with Os-La.
+
+        Parameters
+        ----------
+        elements : list of string
+            eg ["Cu", "Fe"]
+
+        Returns
+        -------
+        XrayLineIndex
+            the smaller index, still sorted by energy
+        """
+        keep = np.isin(self.element, elements)
+        index = copy.copy(self)
+        for key in ("energy", "element", "atomic_number", "line", "name"):
+            setattr(index, key, getattr(self, key)[keep])
+        index._energy_of_name = dict(zip(index.name.tolist(), index.energy.tolist()))
+        return index
+
+    def lines_near(self, energy, tolerance):
+        """
+        All lines from energy - tolerance to energy + tolerance, eg within the FWHM of a peak.
+
+        Parameters
+        ----------
+        energy : float
+            energy of the peak [keV]
+        tolerance : float
+            largest distance to a line [keV]
+
+        Returns
+        -------
+        tuple
+            the names and energies of the lines, sorted by distance to energy
+        """
+        start = np.searchsorted(self.energy, energy - tolerance, side="left")
+        stop = np.searchsorted(self.energy, energy + tolerance, side="right")
+        order = np.argsort(np.abs(self.energy[start:stop] - energy), kind="stable")
+        return self.name[start:stop][order].tolist(), self.energy[start:stop][order].tolist()
+
+    def match(self, energies, tolerance):
+        """
+        The closest line to each energy, for any number of energies at once.
+        Both neighbours in the sorted table of each energy are found with one searchsorted call,
+        and the closest one is used if it is within the tolerance.
+
+        Parameters
+        ----------
+        energies : np.array
+            energies of the peaks [keV], any shape, eg (n_spectra, n_peaks)
+        tolerance : float or np.array
+            largest distance [keV], one value or one per energy, eg the FWHM of each peak
+
+        Returns
+        -------
+        dict
+            with the same shape as energies:
+            index (in the table, -1 if no line is close enough), name ("" if none), energy_keV (nan if none),
+            distance_keV (energy - the line) and n_candidates (the number of lines within the tolerance)
+        """
+        if len(self) == 0:
+            raise ValueError("There are no lines in the index to match with")
+        energies = np.asarray(energies, dtype=np.float64)
+        tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.float64), energies.shape)
+
+        # the line above and the line below each energy
+        above = np.clip(np.searchsorted(self.energy, energies), 1, len(self.energy) - 1)
+        below = above - 1
+        closest = np.where(
+            np.abs(self.energy[above] - energies) < np.abs(self.energy[below] - energies), above, below
+        )
+        distance = energies - self.energy[closest]
+        found = np.abs(distance) <= tolerance
+
+        # the number of lines within the tolerance, as two more searchsorted calls on all energies
+        n_candidates = np.searchsorted(self.energy, energies + tolerance, side="right") - np.searchsorted(
+            self.energy, energies - tolerance, side="left"
+        )
+
+        return {
+            "index": np.where(found, closest, -1),
+            "name": np.where(found, self.name[closest], ""),
+            "energy_keV": np.where(found, self.energy[closest], np.nan),
+            "distance_keV": np.where(found, distance, np.nan),
+            "n_candidates": n_candidates,
+        }
+
+
+def default_line_index():
+    """The index of the bundled xray_lines.csv, loaded once and shared."""
+    global _default_index
+    if _default_index is None:
+        _default_index = XrayLineIndex()
+    return _default_index
+
+
+def identify_peaks(s, tolerance=None, elements=None, index=None):
+    """
+    Names the fitted peaks of a calibrated spectrum with the closest X-ray line.
+    Sets s['peaks_keV'] to the energies of the lines and s['peaks_names'] to their names,
+    so the spectrum can be calibrated against them, or plotted with the names.
+
+    Parameters
+    ----------
+    s : dict
+        spectrum dictionary with fit_params, dispersion and offset
+    tolerance : float or np.array, optional
+        largest distance to a line [keV], by default None which uses the FWHM of each fitted peak
+    elements : list of string, optional
+        only use the lines of these elements, by default None which uses all
+    index : XrayLineIndex, optional
+        the lines to search, by default the bundled table
+
+    Returns
+    -------
+    dict
+        the match of each peak, see XrayLineIndex.match
+    """
+    # imported here, to not import quantification.py when only the index is used
+    from helper_files.quantification import FWHM_PER_STD
+
+    if index is None:
+        index = default_line_index()
+    if elements is not None:
+        index = index.subset(elements)
+    calibration = Calibration.from_spectrum(s)
+    fit_params = np.asarray(s["fit_params"], dtype=np.float64)
+    centroid = calibration.to_keV(fit_params[1::3])
+    if tolerance is None:
+        tolerance = np.abs(fit_params[2::3]) * FWHM_PER_STD * calibration.derivative(fit_params[1::3])
+
+    match = index.match(centroid, tolerance)
+    # peaks without a line close enough keep their fitted energy, and get no name
+    s["peaks_keV"] = np.where(match["index"] >= 0, match["energy_keV"], centroid).tolist()
+    s["peaks_names"] = match["name"].tolist()
+    return match
+
+
+def header_label_lines(header, tolerance=0.02, index=None):
+    """
+    The lines of the labels the instrument has put in the header, eg '##OXINSTLABEL: 26, 6.404, Fe'.
+    The energy of each label is matched with the lines of the same element.
+
+    Parameters
+    ----------
+    header : dict
+        header dictionary from read_header, or s['header']
+    tolerance : float, optional
+        largest difference between the label and the line [keV], by default 0.02
+    index : XrayLineIndex, optional
+        the lines to search, by default the bundled table
+
+    Returns
+    -------
+    tuple
+        peaks_keV and peaks_names of the labels found in the table, sorted by energy
+    """
+    if index is None:
+        index = default_line_index()
+    peaks = {}
+    for _, energy, element in header.get("labels", []):
+        names, energies = index.lines_near(energy, tolerance)
+        for name, line_energy in zip(names, energies):
+            if name.split("-")[0] == element:
+                peaks[name] = line_energy
+                break
+    names = sorted(peaks, key=peaks.get)
+    return [peaks[name] for name in names], names